@@ -0,0 +1,114 @@
+""" Benchmark of broadcasting a sketch event to websocket subscribers.
+
+Times sending the same message to a number of open connections, each
+encoding and framing it separately (as every subscriber did before)
+and with WebSocketRuntime.broadcast, which encodes and frames it once.
+Connections are autobahn protocols writing to a transport which
+discards the data.
+
+Run from the repository root:
+
+	python -m benchmarks.broadcast [--subscribers 1,10,100,1000] [--messages 1000] [--deflate]
+"""
+
+# Python Imports
+import time
+import argparse
+
+# Twisted Imports
+from twisted.internet.testing import StringTransport
+
+# Autobahn Imports
+from autobahn.twisted.websocket import WebSocketServerFactory
+from autobahn.websocket.compress import PerMessageDeflate
+
+# Package Imports
+from server.websocket import WebSocketRuntime, OctopusEditorProtocol
+
+
+class NullTransport (StringTransport):
+	def __init__ (self):
+		StringTransport.__init__(self)
+		self.written = 0
+
+	def write (self, data):
+		self.written += len(data)
+
+
+def makeConnections (runtime, count, deflate):
+	factory = WebSocketServerFactory("ws://localhost:8001")
+	factory.protocol = OctopusEditorProtocol
+	factory.runtime = runtime
+	connections = []
+
+	for i in range(count):
+		protocol = factory.buildProtocol(None)
+		protocol.makeConnection(NullTransport())
+		protocol.state = protocol.STATE_OPEN
+		protocol.websocket_version = 18
+		protocol._perMessageCompress = PerMessageDeflate(True, False, False, 15, 15, 8) if deflate else None
+		protocol.onOpen()
+		connections.append(protocol)
+
+	return connections
+
+def makePayload ():
+	return {
+		"sketch": "0f3c5b7e9a1d4e2b8c6f0a1b2c3d4e5f",
+		"event": 1234,
+		"block": "nJ2#tM8@kq]Yb?4Zt1Lx",
+		"type": "math_arithmetic",
+		"fields": { "OP": "ADD" },
+		"x": 102.5,
+		"y": 48,
+		"mutation": None,
+		"inputs": ["A", "B"]
+	}
+
+def perSubscriber (runtime, connections, messages):
+	payload = makePayload()
+
+	for i in range(messages):
+		for connection in connections:
+			runtime.send("block", "created", payload, connection)
+
+def shared (runtime, connections, messages):
+	payload = makePayload()
+
+	for i in range(messages):
+		runtime.broadcast("block", "created", payload, connections)
+
+def timed (fn, *args):
+	start = time.process_time()
+	fn(*args)
+
+	return time.process_time() - start
+
+def main ():
+	parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+	parser.add_argument("--subscribers", default = "1,10,100,1000")
+	parser.add_argument("--messages", type = int, default = 1000)
+	parser.add_argument("--deflate", action = "store_true")
+	args = parser.parse_args()
+
+	runtime = WebSocketRuntime()
+
+	print ("{:>12s}  {:>16s}  {:>16s}  {:>8s}".format(
+		"subscribers", "per-subscriber", "broadcast", "speedup"
+	))
+
+	for count in [int(n) for n in args.subscribers.split(",")]:
+		connections = makeConnections(runtime, count, args.deflate)
+		before = timed(perSubscriber, runtime, connections, args.messages)
+		after = timed(shared, runtime, connections, args.messages)
+
+		# CPU time per message per subscriber, in microseconds
+		scale = 1e6 / (args.messages * count)
+
+		print ("{:>12d}  {:>13.2f} us  {:>13.2f} us  {:>7.1f}x".format(
+			count, before * scale, after * scale, before / after
+		))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,157 @@
+""" Benchmark of evaluating a condition made of pure blocks.
+
+Builds a balanced expression tree of math_arithmetic (and math_single)
+blocks under a logic_compare, with math_number and lexical_variable_get
+leaves, and connects it to the CONDITION input of a controls_wait_until
+block. Then times getInputValue("CONDITION"):
+
+* through Deferreds, with every block treated as impure, so that each
+  block gathers the values of its inputs before calculating its own
+  (as every block did before evalSync);
+* with evalSync, which evaluates the tree block by block in one
+  synchronous call; and
+* with the tree compiled to a Python function (see
+  server/runtime/compiler.py), which evalSync calls by default.
+
+Variables are stand-ins with a fixed value. server.runtime.workspace
+enables Deferred debugging, which makes each Deferred much more costly;
+pass --no-debug to measure without it.
+
+Run from the repository root:
+
+	python -m benchmarks.conditions [--nodes 50] [--evaluations 1000] [--no-debug]
+"""
+
+# Python Imports
+import time
+import argparse
+
+# Twisted Imports
+from twisted.internet import defer
+
+# Package Imports
+from server.runtime.workspace import Workspace, Block
+
+
+class StandInVariable (object):
+	type = float
+
+	def __init__ (self, value):
+		self.value = value
+
+
+def makeCondition (nodes):
+	""" Returns a controls_wait_until block whose condition has the
+	given number of blocks. """
+
+	workspace = Workspace()
+	ids = iter(range(nodes + 1))
+
+	for i in range(4):
+		workspace.variables["global.global::v{:d}".format(i)] = StandInVariable(i + 1.5)
+
+	def add (type, **fields):
+		id = "b{:d}".format(next(ids))
+		workspace.addBlock(id, type, fields)
+
+		return id
+
+	def connect (id, parent, input):
+		workspace.connectBlock(id, parent, "input-value", input)
+
+	def split (size):
+		# Both halves are odd if possible
+		left = size // 2
+
+		return left - 1 if left % 2 == 0 and left > 1 else left
+
+	def tree (size, depth = 0):
+		if size == 1:
+			if depth % 2:
+				return add("lexical_variable_get", VAR = "global.global::v{:d}".format(depth % 4))
+			else:
+				return add("math_number", NUM = str(depth + 1))
+
+		# A tree of blocks with two inputs has an odd number of blocks
+		if size % 2 == 0:
+			id = add("math_single", OP = "ABS")
+			connect(tree(size - 1, depth + 1), id, "NUM")
+
+			return id
+
+		id = add("math_arithmetic", OP = ["ADD", "MULTIPLY", "MINUS"][depth % 3])
+		left = split(size - 1)
+		connect(tree(left, depth + 1), id, "A")
+		connect(tree(size - 1 - left, depth + 1), id, "B")
+
+		return id
+
+	root = add("logic_compare", OP = "GT")
+	left = split(nodes - 1)
+	connect(tree(left, 1), root, "A")
+	connect(tree(nodes - 1 - left, 2), root, "B")
+
+	block = workspace.allBlocks[add("controls_wait_until")]
+	connect(root, block.id, "CONDITION")
+
+	return block
+
+def evaluate (block, evaluations):
+	results = []
+
+	for i in range(evaluations):
+		block.getInputValue("CONDITION").addCallback(results.append)
+
+	return results
+
+def timed (fn, *args):
+	start = time.perf_counter()
+	result = fn(*args)
+
+	return time.perf_counter() - start, result
+
+def main ():
+	parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+	parser.add_argument("--nodes", type = int, default = 50)
+	parser.add_argument("--evaluations", type = int, default = 1000)
+	parser.add_argument("--no-debug", action = "store_true")
+	args = parser.parse_args()
+
+	if args.no_debug:
+		defer.Deferred.debug = False
+
+	block = makeCondition(args.nodes)
+	isPure = Block.isPure
+	timings = []
+
+	for label, pure, compiled in [
+		("deferred", False, False),
+		("evalSync", True, False),
+		("compiled", True, True)
+	]:
+		Block.compileExpressions = compiled
+
+		if not pure:
+			Block.isPure = lambda self: False
+
+		try:
+			timings.append((label,) + timed(evaluate, block, args.evaluations))
+		finally:
+			Block.isPure = isPure
+
+	assert all(results == timings[0][2] for label, seconds, results in timings)
+
+	print ("{:d}-block condition, {:d} evaluations, Deferred debugging {:s}".format(
+		args.nodes, args.evaluations, "on" if defer.Deferred.debug else "off"
+	))
+
+	for label, seconds, results in timings:
+		print ("{:>10s}  {:>12,.0f} evaluations/s  {:>8.1f} us each  {:>7.1f}x".format(
+			label,
+			args.evaluations / seconds,
+			seconds / args.evaluations * 1e6,
+			timings[0][1] / seconds
+		))
+
+if __name__ == "__main__":
+	main()
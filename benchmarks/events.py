@@ -0,0 +1,229 @@
+""" Microbenchmarks of EventEmitter.
+
+Times the operations that blocks, workspaces and Variables instances
+perform most often:
+
+* emit, to one or several listeners, with and without "all" listeners;
+* emit of an event that nobody listens to;
+* on / off of one listener alongside many others (as the scheduler does
+  for each block it waits on); and
+* churn: a listener added and removed on every emit.
+
+with the previous implementation (lists of listeners, reproduced below)
+and with EventEmitter.
+
+Run from the repository root:
+
+	python -m benchmarks.events [--iterations 100000] [--listeners 100]
+"""
+
+# Python Imports
+import time
+import argparse
+import functools
+
+# Twisted Imports
+from twisted.python import log
+
+# Package Imports
+from server.util import EventEmitter
+
+
+class ListEventEmitter (object):
+	""" The previous implementation of EventEmitter. """
+
+	def on (self, name, function = None):
+		def _on (function):
+			try:
+				self._events[name]
+			except (TypeError, AttributeError):
+				self._events = {}
+				self._events[name] = []
+			except KeyError:
+				self._events[name] = []
+
+			# Use is instead of in to avoid equality comparison
+			for f in self._events[name]:
+				if function is f:
+					return function
+
+			self._events[name].append(function)
+
+			return function
+
+		if function is None:
+			return _on
+		else:
+			return _on(function)
+
+	def once (self, name, function = None):
+		def _once (function):
+			@functools.wraps(function)
+			def g (*args, **kwargs):
+				function(*args, **kwargs)
+				self.off(name, g)
+
+			return g
+
+		if function is None:
+			return lambda function: self.on(name, _once(function))
+		else:
+			self.on(name, _once(function))
+
+	def off (self, name = None, function = None):
+		try:
+			self._events
+		except AttributeError:
+			return
+
+		# If no name is passed, remove all handlers
+		if name is None:
+			self._events.clear()
+
+		# If no function is passed, remove all functions
+		elif function is None:
+			try:
+				self._events[name] = []
+			except KeyError:
+				pass
+
+		# Remove handler [function] from [name]
+		else:
+			self._events[name].remove(function)
+
+	def listeners (self, event):
+		try:
+			return self._events[event]
+		except (AttributeError, KeyError):
+			return []
+
+	def emit (self, _event, **data):
+		handled = False
+
+		try:
+			events = self._events[_event][:]
+		except AttributeError:
+			return False # No events defined yet
+		except KeyError:
+			pass
+		else:
+			handled |= bool(len(events))
+
+			for function in events:
+				try:
+					function(data)
+				except:
+					log.err()
+
+		try:
+			events = self._events["all"][:]
+		except KeyError:
+			pass
+		else:
+			handled |= bool(len(events))
+
+			for function in events:
+				try:
+					function(_event, data)
+				except:
+					log.err()
+
+		return handled
+
+
+def listener (data):
+	pass
+
+def makeListeners (count):
+	# Distinct functions, as registered by separate blocks
+	return [lambda data: None for i in range(count)]
+
+def emitOne (cls, iterations, listeners):
+	emitter = cls()
+	emitter.on("value-changed", listener)
+
+	for i in range(iterations):
+		emitter.emit("value-changed", value = i)
+
+def emitMany (cls, iterations, listeners):
+	emitter = cls()
+
+	for function in makeListeners(10):
+		emitter.on("value-changed", function)
+
+	for i in range(iterations):
+		emitter.emit("value-changed", value = i)
+
+def emitWithAll (cls, iterations, listeners):
+	emitter = cls()
+	emitter.on("value-changed", listener)
+	emitter.on("all", lambda event, data: None)
+
+	for i in range(iterations):
+		emitter.emit("value-changed", value = i)
+
+def emitUnheard (cls, iterations, listeners):
+	emitter = cls()
+	emitter.on("connectivity-changed", listener)
+
+	for i in range(iterations):
+		emitter.emit("value-changed", value = i)
+
+def onOff (cls, iterations, listeners):
+	emitter = cls()
+
+	for function in makeListeners(listeners):
+		emitter.on("connectivity-changed", function)
+
+	for i in range(iterations):
+		emitter.on("connectivity-changed", listener)
+		emitter.off("connectivity-changed", listener)
+
+def churn (cls, iterations, listeners):
+	emitter = cls()
+
+	for function in makeListeners(listeners):
+		emitter.on("value-changed", function)
+
+	for i in range(iterations):
+		emitter.on("value-changed", listener)
+		emitter.emit("value-changed", value = i)
+		emitter.off("value-changed", listener)
+
+def timed (fn, *args):
+	start = time.perf_counter()
+	fn(*args)
+
+	return time.perf_counter() - start
+
+def main ():
+	parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+	parser.add_argument("--iterations", type = int, default = 100000)
+	parser.add_argument("--listeners", type = int, default = 100)
+	args = parser.parse_args()
+
+	print ("{:>24s}  {:>12s}  {:>12s}  {:>8s}".format(
+		"", "list", "dict", "speedup"
+	))
+
+	for label, fn, iterations in [
+		("emit, 1 listener", emitOne, args.iterations),
+		("emit, 10 listeners", emitMany, args.iterations),
+		("emit, with \"all\"", emitWithAll, args.iterations),
+		("emit, no listeners", emitUnheard, args.iterations),
+		("on / off", onOff, args.iterations // 10),
+		("on / emit / off", churn, args.iterations // 100)
+	]:
+		before = timed(fn, ListEventEmitter, iterations, args.listeners)
+		after = timed(fn, EventEmitter, iterations, args.listeners)
+
+		# Time per operation, in nanoseconds
+		scale = 1e9 / iterations
+
+		print ("{:>24s}  {:>9.0f} ns  {:>9.0f} ns  {:>7.1f}x".format(
+			label, before * scale, after * scale, before / after
+		))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,130 @@
+""" Benchmark of the experiment data export.
+
+Writes a multi-variable experiment to a temporary directory, then times
+the generation of the exported table with the previous pandas
+implementation (groupby with a per-row format_time function, reproduced
+below) and with the streaming export in server.export, for each of the
+aggregation options.
+
+Run from the repository root:
+
+	python -m benchmarks.export [--rows 1000000] [--variables 4] [--time-divisor 1] [--time-dp 0]
+"""
+
+# Python Imports
+import time
+import shutil
+import argparse
+import tempfile
+
+# NumPy
+import numpy as np
+
+# Twisted Imports
+from twisted.python.filepath import FilePath
+
+# Package Imports
+from server import datalog, export
+
+
+def makeExperiment (directory, rows, variables, seed = 0):
+	""" Write CSV logs for a number of variables, sampled at
+	interleaved times, which together make rows distinct times. """
+
+	random = np.random.RandomState(seed)
+	times = np.arange(rows) * 0.01
+	owners = random.randint(0, variables, rows)
+	files = []
+
+	for index in range(variables):
+		dataFile = directory.child("var{:d}".format(index))
+		log = datalog.CSVVariableLog(dataFile, "var{:d}".format(index), "float", 0)
+		selected = times[owners == index]
+		values = np.cumsum(random.normal(0, 1, len(selected)))
+
+		for t, value in zip(selected.tolist(), values.tolist()):
+			log.write(t, value)
+
+		log.close()
+		files.append(dataFile)
+
+	return files
+
+def pandasExport (files, time_divisor, time_dp):
+	""" The previous implementation, without the Excel output. """
+
+	import pandas as pd
+
+	cols = [
+		pd.read_csv(
+			f.path,
+			comment = '#',
+			index_col = 0,
+			usecols = [0, 1],
+			names = ["Time", f.basename()]
+		)
+		for f in files
+	]
+
+	dataframe = pd.concat(cols, axis = 1)
+	dataframe = dataframe.ffill()
+
+	def format_time (x):
+		if x != "":
+			return round(float(x) / time_divisor, time_dp)
+
+	return len(dataframe.groupby(format_time).first())
+
+def streamingExport (files, time_divisor, time_dp, aggregate):
+	rows = export.bucketRows(
+		export.mergeBlocks([datalog.iterCSV(f, float) for f in files]),
+		time_divisor,
+		time_dp,
+		aggregate
+	)
+
+	return sum(1 for row in rows)
+
+def timed (fn, *args):
+	start = time.perf_counter()
+	result = fn(*args)
+
+	return time.perf_counter() - start, result
+
+def main ():
+	parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+	parser.add_argument("--rows", type = int, default = 1000000)
+	parser.add_argument("--variables", type = int, default = 4)
+	parser.add_argument("--time-divisor", type = int, default = 1)
+	parser.add_argument("--time-dp", type = int, default = 0)
+	args = parser.parse_args()
+
+	directory = FilePath(tempfile.mkdtemp())
+
+	try:
+		files = makeExperiment(directory, args.rows, args.variables)
+
+		try:
+			old_time, old_rows = timed(pandasExport, files, args.time_divisor, args.time_dp)
+		except ImportError:
+			old_time, old_rows = None, None
+			print ("pandas is not installed; skipping the previous implementation")
+		else:
+			print ("{:>20s}  {:>8.3f}s  {:>8d} rows".format("pandas (before)", old_time, old_rows))
+
+		for aggregate in export.aggregations:
+			new_time, new_rows = timed(streamingExport, files, args.time_divisor, args.time_dp, aggregate)
+
+			print ("{:>20s}  {:>8.3f}s  {:>8d} rows  {:>8s}".format(
+				"streaming " + aggregate,
+				new_time,
+				new_rows,
+				"{:.1f}x".format(old_time / new_time) if old_time is not None else "-"
+			))
+
+	finally:
+		shutil.rmtree(directory.path)
+
+
+if __name__ == "__main__":
+	main()
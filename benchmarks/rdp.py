@@ -0,0 +1,117 @@
+""" Benchmark of the series simplification used for experiment results.
+
+Compares the vectorised, stack-based rdp() in server.experiment with the
+previous recursive pure-Python implementation (reproduced below).
+
+Run from the repository root:
+
+	python -m benchmarks.rdp [--sizes 10000,1000000,10000000] [--max-baseline 1000000]
+"""
+
+# Python Imports
+import sys
+import time
+import argparse
+from math import sqrt
+
+# NumPy
+import numpy as np
+
+# Package Imports
+from server.experiment import rdp
+
+
+def distance (a, b):
+	return sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
+
+def point_line_distance (point, start, end):
+	if (start == end):
+		return distance(point, start)
+	else:
+		n = abs(
+			(end[0] - start[0]) * (start[1] - point[1]) - (start[0] - point[0]) * (end[1] - start[1])
+		)
+		d = sqrt(
+			(end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2
+		)
+		return n / d
+
+def rdp_recursive (points, epsilon):
+	""" The original list-slicing implementation. """
+	dmax = 0.0
+	index = 0
+	for i in range(1, len(points) - 1):
+		d = point_line_distance(points[i], points[0], points[-1])
+		if d > dmax:
+			index = i
+			dmax = d
+	if dmax >= epsilon:
+		results = rdp_recursive(points[:index+1], epsilon)[:-1] + rdp_recursive(points[index:], epsilon)
+	else:
+		results = [points[0], points[-1]]
+	return results
+
+
+def series (count, seed = 0):
+	""" A noisy random walk, sampled every 0.1 s """
+	random = np.random.RandomState(seed)
+	times = np.arange(count) * 0.1
+	values = np.cumsum(random.normal(0, 1, count))
+
+	return times, values
+
+def epsilon (times, values):
+	# Same tolerance as CompletedExperiment._getData
+	interval = times[-1] - times[0]
+	spread = values.max() - values.min()
+
+	return min(interval / 200., spread / 50.)
+
+def timed (fn, *args):
+	start = time.perf_counter()
+	result = fn(*args)
+
+	return time.perf_counter() - start, result
+
+def main ():
+	parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+	parser.add_argument("--sizes", default = "10000,1000000,10000000")
+	parser.add_argument("--max-baseline", type = int, default = 1000000,
+		help = "largest series to run through the recursive implementation")
+	args = parser.parse_args()
+
+	sys.setrecursionlimit(100000)
+
+	print ("{:>10s}  {:>12s}  {:>12s}  {:>8s}  {:>8s}".format(
+		"points", "recursive/s", "vectorised/s", "kept", "speedup"
+	))
+
+	for count in map(int, args.sizes.split(",")):
+		times, values = series(count)
+		eps = epsilon(times, values)
+
+		new_time, mask = timed(rdp, times, values, eps)
+
+		if count <= args.max_baseline:
+			points = list(zip(times.tolist(), values.tolist()))
+
+			try:
+				old_time, old_result = timed(rdp_recursive, points, eps)
+			except RecursionError:
+				old_time = None
+			else:
+				assert len(old_result) == mask.sum()
+		else:
+			old_time = None
+
+		print ("{:>10d}  {:>12s}  {:>12.3f}  {:>8d}  {:>8s}".format(
+			count,
+			"{:.3f}".format(old_time) if old_time is not None else "-",
+			new_time,
+			int(mask.sum()),
+			"{:.1f}x".format(old_time / new_time) if old_time is not None else "-"
+		))
+
+
+if __name__ == "__main__":
+	main()
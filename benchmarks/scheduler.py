@@ -0,0 +1,169 @@
+""" Benchmark of the workspace scheduler's dependency tracking.
+
+Builds a sketch of top blocks which each declare a global variable and
+reference a few variables declared by earlier blocks, then times:
+
+* running the sketch to completion: each finished block releases the
+  blocks waiting for its variables; and
+* connectivity changes: a block being connected to or disconnected
+  from the workspace while the others are waiting.
+
+with the previous implementation (a list of waiting blocks scanned
+on every event, reproduced below) and with DependencyIndex. Blocks are
+stand-ins which return fixed lists of names; real blocks walk their
+children to find these, which adds to the cost of the previous
+implementation's repeated recalculation.
+
+Run from the repository root:
+
+	python -m benchmarks.scheduler [--blocks 1000] [--references 3] [--changes 100]
+"""
+
+# Python Imports
+import time
+import random
+import argparse
+
+# Package Imports
+from server.runtime.workspace import DependencyIndex
+
+
+class StandInBlock (object):
+	def __init__ (self, id, decls, deps):
+		self.id = id
+		self.decls = decls
+		self.deps = deps
+
+	def getGlobalDeclarationNames (self):
+		return list(self.decls)
+
+	def getUnmatchedVariableNames (self):
+		return list(self.deps)
+
+
+def makeBlocks (count, references, seed = 0):
+	generator = random.Random(seed)
+	blocks = []
+
+	for index in range(count):
+		deps = set(
+			"v{:d}".format(generator.randrange(index))
+			for i in range(min(index, references))
+		)
+		blocks.append(StandInBlock(index, ["v{:d}".format(index)], deps))
+
+	return blocks
+
+def listRun (blocks):
+	""" The previous implementation of _blockComplete. """
+
+	dependencyGraph = []
+	queue = []
+
+	for block in blocks:
+		deps = set(block.getUnmatchedVariableNames())
+
+		if len(deps) == 0:
+			queue.append(block)
+		else:
+			dependencyGraph.append({ "block": block, "deps": deps })
+
+	completed = 0
+
+	while len(queue):
+		block = queue.pop(0)
+		decls = block.getGlobalDeclarationNames()
+		completed += 1
+
+		toRun = []
+		for item in dependencyGraph:
+			for decl in decls:
+				item["deps"].discard(decl)
+
+			if len(item["deps"]) == 0:
+				toRun.append(item)
+
+		for item in toRun:
+			dependencyGraph.remove(item)
+			queue.append(item["block"])
+
+	return completed
+
+def indexRun (blocks):
+	dependencyGraph = DependencyIndex()
+	queue = []
+
+	for block in blocks:
+		deps = block.getUnmatchedVariableNames()
+
+		if len(deps) == 0:
+			queue.append(block)
+		else:
+			dependencyGraph.add(block, deps)
+
+	completed = 0
+
+	while len(queue):
+		block = queue.pop(0)
+		completed += 1
+		queue.extend(dependencyGraph.declare(block.getGlobalDeclarationNames()))
+
+	return completed
+
+def listChanges (blocks, changes):
+	""" The previous _updateDependencyGraph, called for every
+	top-block-added / top-block-removed event. """
+
+	dependencyGraph = [
+		{ "block": block, "deps": set(block.getUnmatchedVariableNames()) }
+		for block in blocks if len(block.deps)
+	]
+
+	for i in range(changes):
+		for item in dependencyGraph:
+			item['deps'] = set(item['block'].getUnmatchedVariableNames())
+
+def indexChanges (blocks, changes):
+	dependencyGraph = DependencyIndex()
+	waiting = [block for block in blocks if len(block.deps)]
+
+	for block in waiting:
+		dependencyGraph.add(block, block.getUnmatchedVariableNames())
+
+	# Only the block whose connections changed is updated
+	for i in range(changes):
+		block = waiting[i % len(waiting)]
+		dependencyGraph.add(block, block.getUnmatchedVariableNames())
+
+def timed (fn, *args):
+	start = time.perf_counter()
+	fn(*args)
+
+	return time.perf_counter() - start
+
+def main ():
+	parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+	parser.add_argument("--blocks", type = int, default = 1000)
+	parser.add_argument("--references", type = int, default = 3)
+	parser.add_argument("--changes", type = int, default = 100)
+	args = parser.parse_args()
+
+	blocks = makeBlocks(args.blocks, args.references)
+
+	assert listRun(blocks) == indexRun(blocks) == len(blocks)
+
+	for label, before, after in [
+		("run to completion", timed(listRun, blocks), timed(indexRun, blocks)),
+		(
+			"{:d} connectivity changes".format(args.changes),
+			timed(listChanges, blocks, args.changes),
+			timed(indexChanges, blocks, args.changes)
+		)
+	]:
+		print ("{:>26s}  list {:>9.2f} ms  index {:>9.2f} ms  {:>7.1f}x".format(
+			label, before * 1e3, after * 1e3, before / after
+		))
+
+
+if __name__ == "__main__":
+	main()
@@ -14,18 +14,28 @@ jQuery(function ($) {
   var socketOpen = false;
   var socketUrl = $('#viewer').data('url');
   var socket = new WebSocket(socketUrl, "octopus");
+  socket.binaryType = "arraybuffer";
 
-  properties.updateFrequency = 1000;
-  streams.updateFrequency = 1000;
+  // Interval (ms) at which the server pushes new data
+  var updateFrequency = 1000;
 
   socket.onopen = function () {
     console.log("Socket open");
     socketOpen = true;
+    _socketSend("runtime", "getruntime", {
+      capabilities: ["encoding:binary-streams"]
+    });
     _socketSend("experiment", "load", {});
   };
 
   socket.onmessage = function (e) {
-    var data = JSON.parse(e.data);
+    var data;
+
+    if (e.data instanceof ArrayBuffer) {
+      data = { protocol: "experiment", command: "streams", payload: decodeStreams(e.data) };
+    } else {
+      data = JSON.parse(e.data);
+    }
 
     var protocol = data.protocol;
     var command = data.command;
@@ -70,15 +80,6 @@ jQuery(function ($) {
       for (i = 0, m = graphs.length; i < m; i++) {
         graphs[i].addData(payload.data);
       }
-
-      // Schedule next request
-      if (!payload.oneoff) {
-        window.clearTimeout(streams.updateTimer);
-        streams.updateTimer = window.setTimeout(
-          streams.request,
-          streams.updateFrequency
-        );
-      }
       return;
     }
 
@@ -98,12 +99,11 @@ jQuery(function ($) {
           }
         }
       });
+      return;
+    }
 
-      window.clearTimeout(properties.updateTimer);
-      properties.updateTimer = window.setTimeout(
-        properties.request,
-        properties.updateFrequency
-      );
+    if (command === "subscribed") {
+      updateFrequency = payload.interval * 1000;
       return;
     }
 
@@ -134,46 +134,72 @@ jQuery(function ($) {
     properties.changed();
   };
 
-  properties.changed = function () {
-    _socketSend("experiment", "choose-properties", {
-      properties: properties
-    });
-
-    properties.request();
-  };
-
-  properties.request = function () {
-    if (properties.length > 0) {
-      _socketSend("experiment", "get-properties", {});
-    }
-  };
-
-  streams.changed = function () {
+  // The server pushes new stream data and changed property values
+  // once subscribed, so only changes to the selection are sent.
+  function subscribe () {
     var streamNames = _(graphs).map('streams').flatten().uniq().value();
 
-    _socketSend("experiment", "choose-streams", {
-      streams: streamNames
-    });
-
     streams.length = streamNames.length;
-    streams.request();
-  };
 
-  streams.request = function () {
-    var start;
+    _socketSend("experiment", "subscribe", {
+      streams: streamNames,
+      properties: properties,
+      interval: updateFrequency / 1000
+    });
+  }
 
-    if (!streams.lastRequest) {
-      start = +(new Date()) - 60 * 1000;
-      streams.lastRequest = start;
-    } else {
-      start = streams.lastRequest;
-      streams.lastRequest = +(new Date());
+  properties.changed = subscribe;
+  streams.changed = subscribe;
+
+  // Decode a binary streams frame (packed by _packStreams in
+  // server/protocol/experiment.py) into a "streams" payload.
+  function decodeStreams (buffer) {
+    var view = new DataView(buffer);
+    var decoder = new TextDecoder("utf-8");
+    var offset = 20;
+    var i, j, n, name, times, values, points;
+
+    function readString () {
+      var length = view.getUint16(offset, true);
+      var value = decoder.decode(new Uint8Array(buffer, offset + 2, length));
+      offset += 2 + length;
+      return value;
     }
 
-    if (streams.length > 0) {
-      _socketSend("experiment", "get-streams", { start: start / 1000 });
+    var flags = view.getUint8(1);
+    var count = view.getUint16(2, true);
+    var payload = {
+      zero: view.getFloat64(4, true),
+      max: view.getFloat64(12, true),
+      oneoff: (flags & 1) !== 0,
+      push: (flags & 2) !== 0,
+      data: []
+    };
+
+    payload.sketch = readString();
+    payload.experiment = readString();
+
+    for (i = 0; i < count; i++) {
+      name = readString();
+      n = view.getUint32(offset, true);
+      offset += 4;
+
+      // Copied, as typed arrays must be aligned to their element size
+      times = new Float32Array(buffer.slice(offset, offset + 4 * n));
+      offset += 4 * n;
+      values = new Float64Array(buffer.slice(offset, offset + 8 * n));
+      offset += 8 * n;
+
+      points = new Array(n);
+      for (j = 0; j < n; j++) {
+        points[j] = [times[j], values[j]];
+      }
+
+      payload.data.push({ name: name, data: points });
     }
-  };
+
+    return payload;
+  }
 
   function _socketSend (protocol, command, payload) {
     if (!socketOpen) {
@@ -79,6 +79,10 @@ jQuery(function ($) {
       if (command === 'renamed') {
         return sketchRenamed(payload.title);
       }
+
+      if (command === 'validate') {
+        return sketchValidated(payload);
+      }
     }
 
     if (protocol === 'block' && payload.sketch == sketchId) {
@@ -149,6 +153,38 @@ jQuery(function ($) {
     });
   }
 
+  // Mark blocks with undefined variables or circular dependencies
+  function sketchValidated (result) {
+    var workspace = Blockly.getMainWorkspace();
+    var warnings = {};
+
+    function warn (id, text) {
+      warnings[id] = (warnings[id] ? warnings[id] + "\n" : "") + text;
+    }
+
+    result.undefined.forEach(function (item) {
+      warn(item.block, "Variable " + item.variable + " is never defined.");
+    });
+
+    result.cycles.forEach(function (cycle) {
+      cycle.forEach(function (item) {
+        warn(item.block, "Circular dependency: " + item.declares.join(", ") + " depends on " + item.depends.join(", "));
+      });
+    });
+
+    workspace.getTopBlocks().forEach(function (block) {
+      block.setWarningText(warnings[block.id] || null);
+    });
+
+    if (!result.runnable) {
+      console.warn("No blocks can run.");
+    }
+
+    $('#btn-validate')
+      .toggleClass('btn-success', result.valid)
+      .toggleClass('btn-danger', !result.valid);
+  }
+
   function experimentAction (action) {
     _socketSend("experiment", action, {
       sketch: sketchId
@@ -286,6 +322,15 @@ jQuery(function ($) {
         return block.setRunningState(payload.state);
       }
     }
+    if (command === "states") {
+      payload.states.forEach(function (change) {
+        var block = workspace.getBlockById(change.block);
+        if (block) {
+          block.setRunningState(change.state);
+        }
+      });
+      return;
+    }
 
     block = workspace.getBlockById(payload.id);
     if (!block) {
@@ -465,6 +510,12 @@ jQuery(function ($) {
     experimentAction("run");
   });
 
+  $('#btn-validate').click(function () {
+    _socketSend("sketch", "validate", {
+      sketch: sketchId
+    });
+  });
+
   $('#btn-pause').click(function () {
     experimentAction("pause");
   });
@@ -0,0 +1,35 @@
+import sys
+from os.path import join, dirname
+
+from twisted.python import log
+from twisted.python.filepath import FilePath
+
+from .datalog import convertExperimentDir
+
+def convertdata (dir, removeCSV = False):
+	print ("Converting experiment data in " + dir)
+
+	for path in FilePath(dir).walk():
+		if path.basename() != "variables" or not path.isfile():
+			continue
+
+		experimentDir = path.parent()
+		converted = convertExperimentDir(experimentDir, removeCSV)
+
+		if converted > 0:
+			print ("  {:s}: {:d} variables".format(experimentDir.basename(), converted))
+
+# By default, convert experiments in the ../data/experiments directory.
+# Usage: python -m server.convertdata [--remove-csv] [dir]
+if __name__ == "__main__":
+	# Variables which cannot be converted are reported to the log
+	log.startLogging(sys.stderr, setStdout = False)
+
+	args = sys.argv[1:]
+	removeCSV = "--remove-csv" in args
+	args = [a for a in args if a != "--remove-csv"]
+
+	if len(args):
+		convertdata(args[0], removeCSV)
+	else:
+		convertdata(join(dirname(dirname(__file__)), 'data', 'experiments'), removeCSV)
@@ -0,0 +1,640 @@
+# Python Imports
+import os
+import json
+import math
+import struct
+import itertools
+
+# Twisted Imports
+from twisted.python import log
+
+# NumPy
+import numpy as np
+
+
+#
+# Variable logs
+#
+# While an experiment runs, every change to a variable is appended to
+# a log for that variable. Logs are either CSV text files (the original
+# format, one "time, value" line per change) or binary chunk files.
+#
+# A binary log is a series of chunk files named <file>.<n>.bin. Each
+# chunk has a small fixed-size header followed by fixed-width records of
+# (float64 time, value). Records are only ever appended, so a partially
+# written record at the end of a chunk (e.g. after a crash) is simply
+# ignored when reading, and a complete chunk can be memory-mapped and
+# its time and value columns sliced without copying.
+#
+
+MAGIC = b"OCTOVAR1"
+
+# magic, value dtype, experiment start time, chunk number
+HEADER = struct.Struct("<8s8sdI4x")
+
+# Records per chunk file (16 MiB of float / int data)
+CHUNK_RECORDS = 2 ** 20
+
+# Variable types that can be stored in a binary log: dtype, record
+# packer, and the conversion applied to values before they are packed
+# (a variable's value need not keep the type it was declared with)
+_binaryTypes = {
+	"float": ("<f8", struct.Struct("<dd"), float),
+	"int": ("<i8", struct.Struct("<dq"), int),
+	"bool": ("|b1", struct.Struct("<d?"), bool),
+}
+
+
+# CSV logs have a sidecar index, <file>.idx, of (float64 time, int64
+# byte offset) records giving the position of the first line in each
+# INDEX_BUCKET seconds of data. Reads of a time window seek straight to
+# the bucket containing its start.
+INDEX_BUCKET = 10.
+INDEX_RECORD = np.dtype([("time", "<f8"), ("offset", "<i8")])
+_indexEntry = struct.Struct("<dq")
+
+# Numeric variables also have aggregate logs, <file>.<width>s.agg, of
+# (float64 bucket start, min, max, mean, int64 count) records for buckets
+# of each of AGGREGATE_WIDTHS seconds. Graphs of long time windows are
+# drawn from these rather than from the raw data.
+AGGREGATE_WIDTHS = (1, 10, 60, 600)
+AGGREGATE_RECORD = np.dtype([
+	("time", "<f8"),
+	("min", "<f8"),
+	("max", "<f8"),
+	("mean", "<f8"),
+	("count", "<i8")
+])
+_aggregateEntry = struct.Struct("<ddddq")
+
+
+def binaryFormatSupported (typeName):
+	return typeName in _binaryTypes
+
+def binaryChunkName (fileName, index):
+	return "{:s}.{:d}.bin".format(fileName, index)
+
+def aggregateFileName (fileName, width):
+	return "{:s}.{:d}s.agg".format(fileName, width)
+
+def _indexFileFor (dataFile):
+	return dataFile.siblingExtension(".idx")
+
+def _create (file, writer):
+	""" Create a log file, written through writer (a LogWriter) if given. """
+
+	if writer is None:
+		return file.create()
+
+	return writer.open(file)
+
+def _nextBucket (time):
+	return (math.floor(time / INDEX_BUCKET) + 1) * INDEX_BUCKET
+
+
+class CSVVariableLog (object):
+	""" Writes variable changes to a CSV text log. """
+
+	def __init__ (self, file, name, typeName, startTime, aggregates = None, writer = None):
+		header = "# name:{:s}\n# type:{:s} \n# start:{:.2f}\n".format(
+			name,
+			typeName,
+			startTime
+		).encode('utf-8')
+
+		self._fp = _create(file, writer)
+		self._fp.write(header)
+		self._index = _create(_indexFileFor(file), writer)
+		self._offset = len(header)
+		self._nextBucket = None
+		self._aggregates = aggregates
+
+	def write (self, time, value):
+		# Index by the time as written, so that the index agrees with
+		# the times read back from the file.
+		time = round(time, 2)
+		line = "{:.2f}, {:s}\n".format(time, str(value)).encode('utf-8')
+
+		if self._nextBucket is None or time >= self._nextBucket:
+			self._index.write(_indexEntry.pack(time, self._offset))
+			self._nextBucket = _nextBucket(time)
+
+		self._fp.write(line)
+		self._offset += len(line)
+
+		if self._aggregates is not None:
+			self._aggregates.write(time, value)
+
+	def flush (self):
+		self._fp.flush()
+		self._index.flush()
+
+		if self._aggregates is not None:
+			self._aggregates.flush()
+
+	def fileno (self):
+		return self._fp.fileno()
+
+	def close (self):
+		self._fp.close()
+		self._index.close()
+
+		if self._aggregates is not None:
+			self._aggregates.close()
+
+
+class BinaryVariableLog (object):
+	""" Writes variable changes to a chunked binary log. """
+
+	def __init__ (self, directory, fileName, typeName, startTime, aggregates = None, writer = None):
+		self._directory = directory
+		self._fileName = fileName
+		self._startTime = startTime
+		self._valueType, self._record, self._cast = _binaryTypes[typeName]
+		self._chunk = -1
+		self._count = 0
+		self._fp = None
+		self._aggregates = aggregates
+		self._writer = writer
+		self.dropped = 0
+
+		self._nextChunk()
+
+	def _nextChunk (self):
+		if self._fp is not None:
+			self._fp.close()
+
+		self._chunk += 1
+		self._count = 0
+
+		chunkFile = self._directory.child(binaryChunkName(self._fileName, self._chunk))
+		self._fp = _create(chunkFile, self._writer)
+		self._fp.write(HEADER.pack(
+			MAGIC,
+			self._valueType.encode('ascii'),
+			self._startTime,
+			self._chunk
+		))
+
+	def write (self, time, value):
+		# Unset values cannot be stored in a numeric column.
+		if value is None:
+			return
+
+		try:
+			value = self._cast(value)
+		except (TypeError, ValueError, OverflowError):
+			# e.g. NaN or a string assigned to an int variable
+			self.dropped += 1
+
+			if self.dropped == 1:
+				log.msg("Dropping {!r} from {:s}, which stores {:s} values (further values will be dropped silently)".format(
+					value, self._fileName, self._cast.__name__
+				))
+
+			return
+
+		if self._count >= CHUNK_RECORDS:
+			self._nextChunk()
+
+		self._fp.write(self._record.pack(time, value))
+		self._count += 1
+
+		if self._aggregates is not None:
+			self._aggregates.write(time, value)
+
+	def flush (self):
+		self._fp.flush()
+
+		if self._aggregates is not None:
+			self._aggregates.flush()
+
+	def fileno (self):
+		return self._fp.fileno()
+
+	def close (self):
+		self._fp.close()
+
+		if self._aggregates is not None:
+			self._aggregates.close()
+
+		if self.dropped > 1:
+			log.msg("Dropped {:d} values from {:s}".format(self.dropped, self._fileName))
+
+
+class _AggregateLevel (object):
+	def __init__ (self, file, width, writer = None):
+		self.width = width
+		self.bucket = None
+		self._fp = _create(file, writer)
+
+	def add (self, time, value):
+		bucket = math.floor(time / self.width)
+
+		if bucket == self.bucket:
+			self.min = min(self.min, value)
+			self.max = max(self.max, value)
+			self.total += value
+			self.count += 1
+		else:
+			self.write()
+			self.bucket = bucket
+			self.min = self.max = self.total = value
+			self.count = 1
+
+	def write (self):
+		""" Write out the current bucket """
+
+		if self.bucket is not None:
+			self._fp.write(_aggregateEntry.pack(
+				self.bucket * self.width,
+				self.min,
+				self.max,
+				self.total / self.count,
+				self.count
+			))
+
+	def flush (self):
+		self._fp.flush()
+
+	def close (self):
+		self.write()
+		self._fp.close()
+
+
+class AggregateLog (object):
+	""" Keeps min / max / mean aggregates of a numeric variable over
+	buckets of each of AGGREGATE_WIDTHS, writing each bucket out to
+	its file once it is complete. """
+
+	def __init__ (self, directory, fileName, writer = None):
+		self._fileName = fileName
+		self._levels = [
+			_AggregateLevel(directory.child(aggregateFileName(fileName, width)), width, writer)
+			for width in AGGREGATE_WIDTHS
+		]
+		self.dropped = 0
+
+	def write (self, time, value):
+		if value is None:
+			return
+
+		try:
+			value = float(value)
+		except (TypeError, ValueError, OverflowError):
+			# e.g. a string assigned to a numeric variable, which is
+			# still written to a CSV log
+			self.dropped += 1
+
+			if self.dropped == 1:
+				log.msg("Not aggregating {!r} in {:s}, which is not a number (further values will be dropped silently)".format(
+					value, self._fileName
+				))
+
+			return
+
+		if math.isnan(value):
+			return
+
+		for level in self._levels:
+			level.add(time, value)
+
+	def flush (self):
+		for level in self._levels:
+			level.flush()
+
+	def close (self):
+		for level in self._levels:
+			level.close()
+
+		if self.dropped > 1:
+			log.msg("Did not aggregate {:d} values in {:s}".format(self.dropped, self._fileName))
+
+
+def _buildIndex (dataFile):
+	""" Scan a CSV log to generate its time index. """
+
+	entries = []
+	nextBucket = None
+	offset = 0
+
+	with dataFile.open() as fp:
+		for line in fp:
+			if line[:1] != b'#':
+				try:
+					time = float(line.split(b',', 1)[0])
+				except ValueError:
+					# Incomplete final line
+					break
+
+				if nextBucket is None or time >= nextBucket:
+					entries.append((time, offset))
+					nextBucket = _nextBucket(time)
+
+			offset += len(line)
+
+	return np.array(entries, dtype = INDEX_RECORD)
+
+def readIndex (dataFile):
+	""" Return the time index of a CSV log.
+
+	Logs written before indexes were introduced are indexed on first
+	access, and the index is saved for next time. """
+
+	indexFile = _indexFileFor(dataFile)
+
+	if indexFile.exists():
+		index = np.fromfile(indexFile.path, dtype = INDEX_RECORD)
+
+		# The index is written alongside the log, so after a crash it may
+		# refer to lines that never made it to disk.
+		return index[index["offset"] < dataFile.getsize()]
+
+	index = _buildIndex(dataFile)
+
+	try:
+		indexFile.setContent(index.tobytes())
+	except (IOError, OSError):
+		pass
+
+	return index
+
+def _startOffset (dataFile, start):
+	""" Byte offset of the first line that may be at or after start. """
+
+	index = readIndex(dataFile)
+	bucket = np.searchsorted(index["time"], start, side = "right") - 1
+
+	if bucket < 0:
+		return 0
+
+	return int(index["offset"][bucket])
+
+def readCSV (dataFile, cast, start = None, end = None):
+	""" Read (times, values) lists from a CSV log, optionally
+	limited to the time range [start, end]. """
+
+	times = []
+	values = []
+
+	if cast is str:
+		cast = lambda value: value.decode('utf-8').strip()
+
+	with dataFile.open() as fp:
+		if start is not None:
+			fp.seek(_startOffset(dataFile, start))
+
+		for line in fp:
+			# Skip comments
+			if line[:1] == b'#':
+				continue
+
+			time, value = line.split(b',', 1)
+			time = float(time)
+
+			if start is not None:
+				if time < start:
+					continue
+				if time > end:
+					break
+
+			times.append(time)
+			values.append(cast(value))
+
+	return times, values
+
+def _mapChunk (chunkFile):
+	""" Memory-map the records of a single binary chunk. """
+
+	with chunkFile.open() as fp:
+		magic, valueType, startTime, index = HEADER.unpack(fp.read(HEADER.size))
+
+	if magic != MAGIC:
+		raise ValueError("{:s} is not a binary variable log".format(chunkFile.path))
+
+	dtype = np.dtype([("time", "<f8"), ("value", valueType.rstrip(b"\0").decode('ascii'))])
+	count = (chunkFile.getsize() - HEADER.size) // dtype.itemsize
+
+	if count <= 0:
+		return np.empty(0, dtype = dtype)
+
+	return np.memmap(chunkFile.path, dtype = dtype, mode = 'r', offset = HEADER.size, shape = (count, ))
+
+def readBinary (directory, fileName, start = None, end = None):
+	""" Read (times, values) arrays from a binary log, optionally
+	limited to the time range [start, end].
+
+	Where the range falls within a single chunk the returned arrays are
+	views onto the memory-mapped file. """
+
+	times = []
+	values = []
+	index = 0
+
+	while True:
+		chunkFile = directory.child(binaryChunkName(fileName, index))
+
+		if not chunkFile.exists():
+			break
+
+		records = _mapChunk(chunkFile)
+		index += 1
+
+		if len(records) == 0:
+			continue
+
+		chunkTimes = records["time"]
+
+		if start is not None:
+			if chunkTimes[-1] < start:
+				continue
+			if chunkTimes[0] > end:
+				break
+
+			first = np.searchsorted(chunkTimes, start, side = "left")
+			last = np.searchsorted(chunkTimes, end, side = "right")
+			records = records[first:last]
+
+		times.append(records["time"])
+		values.append(records["value"])
+
+	if len(times) == 0:
+		return np.empty(0), np.empty(0)
+	elif len(times) == 1:
+		return times[0], values[0]
+	else:
+		return np.concatenate(times), np.concatenate(values)
+
+def iterCSV (dataFile, cast, blockSize = 65536):
+	""" Iterate over the data in a CSV log in blocks of up to blockSize
+	records. Yields (times, values) arrays. """
+
+	with dataFile.open() as fp:
+		while True:
+			lines = [line for line in itertools.islice(fp, blockSize) if line[:1] != b'#']
+
+			if len(lines) == 0:
+				return
+
+			# Incomplete final line
+			if not lines[-1].endswith(b'\n'):
+				lines.pop()
+
+				if len(lines) == 0:
+					return
+
+			if cast is str:
+				pairs = [line.split(b',', 1) for line in lines]
+				times = np.array([float(time) for time, value in pairs])
+				values = np.array([value.decode('utf-8').strip() for time, value in pairs], dtype = object)
+			else:
+				data = np.loadtxt(lines, delimiter = ',', ndmin = 2)
+				times = data[:, 0]
+				values = data[:, 1].astype(np.int64) if cast is int else data[:, 1]
+
+			yield times, values
+
+def iterBinary (directory, fileName, blockSize = 65536):
+	""" Iterate over the data in a binary log in blocks of up to
+	blockSize records. Yields (times, values) arrays. """
+
+	index = 0
+
+	while True:
+		chunkFile = directory.child(binaryChunkName(fileName, index))
+
+		if not chunkFile.exists():
+			return
+
+		records = _mapChunk(chunkFile)
+		index += 1
+
+		for first in range(0, len(records), blockSize):
+			block = records[first:first + blockSize]
+			yield np.array(block["time"]), np.array(block["value"])
+
+
+def readAggregates (directory, fileName, width, start = None, end = None):
+	""" Read the aggregate records of a variable for buckets of the given
+	width, optionally limited to buckets overlapping [start, end].
+
+	Returns None if the variable has no aggregates. """
+
+	aggregateFile = directory.child(aggregateFileName(fileName, width))
+
+	if not aggregateFile.exists():
+		return None
+
+	count = aggregateFile.getsize() // AGGREGATE_RECORD.itemsize
+
+	if count == 0:
+		return np.empty(0, dtype = AGGREGATE_RECORD)
+
+	records = np.memmap(aggregateFile.path, dtype = AGGREGATE_RECORD, mode = 'r', shape = (count, ))
+
+	if start is not None:
+		first = np.searchsorted(records["time"], start - width, side = "right")
+		last = np.searchsorted(records["time"], end, side = "right")
+		records = records[first:last]
+
+	return records
+
+
+def _parseCSVValue (cast):
+	""" A cast for readCSV which reads None as None. Numbers are
+	read as floats; BinaryVariableLog converts them to ints. """
+
+	def parse (value):
+		value = value.strip()
+
+		if value == b"None":
+			return None
+
+		return cast(value)
+
+	return parse
+
+def convertExperimentDir (experimentDir, removeCSV = False):
+	""" Convert the numeric CSV variable logs in an experiment directory
+	to binary logs (with aggregates), and update the variables file to
+	point to them. A variable whose log cannot be read is logged and
+	left as CSV.
+
+	Returns the number of variables converted. """
+
+	varsFile = experimentDir.child("variables")
+
+	if not varsFile.exists():
+		return 0
+
+	variables = json.loads(varsFile.getContent())
+	converted = 0
+
+	for variable in variables.values():
+		if "file" not in variable \
+		or variable.get("format", "csv") != "csv" \
+		or not binaryFormatSupported(variable["type"]):
+			continue
+
+		csvFile = experimentDir.child(variable["file"])
+		if not csvFile.exists():
+			continue
+
+		try:
+			_convertVariable(experimentDir, csvFile, variable, removeCSV)
+		except Exception:
+			log.err(None, "Converting {:s}".format(csvFile.path))
+			continue
+
+		converted += 1
+
+	if converted > 0:
+		varsFile.setContent(json.dumps(variables).encode('utf-8'))
+
+	return converted
+
+def _convertVariable (experimentDir, csvFile, variable, removeCSV):
+	if variable["type"] == "bool":
+		cast = _parseCSVValue(lambda value: value == b"True")
+	else:
+		# Logs of int variables may contain floats, e.g. 2.0
+		cast = _parseCSVValue(float)
+
+	startTime = 0.
+	with csvFile.open() as fp:
+		for line in fp:
+			if line.startswith(b"# start:"):
+				startTime = float(line[8:])
+			elif line[:1] != b'#':
+				break
+
+	fileName = os.path.splitext(variable["file"])[0]
+	times, values = readCSV(csvFile, cast)
+
+	# Remove any files left by an interrupted conversion
+	for chunkFile in experimentDir.globChildren(fileName + ".*.bin"):
+		chunkFile.remove()
+	for aggregateFile in experimentDir.globChildren(fileName + ".*s.agg"):
+		aggregateFile.remove()
+
+	if variable["type"] in ("int", "float"):
+		aggregates = AggregateLog(experimentDir, fileName)
+	else:
+		aggregates = None
+
+	binaryLog = BinaryVariableLog(experimentDir, fileName, variable["type"], startTime, aggregates)
+
+	try:
+		for time, value in zip(times, values):
+			binaryLog.write(time, value)
+	finally:
+		binaryLog.close()
+
+	if removeCSV:
+		csvFile.remove()
+
+		if _indexFileFor(csvFile).exists():
+			_indexFileFor(csvFile).remove()
+
+	variable["file"] = fileName
+	variable["format"] = "binary"
@@ -1,6 +1,5 @@
 # Python Imports
 import uuid
-import os
 import json
 import time
 import re
@@ -9,7 +8,7 @@ import numpy as np
 now = time.time # shortcut
 
 # Twisted Imports
-from twisted.internet import defer, threads, task
+from twisted.internet import defer, threads
 from twisted.python import log
 from twisted.python.filepath import FilePath
 
@@ -17,8 +16,11 @@ from twisted.python.filepath import FilePath
 from octopus.runtime.sequence.error import AlreadyRunning, NotRunning
 
 # Package Imports
-from .util import EventEmitter
+from .util import EventEmitter, LRUCache
 from .dbutil import makeFinder
+from . import datalog
+from . import export
+from .logwriter import LogWriter
 
 
 class Experiment (EventEmitter):
@@ -28,6 +30,16 @@ class Experiment (EventEmitter):
 	db = None
 	dataDir = None
 
+	# Storage format for variable logs: "csv" or "binary"
+	dataFormat = "csv"
+
+	# Log files are written out when a file has logBufferSize bytes
+	# buffered, or every logFlushInterval seconds, and synced to disk
+	# every logSyncInterval seconds.
+	logBufferSize = 64 * 1024
+	logFlushInterval = 5
+	logSyncInterval = 5 * 60
+
 	@classmethod
 	def exists (cls, id):
 		d = cls.db.runQuery("SELECT guid FROM experiments WHERE guid = ?", (id,))
@@ -37,10 +49,12 @@ class Experiment (EventEmitter):
 
 	@classmethod
 	def delete (cls, id):
+		CompletedExperiment.cache.invalidate(id)
 		return cls.db.runOperation("UPDATE experiments SET deleted = 1 WHERE guid = ?", (id, ))
 
 	@classmethod
 	def restore (cls, id):
+		CompletedExperiment.cache.invalidate(id)
 		return cls.db.runOperation("UPDATE experiments SET deleted = 0 WHERE guid = ?", (id, ))
 
 	def __init__ (self, sketch):
@@ -49,6 +63,7 @@ class Experiment (EventEmitter):
 		self.id = id
 		self.sketch = sketch
 		self.logMessages = []
+		self.logWriter = None
 
 	@defer.inlineCallbacks
 	def run (self):
@@ -109,9 +124,17 @@ class Experiment (EventEmitter):
 			if not self._experimentDir.exists():
 				self._experimentDir.createDirectory()
 
+		# Log files are written through a LogWriter, which buffers
+		# writes and writes them out in a worker thread.
+		writer = self.logWriter = LogWriter(
+			bufferSize = self.logBufferSize,
+			flushInterval = self.logFlushInterval,
+			syncInterval = self.logSyncInterval
+		)
+
 		# Create files for the sketch logs, snapshot, variables etc.
-		eventFile = self._experimentDir.child("events.log").create()
-		sketchFile = self._experimentDir.child("sketch.log").create()
+		eventFile = writer.open(self._experimentDir.child("events.log"))
+		sketchFile = writer.open(self._experimentDir.child("sketch.log"))
 		snapFile = self._experimentDir.child("sketch.snapshot.log")
 		varsFile = self._experimentDir.child("variables")
 		openFiles = { "_events": eventFile, "_sketch": sketchFile }
@@ -119,7 +142,7 @@ class Experiment (EventEmitter):
 
 		# Write a snapshot of the sketch.
 		with snapFile.create() as fp:
-			fp.write("\n".join(map(json.dumps, workspace.toEvents())))
+			fp.write("\n".join(map(json.dumps, workspace.toEvents())).encode('utf-8'))
 
 		# Log events emitted by the sketch (block changes, etc.)
 		# The idea is that with the snapshot and change log, the
@@ -155,19 +178,17 @@ class Experiment (EventEmitter):
 				"data": data
 			}
 
-			file.write(json.dumps(event) + "\n")
+			file.write((json.dumps(event) + "\n").encode('utf-8'))
 
 		sketch.subscribe(self, onSketchEvent)
 
-		# Subscribe to workspace events. Block states are written to
-		# the events log.
+		# Subscribe to workspace events. Every block state change is
+		# written to the events log, but subscribers are sent the
+		# latest states in batches.
 		@workspace.on("block-state")
 		def onBlockStateChange (data):
 			writeEvent(eventFile, "block", "state", data)
-
-			data['sketch'] = sketch_id
-			data['experiment'] = id
-			sketch.notifySubscribers("block", "state", data, self)
+			sketch.blockStates.add(data['block'], data['state'], self)
 
 		# Log messages are written to the events log, and also
 		# broadcast to subscribers. The experiment keeps a record
@@ -189,25 +210,55 @@ class Experiment (EventEmitter):
 		#
 		# The relative time is written, to save filesize. The absolute
 		# time can be calculated using the start time at the top of the file.
+		#
+		# Numeric variables are written to binary logs if dataFormat is
+		# "binary"; anything else is written as CSV.
 		@workspace.variables.on("variable-changed")
 		def onVarChanged (data):
 			try:
 				logFile = openFiles[data['name']]
 			except KeyError:
 				varName = unusedVarName(data['name'])
+				variable = workspace.variables.get(data['name'])
+				typeName = variable.type.__name__
 				fileName = fileNameFor(varName)
-				logFile = self._experimentDir.child(fileName).create()
-				openFiles[varName] = logFile
-				addUsedFile(varName, fileName, workspace.variables.get(data['name']))
 
-				logFile.write(
-					"# name:{:s}\n# type:{:s} \n# start:{:.2f}\n".format(
+				if self.dataFormat == "binary" \
+				and datalog.binaryFormatSupported(typeName):
+					fileFormat = "binary"
+				else:
+					fileFormat = "csv"
+					fileName += '.csv'
+
+				# Numeric variables are also aggregated for graphing
+				if typeName in ("int", "float"):
+					aggregates = datalog.AggregateLog(self._experimentDir, fileName, writer)
+				else:
+					aggregates = None
+
+				if fileFormat == "binary":
+					logFile = datalog.BinaryVariableLog(
+						self._experimentDir,
+						fileName,
+						typeName,
+						self.startTime,
+						aggregates,
+						writer
+					)
+				else:
+					logFile = datalog.CSVVariableLog(
+						self._experimentDir.child(fileName),
 						data['name'],
 						type(data['value']).__name__,
-						self.startTime
-				))
+						self.startTime,
+						aggregates,
+						writer
+					)
 
-			logFile.write("{:.2f}, {:s}\n".format(data['time'] - self.startTime, str(data['value'])))
+				openFiles[varName] = logFile
+				addUsedFile(varName, fileName, fileFormat, variable)
+
+			logFile.write(data['time'] - self.startTime, data['value'])
 
 		# Update the open files list if a variable is renamed.
 		#
@@ -218,7 +269,7 @@ class Experiment (EventEmitter):
 		def onVarRenamed (data):
 			openFiles[data['newName']] = openFiles[data['oldName']]
 			del openFiles[data['oldName']]
-			addUsedFile(data['newName'], "", data['variable'])
+			addUsedFile(data['newName'], "", None, data['variable'])
 
 		# Ensure that renaming vars doesn't lead to any overwriting.
 		# (see TODO above).
@@ -227,14 +278,14 @@ class Experiment (EventEmitter):
 				return unusedVarName(varName + "_")
 			return varName
 
-		# Format a variable name into a file name
+		# Format a variable name into a file name (without extension)
 		def fileNameFor (varName):
-			return re.sub(r'[^a-z0-9\.]', '_', varName) + '.csv'
+			return re.sub(r'[^a-z0-9\.]', '_', varName)
 
 		# Build a list of files and variables to be written to the variables
 		# list file, which is used to generate the var list
 		# when the experiment results are being displayed.
-		def addUsedFile (varName, fileName, variable):
+		def addUsedFile (varName, fileName, fileFormat, variable):
 			try:
 				unit = str(variable.unit)
 			except AttributeError:
@@ -245,31 +296,25 @@ class Experiment (EventEmitter):
 					"name": varName,
 					"type": variable.type.__name__,
 					"unit": unit,
-					"file": fileName
+					"file": fileName,
+					"format": fileFormat
 				}
 			else:
 				usedFiles[varName] = {}
 
-		# Write all file data. This is called periodically during the
-		# experiment so that data variables that do not change very
-		# often is still written to disk, and will not be lost if the
-		# program crashes.
-		def flushFiles ():
-			try:
-				for file in openFiles.values():
-					file.flush()
-					os.fsync(file.fileno())
-			except:
-				log.err()
-
-		flushFilesLoop = task.LoopingCall(flushFiles)
-		flushFilesLoop.start(5 * 60, False).addErrback(log.err)
+		# Buffered data is written out periodically during the
+		# experiment, and synced to disk so that data is not lost
+		# if the program crashes.
+		writer.start()
 
 		# Attempt to run the experiment. Make sure that eveything is
 		# cleaned up after the experiment, even in the event of an error.
 		try:
 			yield workspace.run()
 		finally:
+			# Send the final block states
+			sketch.blockStates.flush()
+
 			# Remove event handlers
 			sketch.unsubscribe(self)
 			workspace.off("block-state", onBlockStateChange)
@@ -279,15 +324,17 @@ class Experiment (EventEmitter):
 
 			# Close file pointers
 			with varsFile.create() as fp:
-				fp.write(json.dumps(usedFiles))
+				fp.write(json.dumps(usedFiles).encode('utf-8'))
+
+			for file in openFiles.values():
+				file.close()
 
 			try:
-				flushFilesLoop.stop()
+				yield writer.close()
 			except:
 				log.err()
 
-			for file in openFiles.values():
-				file.close()
+			log.msg("Experiment %s log writer: %s" % (id, writer.metrics()))
 
 			# Store completed time for experiment.
 			self.db.runOperation("""
@@ -360,6 +407,16 @@ find = makeFinder(
 
 
 class CompletedExperiment (object):
+	""" Results of an experiment that has finished running.
+
+	Completed experiments do not change, so their metadata, variable lists
+	and data windows are kept in a process-wide cache, keyed by experiment
+	id. Entries for an experiment are invalidated when it is deleted or
+	restored. Results are only cached once the experiment has finished. """
+
+	# Budget for the cache, in (approximate) bytes.
+	cache = LRUCache(64 * 2 ** 20)
+
 	def __init__ (self, id):
 		self.id = id
 
@@ -394,39 +451,52 @@ class CompletedExperiment (object):
 
 	@defer.inlineCallbacks
 	def loadData (self, variables, start, end):
-		date = yield self._fetchDateFromDb(self.id)
-		experimentDir = self._getExperimentDir(self.id, date)
+		expt = yield self._fetchFromDb(self.id)
+		experimentDir = self._getExperimentDir(self.id, expt['started_date'])
 		storedVariablesData = yield self._getVariables(experimentDir)
 
-		data = yield defer.gatherResults(map(
-			lambda variable: self._getData(
-				experimentDir.child(variable["file"]),
-				variable["name"],
-				variable["type"],
+		if end is None:
+			start = None
+
+		def _cached (variable):
+			key = (self.id, "data", variable["name"], start, end)
+			result = self.cache.get(key)
+
+			if result is not None:
+				return defer.succeed(result)
+
+			def _store (result):
+				if expt['finished_date'] > 0 and 'data' in result:
+					self.cache.set(key, result, 256 + 128 * len(result['data']))
+
+				return result
+
+			return self._getData(
+				experimentDir,
+				variable,
 				start,
 				end
-			),
+			).addCallback(_store)
+
+		data = yield defer.gatherResults(map(
+			_cached,
 			map(lambda name: storedVariablesData[name], variables)
 		))
 
 		defer.returnValue(data)
 
 	@defer.inlineCallbacks
-	def buildExcelFile (self, variables, time_divisor, time_dp):
-		import pandas as pd
-		try:
-		    from cStringIO import StringIO
-		except:
-		    from StringIO import StringIO
+	def exportRows (self, variables, time_divisor, time_dp, aggregate = "first"):
+		""" Generate a table of the data for the requested variables.
 
-		date = yield self._fetchDateFromDb(self.id)
-		experimentDir = self._getExperimentDir(self.id, date)
-		storedVariablesData = yield self._getVariables(experimentDir)
-		io = StringIO()
+		Returns (header, rows), where rows is an iterator of
+		(time, [values]) with one row per time bucket, with values
+		reduced by aggregate (see export.bucketRows). The data files
+		are read as the rows are consumed. """
 
-		# http://stackoverflow.com/questions/28058563/write-to-stringio-object-using-pandas-excelwriter
-		writer = pd.ExcelWriter('temp.xlsx', engine='xlsxwriter')
-		writer.book.filename = io
+		expt = yield self._fetchFromDb(self.id)
+		experimentDir = self._getExperimentDir(self.id, expt['started_date'])
+		storedVariablesData = yield self._getVariables(experimentDir)
 
 		def varName (variable):
 			""" Generates a column title from a variable name """
@@ -443,52 +513,47 @@ class CompletedExperiment (object):
 
 			return name + unit
 
-		# Read data for each requested variable
-		cols = yield defer.gatherResults(map(
-			lambda variable: threads.deferToThread(
-				pd.read_csv,
-				experimentDir.child(variable["file"]).path,
-				comment = '#',
-				index_col = 0,
-				usecols = [0, 1],
-				names = ["Time", varName(variable)]
-			),
-			map(lambda name: storedVariablesData[name], variables)
-		))
-
-		# Convert the columns into a single DataFrame
-		dataframe = pd.concat(cols, axis = 1)
+		def readColumn (variable):
+			""" Iterates over blocks of the data for a variable """
 
-		# Ensure there is a datapoint at each time point. Fill rather than
-		# interpolate to maintain greatest data fidelity.
-		dataframe.fillna(method = 'pad', inplace = True)
+			if variable.get("format") == "binary":
+				return datalog.iterBinary(experimentDir, variable["file"])
 
-		# Reduce the number of datapoints according to time_divisor / time_dp
-		# This is done over the entire dataframe, after filling empty values,
-		# so that all property values are retained.
-		def format_time (x):
-			if x is not "":
-				return round(float(x) / time_divisor, time_dp)
+			if variable["type"] == "int":
+				cast = int
+			elif variable["type"] == "float":
+				cast = float
+			else:
+				cast = str
 
-		dataframe = dataframe.groupby(format_time).first()
+			return datalog.iterCSV(experimentDir.child(variable["file"]), cast)
 
-		# Remove invalid chars from expt title for Excel sheet title
-		sheet_title = re.sub('[\[\]\*\/\\\?]+', '', self.title)[0:30]
+		selected = [storedVariablesData[name] for name in variables]
 
-		# Generate excel file
-		dataframe.to_excel(writer, sheet_name = sheet_title)
-		writer.save()
+		header = ["Time"] + [varName(variable) for variable in selected]
+		rows = export.bucketRows(
+			export.mergeBlocks([readColumn(variable) for variable in selected]),
+			time_divisor,
+			time_dp,
+			aggregate
+		)
 
-		defer.returnValue(io.getvalue())
+		defer.returnValue((header, rows))
 
 	def _fetchFromDb (self, id):
+		key = (id, "meta")
+		expt = self.cache.get(key)
+
+		if expt is not None:
+			return defer.succeed(expt)
+
 		def _done (rows):
 			try:
 				row = rows[0]
-			except KeyError:
+			except IndexError:
 				return None
 
-			return {
+			expt = {
 				'guid': str(row[0]),
 				'sketch_guid': str(row[1]),
 				'user_id': int(row[2]),
@@ -497,21 +562,13 @@ class CompletedExperiment (object):
 				'sketch_title': str(row[5])
 			}
 
-		return Experiment.db.runQuery("""
-			SELECT guid, sketch_guid, user_id, started_date, finished_date, title
-			FROM experiments
-			WHERE guid = ?
-		""", (id, )).addCallback(_done)
+			if expt['finished_date'] > 0:
+				self.cache.set(key, expt, 1024)
 
-	def _fetchDateFromDb (self, id):
-		def _done (rows):
-			try:
-				return int(rows[0][0])
-			except KeyError:
-				return None
+			return expt
 
 		return Experiment.db.runQuery("""
-			SELECT started_date
+			SELECT guid, sketch_guid, user_id, started_date, finished_date, title
 			FROM experiments
 			WHERE guid = ?
 		""", (id, )).addCallback(_done)
@@ -529,6 +586,13 @@ class CompletedExperiment (object):
 
 	@defer.inlineCallbacks
 	def _getVariables (self, experimentDir):
+		key = (self.id, "variables")
+		variables = self.cache.get(key)
+
+		if variables is not None:
+			defer.returnValue(variables)
+
+		# The variables file is written when the experiment finishes.
 		varsFile = experimentDir.child("variables")
 		try:
 			content = yield threads.deferToThread(varsFile.getContent)
@@ -536,11 +600,15 @@ class CompletedExperiment (object):
 		except:
 			log.err()
 			variables = {}
+		else:
+			self.cache.set(key, variables, 256 + len(content))
 
 		defer.returnValue(variables)
 
 	@defer.inlineCallbacks
-	def _getData (self, dataFile, name, var_type, start = None, end = None):
+	def _getData (self, experimentDir, variable, start = None, end = None):
+		name = variable["name"]
+		var_type = variable["type"]
 
 		if var_type == "int":
 			cast = int
@@ -553,28 +621,70 @@ class CompletedExperiment (object):
 			start = None
 
 		def _readFile ():
-			data = []
-			with dataFile.open() as fp:
-				for line in fp:
-					# Skip comments
-					if line[0] == '#':
-						continue
+			if variable.get("format") == "binary":
+				return datalog.readBinary(experimentDir, variable["file"], start, end)
+			else:
+				return datalog.readCSV(experimentDir.child(variable["file"]), cast, start, end)
+
+		def _simplify (times, values):
+			times = np.asarray(times, dtype = float)
+			values = np.asarray(values)
+
+			if end is None:
+				interval = times[-1] - times[0]
+			else:
+				interval = end - start
+
+			spread = values.max() - values.min()
+			epsilon = min(interval / 200., spread / 50.)
+			print ("Simplifying data with interval " + str(interval) + " (currently %s points)" % len(times))
+			print ("Spread: %s" % spread)
+			print ("Epsilon: %s" % epsilon)
+
+			mask = rdp(times, values, epsilon)
 
-					time, value = line.split(',')
-					time = float(time)
+			return list(zip(times[mask].tolist(), values[mask].tolist()))
 
-					if start is not None:
-						if time < start:
-							continue
-						if time > end:
-							break
+		def _readAggregates ():
+			""" Find the coarsest aggregate level that still gives enough
+			points to draw the window. Points are (time, mean, min, max). """
 
-					data.append((time, cast(value)))
+			for width in sorted(datalog.AGGREGATE_WIDTHS, reverse = True):
+				records = datalog.readAggregates(experimentDir, variable["file"], width, start, end)
 
-			return data
+				if records is not None and len(records) >= 400:
+					log.msg("Using {:d}s aggregates of {:s}".format(width, variable["file"]))
+
+					return width, list(zip(
+						records["time"].tolist(),
+						records["mean"].tolist(),
+						records["min"].tolist(),
+						records["max"].tolist()
+					))
+
+			return None, None
+
+		def _read ():
+			if cast in (int, float):
+				resolution, data = _readAggregates()
+
+				if data is not None:
+					return resolution, data
+
+			times, values = _readFile()
+
+			if len(times) > 400 and cast in (int, float):
+				return None, _simplify(times, values)
+
+			# Binary logs are read as arrays
+			if isinstance(times, np.ndarray):
+				times = times.tolist()
+				values = values.tolist()
+
+			return None, list(zip(times, values))
 
 		try:
-			data = yield threads.deferToThread(_readFile)
+			resolution, data = yield threads.deferToThread(_read)
 		except:
 			log.err()
 			defer.returnValue({})
@@ -582,61 +692,70 @@ class CompletedExperiment (object):
 		# Make a readable variable name
 		#var_name = '.'.join(name.split('::')[1:])
 
-		if len(data) > 400 and cast in (int, float):
-			if end is None:
-				try:
-					interval = data[-1][0] - data[0][0]
-				except IndexError:
-					interval = 0
-			else:
-				interval = end - start
-
-			spread = max(data, key = lambda x: x[1])[1] - min(data, key = lambda x: x[1])[1]
-			print ("Simplifying data with interval " + str(interval) + " (currently %s points)" % len(data))
-			print ("Spread: %s" % spread)
-			print ("Epsilon: %s" % min(interval / 200., spread / 50.))
-			data = rdp(data, epsilon = min(interval / 200., spread / 50.))
-
 		print (" -> %s points" % len(data))
 
-		defer.returnValue({
+		result = {
 			'name': name,
 			'type': var_type,
 			'data': data
-		})
+		}
 
+		if resolution is not None:
+			result['resolution'] = resolution
 
-from math import sqrt
+		defer.returnValue(result)
 
-def distance(a, b):
-	return  sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
 
-def point_line_distance(point, start, end):
-	if (start == end):
-		return distance(point, start)
-	else:
-		n = abs(
-			(end[0] - start[0]) * (start[1] - point[1]) - (start[0] - point[0]) * (end[1] - start[1])
-		)
-		d = sqrt(
-			(end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2
-		)
-		return n / d
+from math import sqrt
 
-def rdp(points, epsilon):
+def rdp (x, y, epsilon):
 	"""
 	Reduces a series of points to a simplified version that loses detail, but
 	maintains the general shape of the series.
+
+	Ramer-Douglas-Peucker, evaluated with an explicit stack rather than by
+	recursion, so that long series do not hit the recursion limit. The
+	distances for each segment are calculated as a single array operation.
+
+	Returns a boolean mask of the points in (x, y) that should be kept.
 	"""
-	dmax = 0.0
-	index = 0
-	for i in range(1, len(points) - 1):
-		d = point_line_distance(points[i], points[0], points[-1])
-		if d > dmax:
-			index = i
-			dmax = d
-	if dmax >= epsilon:
-		results = rdp(points[:index+1], epsilon)[:-1] + rdp(points[index:], epsilon)
-	else:
-		results = [points[0], points[-1]]
-	return results
+	x = np.asarray(x, dtype = float)
+	y = np.asarray(y, dtype = float)
+	count = len(x)
+	mask = np.zeros(count, dtype = bool)
+
+	if count == 0:
+		return mask
+
+	mask[0] = mask[-1] = True
+	stack = [(0, count - 1)]
+
+	while len(stack) > 0:
+		first, last = stack.pop()
+
+		if last - first < 2:
+			continue
+
+		dx = x[last] - x[first]
+		dy = y[last] - y[first]
+		px = x[first + 1:last] - x[first]
+		py = y[first + 1:last] - y[first]
+		length = sqrt(dx ** 2 + dy ** 2)
+
+		# Perpendicular distance of each point from the line between the
+		# first and last points, or distance from the first point if the
+		# two are coincident.
+		if length == 0:
+			distances = np.hypot(px, py)
+		else:
+			distances = np.abs(dx * py - px * dy) / length
+
+		index = int(np.argmax(distances))
+
+		if distances[index] > epsilon:
+			index += first + 1
+			mask[index] = True
+			stack.append((first, index))
+			stack.append((index, last))
+
+	return mask
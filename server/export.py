@@ -0,0 +1,337 @@
+# Python Imports
+import io
+import re
+import csv
+import itertools
+import tempfile
+
+# NumPy
+import numpy as np
+
+# Zope Imports
+from zope.interface import implementer
+
+# Twisted Imports
+from twisted.internet import defer, threads, interfaces
+from twisted.protocols.basic import FileSender
+
+
+#
+# Export of experiment data
+#
+# Variable logs are each sorted by time, so a table of all of the
+# requested variables can be generated a block of rows at a time by
+# merging them. Blocks are forward-filled and reduced to one row per
+# time bucket with NumPy as they are generated, and written out to
+# the response as the client is ready for them.
+#
+
+contentTypes = {
+	"csv": "text/csv",
+	"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+aggregations = ("first", "mean", "min", "max", "last")
+
+
+def mergeBlocks (series):
+	""" Merge iterators of (times, values) blocks into (times, columns)
+	blocks.
+
+	times holds each distinct time of the series within the block, and
+	columns holds a (values, valid) pair of arrays for each series with
+	the latest value of the series at each of these times (i.e. values
+	are forward-filled). valid is False where a series has not had a
+	value yet. """
+
+	sources = [iter(blocks) for blocks in series]
+	buffers = [None] * len(sources)
+	carry = [None] * len(sources)
+
+	def _fill (index):
+		block = next(sources[index], None)
+
+		if block is None:
+			sources[index] = None
+		elif buffers[index] is None:
+			buffers[index] = block
+		else:
+			buffers[index] = (
+				np.concatenate((buffers[index][0], block[0])),
+				np.concatenate((buffers[index][1], block[1]))
+			)
+
+	while True:
+		for index in range(len(sources)):
+			while sources[index] is not None and (buffers[index] is None or len(buffers[index][0]) == 0):
+				_fill(index)
+
+		# Times before the end of the shortest buffered block can be
+		# merged. Later times (including the last time itself, which
+		# might be repeated) may still be to come from that series.
+		live = [index for index, source in enumerate(sources) if source is not None]
+		cutoff = min(buffers[index][0][-1] for index in live) if len(live) else None
+		segments = []
+
+		for index, buffer in enumerate(buffers):
+			if buffer is None:
+				segments.append(None)
+				continue
+
+			split = len(buffer[0]) if cutoff is None else np.searchsorted(buffer[0], cutoff, side = "left")
+			segments.append((buffer[0][:split], buffer[1][:split]))
+			buffers[index] = (buffer[0][split:], buffer[1][split:])
+
+		present = [segment[0] for segment in segments if segment is not None and len(segment[0])]
+
+		if len(present) == 0:
+			if cutoff is None:
+				return
+
+			for index in live:
+				if buffers[index][0][-1] == cutoff:
+					_fill(index)
+
+			continue
+
+		times = np.unique(np.concatenate(present))
+		columns = []
+
+		for index, segment in enumerate(segments):
+			if segment is not None and len(segment[0]):
+				position = np.searchsorted(segment[0], times, side = "right") - 1
+
+				if carry[index] is None:
+					values = segment[1][np.maximum(position, 0)]
+					valid = position >= 0
+				else:
+					values = np.concatenate((carry[index], segment[1]))[position + 1]
+					valid = np.ones(len(times), dtype = bool)
+
+				carry[index] = segment[1][-1:]
+			elif carry[index] is not None:
+				values = np.repeat(carry[index], len(times))
+				valid = np.ones(len(times), dtype = bool)
+			else:
+				dtype = float if buffers[index] is None else buffers[index][1].dtype
+				values = np.zeros(len(times), dtype = dtype)
+				valid = np.zeros(len(times), dtype = bool)
+
+			columns.append((values, valid))
+
+		yield times, columns
+
+def _aggregateColumn (values, valid, starts, aggregate):
+	""" Reduce a column to one value per bucket, as a list with None
+	for buckets without a value. Columns which are not numeric can only
+	be reduced to their first or last value; "mean", "min" and "max"
+	give the first value for these. """
+
+	if aggregate in ("mean", "min", "max") and values.dtype.kind in "biuf":
+		column = values.astype(float)
+		missing = ~np.logical_or.reduceat(valid, starts)
+
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			if aggregate == "mean":
+				result = np.add.reduceat(np.where(valid, column, 0.), starts) / np.add.reduceat(valid, starts)
+			elif aggregate == "min":
+				result = np.minimum.reduceat(np.where(valid, column, np.inf), starts)
+			else:
+				result = np.maximum.reduceat(np.where(valid, column, -np.inf), starts)
+
+		if aggregate != "mean":
+			result[missing] = 0
+			result = result.astype(values.dtype)
+	else:
+		positions = np.arange(len(values))
+
+		if aggregate == "last":
+			index = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+			missing = index < 0
+		else:
+			index = np.minimum.reduceat(np.where(valid, positions, len(values)), starts)
+			missing = index == len(values)
+
+		result = values[np.where(missing, 0, index)]
+
+	result = result.tolist()
+
+	for index in np.flatnonzero(missing).tolist():
+		result[index] = None
+
+	return result
+
+def bucketRows (blocks, time_divisor = None, time_dp = None, aggregate = "first"):
+	""" Reduce blocks from mergeBlocks to (time, [values]) rows, one
+	per time bucket.
+
+	Times are divided by time_divisor and rounded to time_dp decimal
+	places (or to an integer if time_dp is None). The values of each
+	column in a bucket are reduced according to aggregate, one of
+	"first", "mean", "min", "max" or "last". """
+
+	if aggregate not in aggregations:
+		raise ValueError("Unknown aggregation " + str(aggregate))
+
+	time_divisor = float(time_divisor or 1)
+	pending = None
+
+	for block in itertools.chain(blocks, [None]):
+		final = block is None
+
+		if pending is not None:
+			block = pending if final else (
+				np.concatenate((pending[0], block[0])),
+				[
+					(np.concatenate((values, block[1][index][0])), np.concatenate((valid, block[1][index][1])))
+					for index, (values, valid) in enumerate(pending[1])
+				]
+			)
+		elif final:
+			return
+
+		times, columns = block
+		keys = np.round(times / time_divisor, time_dp or 0)
+
+		if time_dp is None:
+			keys = keys.astype(np.int64)
+
+		starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+		# The last bucket may continue into the next block
+		end = len(times) if final else starts[-1]
+		pending = (times[end:], [(values[end:], valid[end:]) for values, valid in columns])
+
+		if end == 0:
+			continue
+
+		starts = starts[starts < end]
+		reduced = [
+			_aggregateColumn(values[:end], valid[:end], starts, aggregate)
+			for values, valid in columns
+		]
+
+		for key, row in zip(keys[starts].tolist(), zip(*reduced)):
+			yield key, list(row)
+
+		if final:
+			return
+
+
+@implementer(interfaces.IPullProducer)
+class ChunkProducer (object):
+	""" Writes chunks from an iterator to a consumer as it asks for them.
+
+	Each chunk is generated in a worker thread, so that reading the
+	data files does not block the reactor. """
+
+	def __init__ (self, chunks):
+		self._chunks = chunks
+		self._consumer = None
+		self._producing = False
+		self._stopped = False
+		self.deferred = defer.Deferred()
+
+	def beginProducing (self, consumer):
+		self._consumer = consumer
+		consumer.registerProducer(self, False)
+
+		return self.deferred
+
+	def resumeProducing (self):
+		if self._producing or self._stopped:
+			return
+
+		self._producing = True
+		threads.deferToThread(next, self._chunks, None).addCallbacks(self._write, self._error)
+
+	def _write (self, chunk):
+		self._producing = False
+
+		if self._stopped:
+			return
+
+		if chunk is None:
+			self._consumer.unregisterProducer()
+			self.deferred.callback(None)
+		else:
+			self._consumer.write(chunk)
+
+	def _error (self, failure):
+		self._producing = False
+
+		if not self._stopped:
+			self._stopped = True
+			self._consumer.unregisterProducer()
+			self.deferred.errback(failure)
+
+	def stopProducing (self):
+		if not self._stopped:
+			self._stopped = True
+			self.deferred.errback(Exception("Export cancelled"))
+
+
+def _csvChunks (header, rows, rowsPerChunk = 1000):
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(header)
+	count = 0
+
+	for key, row in rows:
+		writer.writerow([key] + row)
+		count += 1
+
+		if count == rowsPerChunk:
+			yield buffer.getvalue().encode('utf-8')
+			buffer.seek(0)
+			buffer.truncate()
+			count = 0
+
+	if buffer.tell() > 0:
+		yield buffer.getvalue().encode('utf-8')
+
+def writeCSV (consumer, header, rows):
+	""" Stream rows to consumer as CSV. Returns a Deferred which
+	fires once all of the rows have been written. """
+
+	return ChunkProducer(_csvChunks(header, rows)).beginProducing(consumer)
+
+def writeXLSX (consumer, title, header, rows):
+	""" Write rows to an Excel workbook and send it to consumer.
+
+	The workbook is built in a worker thread, in xlsxwriter's constant
+	memory mode, in a temporary file. An xlsx file is a zip archive which
+	cannot be sent until it is complete, so the file is then streamed
+	to the consumer. Returns a Deferred which fires once it has been
+	sent. """
+
+	import xlsxwriter
+
+	# Remove invalid chars from expt title for Excel sheet title
+	sheet_title = re.sub(r'[\[\]\*\/\\\?:]+', '', title)[0:30]
+	fp = tempfile.TemporaryFile()
+
+	def _build ():
+		workbook = xlsxwriter.Workbook(fp, { 'constant_memory': True })
+		worksheet = workbook.add_worksheet(sheet_title or None)
+		worksheet.write_row(0, 0, header)
+
+		for index, (key, row) in enumerate(rows, 1):
+			worksheet.write_number(index, 0, key)
+			worksheet.write_row(index, 1, row)
+
+		workbook.close()
+		fp.seek(0)
+
+	def _send (result):
+		return FileSender().beginFileTransfer(fp, consumer)
+
+	def _close (result):
+		fp.close()
+		return result
+
+	d = threads.deferToThread(_build)
+	d.addCallback(_send)
+	d.addBoth(_close)
+
+	return d
@@ -0,0 +1,232 @@
+# Python Imports
+import os
+import time
+
+# Twisted Imports
+from twisted.internet import defer, threads, task
+from twisted.python import log
+
+
+#
+# Buffered writing of sketch and experiment logs
+#
+# Sketches and experiments write a line or record to a log file for
+# every event and every variable change. These writes are collected in memory, and
+# written out to the files in a worker thread when a file's buffer is
+# full or every few seconds. The files are synced to disk (also in a
+# worker thread) less often, so that the data is not lost if the
+# program crashes.
+#
+
+class LogFile (object):
+	""" A file written through a LogWriter.
+
+	Has the write / flush / close interface of a file, but writes
+	are buffered in memory and written out by the LogWriter. """
+
+	def __init__ (self, writer, fp):
+		self._writer = writer
+		self._fp = fp
+		self._buffer = []
+		self._pending = None
+		self.bufferedBytes = 0
+
+	def write (self, data):
+		self._buffer.append(data)
+		self.bufferedBytes += len(data)
+		self._writer._queued(self, len(data))
+
+	def flush (self):
+		return self._writer.flushFile(self)
+
+	def fileno (self):
+		return self._fp.fileno()
+
+	def close (self):
+		return self._writer.closeFile(self)
+
+	def _take (self):
+		data = b"".join(self._buffer)
+		self._buffer = []
+		self.bufferedBytes = 0
+
+		return data
+
+
+class LogWriter (object):
+	""" Writes a set of log files without blocking the reactor.
+
+	A file's buffer is written out once it holds bufferSize bytes,
+	and all buffers are written out every flushInterval seconds.
+	Every syncInterval seconds all files are also synced to disk.
+	Writes and syncs are done one at a time, in order, in a worker
+	thread. Buffers are taken when their write starts, so writes made
+	whilst the worker thread is busy are written out together. """
+
+	def __init__ (self, bufferSize = 64 * 1024, flushInterval = 5, syncInterval = 5 * 60):
+		self.bufferSize = bufferSize
+		self.flushInterval = flushInterval
+		self.syncInterval = syncInterval
+
+		self._files = set()
+		self._lock = defer.DeferredLock()
+		self._loops = []
+
+		# Metrics
+		self.queuedBytes = 0
+		self.writtenBytes = 0
+		self.flushes = 0
+		self.flushLatency = 0.
+		self.maxFlushLatency = 0.
+		self.totalFlushLatency = 0.
+		self.syncs = 0
+		self.syncLatency = 0.
+		self.maxSyncLatency = 0.
+
+	def open (self, file, append = False):
+		""" Create file (a FilePath), or open it for appending if append
+		is True, and return a LogFile for it. """
+
+		logFile = LogFile(self, file.open('a') if append else file.create())
+		self._files.add(logFile)
+
+		return logFile
+
+	def start (self):
+		for interval, fn in [
+			(self.flushInterval, self.flush),
+			(self.syncInterval, self.sync)
+		]:
+			loop = task.LoopingCall(fn)
+			loop.start(interval, False).addErrback(log.err)
+			self._loops.append(loop)
+
+	def flushFile (self, logFile):
+		""" Write out the buffer of a file. """
+
+		if logFile._pending is not None:
+			return logFile._pending
+
+		if logFile.bufferedBytes == 0:
+			return defer.succeed(None)
+
+		# Set before queueing the write, which clears it when it starts.
+		d = logFile._pending = defer.Deferred()
+		self._write([logFile]).chainDeferred(d)
+
+		return d
+
+	def closeFile (self, logFile):
+		""" Write out the buffer of a file and close it. """
+
+		self._files.discard(logFile)
+
+		return self._write([logFile], close = True)
+
+	def flush (self):
+		""" Write out all buffers. Returns a Deferred which fires
+		once the data has been written. """
+
+		files = [logFile for logFile in self._files if logFile.bufferedBytes]
+
+		if len(files) == 0:
+			return defer.succeed(None)
+
+		return self._write(files)
+
+	def sync (self):
+		""" Write out all buffers and sync all files to disk. Returns
+		a Deferred which fires once the files have been synced. """
+
+		return self._write(list(self._files), sync = True)
+
+	def close (self):
+		""" Stop the periodic flushes, then write out, sync and close
+		all files. Returns a Deferred which fires once they are closed. """
+
+		for loop in self._loops:
+			if loop.running:
+				loop.stop()
+
+		self._loops = []
+		files = list(self._files)
+		self._files.clear()
+
+		return self._write(files, sync = True, close = True)
+
+	def metrics (self):
+		return {
+			"files": len(self._files),
+			"queued_bytes": self.queuedBytes,
+			"written_bytes": self.writtenBytes,
+			"flushes": self.flushes,
+			"flush_latency": self.flushLatency,
+			"max_flush_latency": self.maxFlushLatency,
+			"mean_flush_latency": self.totalFlushLatency / self.flushes if self.flushes else 0.,
+			"syncs": self.syncs,
+			"sync_latency": self.syncLatency,
+			"max_sync_latency": self.maxSyncLatency
+		}
+
+	def _queued (self, logFile, size):
+		self.queuedBytes += size
+
+		if logFile.bufferedBytes >= self.bufferSize:
+			self.flushFile(logFile)
+
+	def _write (self, files, sync = False, close = False):
+		queued = time.time()
+		state = {}
+
+		def _start ():
+			# Buffers are taken on the reactor thread, so that any further
+			# writes go into new buffers while these are being written.
+			writes = [(logFile._fp, logFile._take()) for logFile in files]
+			state['size'] = sum(len(data) for fp, data in writes)
+
+			for logFile in files:
+				logFile._pending = None
+
+			return threads.deferToThread(_job, writes)
+
+		def _job (writes):
+			for fp, data in writes:
+				if len(data):
+					fp.write(data)
+				fp.flush()
+
+			written = time.time()
+
+			if sync:
+				for fp, data in writes:
+					os.fsync(fp.fileno())
+
+			if close:
+				for fp, data in writes:
+					fp.close()
+
+			return written, time.time() - written
+
+		def _done (result):
+			written, syncLatency = result
+
+			self.writtenBytes += state['size']
+			self.flushes += 1
+			self.flushLatency = written - queued
+			self.maxFlushLatency = max(self.maxFlushLatency, self.flushLatency)
+			self.totalFlushLatency += self.flushLatency
+
+			if sync:
+				self.syncs += 1
+				self.syncLatency = syncLatency
+				self.maxSyncLatency = max(self.maxSyncLatency, syncLatency)
+
+		def _finally (result):
+			self.queuedBytes -= state.get('size', 0)
+			return result
+
+		d = self._lock.run(_start)
+		d.addBoth(_finally)
+		d.addCallbacks(_done, log.err)
+
+		return d
@@ -1,6 +1,17 @@
 from time import time as now
 from octopus.data import Variable
 
+import struct
+import numpy as np
+
+# Capability with which a client asks for stream data in binary frames
+BINARY_STREAMS = 'encoding:binary-streams'
+
+# Limits on the interval, in seconds, at which stream data and
+# property values are pushed to subscribed clients.
+MIN_PUSH_INTERVAL = 0.1
+MAX_PUSH_INTERVAL = 10
+
 def _format (variable):
 	if variable.value is None:
 		if variable.type in (float, int):
@@ -14,6 +25,57 @@ def _format (variable):
 
 	return str(variable)
 
+def _compress (points, zero):
+	def _point (point):
+		try:
+			return (round(point[0] - zero, 1), round(point[1], 2))
+		except TypeError:
+			return 0
+
+	return list(map(_point, points))
+
+def _float (value):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return np.nan
+
+def _packString (value):
+	data = str(value).encode('utf-8')
+	return struct.pack('<H', len(data)) + data
+
+def _packStreams (sketch, experiment, zero, end, streams, oneoff = False, push = False):
+	""" Pack stream data into a binary frame.
+
+	All numbers are little-endian. The header is a uint8 frame type
+	(1, streams), uint8 flags (1 = oneoff, 2 = push), uint16 number of
+	streams, float64 zero and float64 max, followed by the sketch and
+	experiment ids. Each stream is then its name, a uint32 number of
+	points n, n float32 times relative to zero and n float64 values
+	(NaN where a value is not a number). Strings are a uint16 length
+	followed by UTF-8. """
+
+	parts = [
+		struct.pack('<BBHdd', 1, oneoff | push << 1, len(streams), zero, end),
+		_packString(sketch.id),
+		_packString(experiment.id)
+	]
+
+	for name, points in streams:
+		times = np.fromiter((point[0] for point in points), np.float64, len(points))
+
+		try:
+			values = np.fromiter((point[1] for point in points), np.float64, len(points))
+		except (TypeError, ValueError):
+			values = np.array([_float(point[1]) for point in points], np.float64)
+
+		parts.append(_packString(name))
+		parts.append(struct.pack('<I', len(points)))
+		parts.append((times - zero).astype('<f4').tobytes())
+		parts.append(values.astype('<f8').tobytes())
+
+	return b''.join(parts)
+
 class ExperimentProtocol (object):
 	def __init__ (self, transport):
 		self.transport = transport
@@ -63,6 +125,11 @@ class ExperimentProtocol (object):
 
 				return self.sendStreams(sketch, experiment, streams, payload['start'], end, context, oneoff)
 
+			if topic == 'subscribe':
+				return self.subscribe(sketch, experiment, payload, context)
+			if topic == 'unsubscribe':
+				return context.stopExperimentPush(experiment)
+
 			if topic == 'set-property':
 				return self.setProperty(sketch, experiment, payload['variable'], payload['value'], context)
 
@@ -146,35 +213,151 @@ class ExperimentProtocol (object):
 		variables = experiment.variables()
 		interval = end - start
 
-		def _compress (point):
-			try:
-				return (round(point[0] - start, 1), round(point[1], 2))
-			except TypeError:
-				return 0
+		return self._sendStreams(
+			sketch, experiment, start, end,
+			[(name, variables[name].get(start, interval)) for name in streams],
+			context,
+			oneoff = oneoff
+		)
+
+	def _sendStreams (self, sketch, experiment, zero, end, streams, context, oneoff = False, push = False):
+		""" Send a list of (name, points) pairs, as a binary frame if
+		the client has enabled binary streams, or as JSON otherwise. """
+
+		if self.transport.supports(BINARY_STREAMS, context):
+			return self.transport.sendBinary(
+				_packStreams(sketch, experiment, zero, end, streams, oneoff, push),
+				context,
+				push = push
+			)
 
 		payload = {
 			"sketch": sketch.id,
 			"experiment": experiment.id,
-			"zero": round(start, 1),
-			"max": round(start + interval, 1),
+			"zero": round(zero, 1),
+			"max": round(end, 1),
 			"data": [
-				{
-					"name": name,
-					"data": map(_compress, variables[name].get(start, interval))
-				}
-				for name in streams
+				{ "name": name, "data": _compress(points, zero) }
+				for name, points in streams
 			]
 		}
 
 		if oneoff:
 			payload['oneoff'] = True
 
+		if push:
+			payload['push'] = True
+
 		return self.send(
 			'streams',
 			payload,
 			context
 		)
 
+	def subscribe (self, sketch, experiment, payload, context):
+		""" Push stream data and property values to the client, rather
+		than the client polling with get-streams and get-properties.
+
+		The streams and properties are chosen as with choose-streams and
+		choose-properties. Every `interval` seconds (as requested by the
+		client, within MIN_PUSH_INTERVAL and MAX_PUSH_INTERVAL), the
+		points of each stream since the last push, and the properties
+		whose values have changed, are sent. Stream data starts from
+		`start` (default: one minute ago) for streams which have not
+		been sent to this client before. """
+
+		if 'streams' in payload:
+			context.chooseExperimentStreams(experiment, payload['streams'])
+
+		if 'properties' in payload:
+			context.chooseExperimentProperties(experiment, payload['properties'])
+
+		try:
+			interval = float(payload.get('interval', 1))
+			start = float(payload.get('start', now() - 60))
+		except (TypeError, ValueError):
+			raise Error("[experiment:subscribe] Invalid interval or start")
+
+		interval = min(max(interval, MIN_PUSH_INTERVAL), MAX_PUSH_INTERVAL)
+		state = context.getExperimentPushState(experiment)
+		sent = state['sent']
+		values = state['values']
+		cache = { "version": None, "variables": {} }
+
+		def _variable (name):
+			# Only rebuild the variables list once variables have been
+			# added, removed or renamed, so that names which do not
+			# exist (yet) are not looked up again on every push
+			version = sketch.workspace.variables.version
+
+			if cache["version"] != version:
+				cache["variables"] = experiment.variables()
+				cache["version"] = version
+
+			return cache["variables"].get(name)
+
+		def _push ():
+			if sketch.experiment is not experiment:
+				return context.stopExperimentPush(experiment)
+
+			# Skip a client which is not keeping up. Nothing is marked
+			# as sent, so the next push carries on from the same point.
+			if context.isCongested():
+				return
+
+			end = now()
+			streams = []
+
+			for name in context.getExperimentStreams(experiment):
+				variable = _variable(name)
+
+				if variable is None:
+					continue
+
+				last = sent.get(name)
+				since = start if last is None else last
+				points = [
+					point for point in variable.get(since, end - since)
+					if last is None or point[0] > last
+				]
+
+				if len(points):
+					sent[name] = points[-1][0]
+					streams.append((name, points))
+
+			if len(streams):
+				zero = min(points[0][0] for name, points in streams)
+				self._sendStreams(sketch, experiment, zero, end, streams, context, push = True)
+
+			changed = {}
+
+			for name in context.getExperimentProperties(experiment):
+				variable = _variable(name)
+
+				if variable is None:
+					continue
+
+				value = _format(variable)
+
+				if name not in values or values[name] != value:
+					changed[name] = values[name] = value
+
+			if len(changed):
+				self.send('properties', {
+					"sketch": sketch.id,
+					"experiment": experiment.id,
+					"push": True,
+					"data": changed
+				}, context)
+
+		self.send('subscribed', {
+			"sketch": sketch.id,
+			"experiment": experiment.id,
+			"interval": interval
+		}, context)
+
+		context.startExperimentPush(experiment, interval, _push)
+
 
 class Error (Exception):
 	pass
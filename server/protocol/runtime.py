@@ -21,11 +21,18 @@ class RuntimeProtocol (object):
 		except KeyError:
 			capabilities = []
 
-		self.send('runtime', {
+		response = {
 			"type": name,
 			"version": self.transport.version,
 			"capabilities": capabilities
-		}, context)
+		}
+
+		# Optional capabilities (e.g. binary encodings) are only used
+		# once the client asks for them.
+		if payload is not None and 'capabilities' in payload:
+			response['enabled'] = self.transport.enableCapabilities(payload['capabilities'], context)
+
+		self.send('runtime', response, context)
 
 	def receivePacket (self, payload, context):
 		self.send('error', Error('Packets not supported yet'), context)
@@ -1,4 +1,5 @@
 from ..sketch import Sketch
+from ..util import JSONFragment
 
 from twisted.internet import reactor
 
@@ -22,6 +23,9 @@ class SketchProtocol (object):
 			if topic == 'rename':
 				return sketch.renameSketch({ 'title': payload['title'] }, context)
 
+			if topic == 'validate':
+				return self.validateSketch(sketch, context)
+
 		except Error as e:
 			return self.send('error', e, context)
 
@@ -31,11 +35,6 @@ class SketchProtocol (object):
 
 		id = payload["sketch"]
 
-		def _onEvent (protocol, topic, payload):
-			# is id already in the data?
-			payload['sketch'] = id
-			self.transport.send(protocol, topic, payload, context)
-
 		def _sendData (sketch):
 			blockStates = {
 				block.id: block.state.name.lower()
@@ -46,7 +45,7 @@ class SketchProtocol (object):
 			sketchData = {
 				"sketch": sketch.id,
 				"title": sketch.title,
-				"events": sketch.workspace.toEvents(),
+				"events": JSONFragment(sketch.workspace.toEventsJSON()),
 				"state": sketch.workspace.state.name.lower(),
 				"block-states": blockStates
 			}
@@ -62,12 +61,12 @@ class SketchProtocol (object):
 		except KeyError:
 			pass
 		else:
-			sketch.subscribe(context, _onEvent)
+			sketch.subscribe(context, transport = self.transport)
 			return _sendData(sketch)
 
 		def _done (data):
 			self.transport.sketches[id] = sketch
-			sketch.subscribe(context, _onEvent)
+			sketch.subscribe(context, transport = self.transport)
 			return _sendData(sketch)
 
 		def _error (failure):
@@ -86,6 +85,15 @@ class SketchProtocol (object):
 
 		return sketch.load().addCallbacks(_done, _error)
 
+	def validateSketch (self, sketch, context):
+		""" Check the sketch's variable dependencies without
+		running it, and send the results to the client. """
+
+		result = sketch.workspace.validate()
+		result['sketch'] = sketch.id
+
+		self.send('validate', result, context)
+
 
 class Error (Exception):
 	pass
@@ -1,5 +1,6 @@
 # Package imports
 from ..workspace import Block, Disconnected, Cancelled, Aborted, anyOfStackIs
+from ..expressions import Expression
 
 # Octopus Imports
 from octopus.constants import State
@@ -312,7 +313,7 @@ class controls_wait (Block):
 class controls_wait_until (Block):
 	def _run (self):
 		complete = defer.Deferred()
-		self._variables = []
+		self._expression = None
 
 		@defer.inlineCallbacks
 		def runTest (data = None):
@@ -325,7 +326,7 @@ class controls_wait_until (Block):
 				defer.returnValue(None)
 
 			try:
-				result = yield self.getInputValue("CONDITION", True)
+				changed, result = yield self._expression.evaluate()
 			except Exception as e:
 				removeListeners()
 				complete.errback(e)
@@ -334,32 +335,25 @@ class controls_wait_until (Block):
 					done()
 
 		def setListeners (data = None):
-			for v in self._variables:
-				v.off('change', runTest)
-
-			try:
-				self._variables = set(self.getInput("CONDITION").getReferencedVariables())
-			except AttributeError:
-				self._variables = []
-
-			for v in self._variables:
-				v.on('change', runTest)
+			if self._expression is not None:
+				self._expression.dispose()
 
+			self._expression = Expression(self, "CONDITION", runTest, default = True)
 			runTest()
 
 		def removeListeners ():
 			self.off("connectivity-changed", setListeners)
-			self.off("value-changed", runTest)
+			self.off("value-changed", setListeners)
 
-			for v in self._variables:
-				v.off('change', runTest)
+			self._expression.dispose()
 
 		def done ():
 			removeListeners()
 			complete.callback(None)
 
+		# The expression is rebuilt if any of its fields change
 		self.on("connectivity-changed", setListeners)
-		self.on("value-changed", runTest)
+		self.on("value-changed", setListeners)
 
 		setListeners()
 
@@ -367,12 +361,12 @@ class controls_wait_until (Block):
 
 
 class controls_maketime (Block):
-	def eval (self):
+	def calculate (self, inputValue):
 		hour = float(self.getFieldValue('HOUR'))
 		minute = float(self.getFieldValue('MINUTE'))
 		second = float(self.getFieldValue('SECOND'))
 
-		return defer.succeed(hour * 3600 + minute * 60 + second)
+		return hour * 3600 + minute * 60 + second
 
 
 class controls_whileUntil (Block):
@@ -1,5 +1,6 @@
 # Package Imports
 from ..workspace import Block, Disconnected, Cancelled
+from ..expressions import Expression, same
 from .variables import lexical_variable
 
 # Octopus Imports
@@ -67,7 +68,7 @@ class controls_bind (lexical_variable, Block):
 
 	def _run (self):
 		self._run_complete = defer.Deferred()
-		self._variables = []
+		self._expression = None
 
 		self.on("connectivity-changed", self._setListeners)
 		self.on("value-changed", self._setListeners)
@@ -81,8 +82,13 @@ class controls_bind (lexical_variable, Block):
 			return
 
 		try:
-			result = yield self.getInputValue("VALUE")
-			self._getVariable().set(result)
+			changed, result = yield self._expression.evaluate()
+			variable = self._getVariable()
+
+			# Only set the variable if it does not hold the value already.
+			# Another block (or the user) may have set it since.
+			if not same(variable.value, result):
+				variable.set(result)
 		except (AttributeError, Disconnected, Cancelled):
 			# May get an AttributeError if the variable has been
 			# changed and become None.
@@ -94,25 +100,18 @@ class controls_bind (lexical_variable, Block):
 			self._run_complete.errback(e)
 
 	def _setListeners (self, data = None):
-		for v in self._variables:
-			v.off('change', self._runUpdate)
-
-		try:
-			self._variables = set(self.getInput("VALUE").getReferencedVariables())
-		except (KeyError, AttributeError):
-			self._variables = []
-
-		for v in self._variables:
-			v.on('change', self._runUpdate)
+		if self._expression is not None:
+			self._expression.dispose()
 
+		self._expression = Expression(self, "VALUE", self._runUpdate)
 		self._runUpdate()
 
 	def _removeListeners (self):
 		self.off("connectivity-changed", self._setListeners)
 		self.off("value-changed", self._setListeners)
 
-		for v in self._variables:
-			v.off('change', self._runUpdate)
+		if self._expression is not None:
+			self._expression.dispose()
 
 	def _cancel (self, abort = False):
 		self._removeListeners()
@@ -129,7 +128,7 @@ class controls_statemonitor (Block):
 
 	def _run (self):
 		self._run_complete = defer.Deferred()
-		self._variables = []
+		self._expressions = []
 
 		self.on("connectivity-changed", self.setListeners)
 		self.on("value-changed", self.setListeners)
@@ -145,22 +144,26 @@ class controls_statemonitor (Block):
 		elif self.state is not State.RUNNING:
 			return
 
-		inputValues = [
-			input.eval()
-			for name, input in self.inputs.items()
-			if input is not None and name[:4] == "TEST"
-		]
-		results = yield defer.DeferredList(inputValues, consumeErrors = True)
+		results = yield defer.DeferredList([
+			defer.maybeDeferred(expression.evaluate)
+			for expression in self._expressions
+		], consumeErrors = True)
 
 		ok = True
+		changed = len(self._expressions) == 0
 		for success, result in results:
 			if success:
-				ok &= bool(result)
+				changed |= result[0]
+				ok &= bool(result[1])
 			else:
-				# Ignore if Disconnected or Cancelled.
 				# TODO: log a warning if an exception.
 				pass
 
+		# Nothing to do if none of the inputs have changed, unless
+		# the trigger is still due (TRIGGER may have been running)
+		if not changed and (self._triggered or ok):
+			return
+
 		# Reset if already triggered and inputs now OK.
 		if self._triggered and self.auto_reset and ok:
 			self.resetTrigger()
@@ -200,24 +203,15 @@ class controls_statemonitor (Block):
 				return
 
 	def setListeners (self, data = None):
-		for v in self._variables:
-			v.off('change', self.runUpdate)
+		for expression in self._expressions:
+			expression.dispose()
 
-		self._variables = []
-		inputs = [
-			input
+		# Disconnected or cancelled inputs are treated as OK
+		self._expressions = [
+			Expression(self, name, self.runUpdate, default = True)
 			for name, input in self.inputs.items()
 			if input is not None and name[:4] == "TEST"
 		]
-		for input in inputs:
-			try:
-				self._variables.extend(input.getReferencedVariables())
-			except AttributeError:
-				pass
-
-		self._variables = set(self._variables)
-		for v in self._variables:
-			v.on('change', self.runUpdate)
 
 		self.runUpdate()
 
@@ -225,8 +219,8 @@ class controls_statemonitor (Block):
 		self.off("connectivity-changed", self.setListeners)
 		self.off("value-changed", self.setListeners)
 
-		for v in self._variables:
-			v.off('change', self.runUpdate)
+		for expression in self._expressions:
+			expression.dispose()
 
 	def _cancel (self, abort = False):
 		self.removeListeners()
@@ -5,27 +5,25 @@ import operator
 
 
 class logic_null (Block):
-	def eval (self):
-		return defer.succeed(None)
+	def calculate (self, inputValue):
+		return None
 
 
 class logic_boolean (Block):
-	def eval (self):
-		return defer.succeed(self.fields['BOOL'] == 'TRUE')
+	def calculate (self, inputValue):
+		return self.fields['BOOL'] == 'TRUE'
 
 
 class logic_negate (Block):
 	outputType = bool
 
-	def eval (self):
-		def negate (result):
-			if result is None:
-				return None
+	def calculate (self, inputValue):
+		result = inputValue('BOOL')
 
-			return result == False
+		if result is None:
+			return None
 
-		self._complete = self.getInputValue('BOOL').addCallback(negate)
-		return self._complete
+		return result == False
 
 
 class logic_compare (Block):
@@ -40,29 +38,42 @@ class logic_compare (Block):
 		"GTE": operator.ge
 	}
 
-	def eval (self):
-		def compare (results):
-			lhs, rhs = results
+	def calculate (self, inputValue):
+		lhs = inputValue('A')
+		rhs = inputValue('B')
 
-			if lhs is None or rhs is None:
-				return None
+		if lhs is None or rhs is None:
+			return None
 
-			op = self._map[self.fields['OP']]
-			return op(lhs, rhs)
+		return self._map[self.fields['OP']](lhs, rhs)
 
-			# Emit a warning if bad op given
 
-		lhs = self.getInputValue('A')
-		rhs = self.getInputValue('B')
+class logic_operation (Block):
+	outputType = bool
 
-		self._complete = defer.gatherResults([lhs, rhs]).addCallback(compare)
-		return self._complete
+	def calculate (self, inputValue):
+		op = self.fields['OP']
+		lhs = inputValue('A')
 
+		if lhs is None or op not in ("AND", "OR"):
+			return None
 
-class logic_operation (Block):
-	outputType = bool
+		# Only evaluate B if it is needed
+		if bool(lhs) is (op == "OR"):
+			return bool(lhs)
+
+		rhs = inputValue('B')
+
+		if rhs is None:
+			return None
+
+		return bool(rhs)
 
 	def eval (self):
+		if self.isPure():
+			return Block.eval(self)
+
+		# Only evaluate B if it is needed
 		@defer.inlineCallbacks
 		def _run ():
 			op = self.fields['OP']
@@ -102,8 +113,20 @@ class logic_operation (Block):
 class logic_ternary (Block):
 	# TODO: outputType of then and else should be the same.
 	# this is then the outputType of the logic_ternary block.
-	
+
+	def calculate (self, inputValue):
+		test = inputValue('IF')
+
+		if test is None:
+			return None
+
+		return inputValue('THEN' if bool(test) else 'ELSE')
+
 	def eval (self):
+		if self.isPure():
+			return Block.eval(self)
+
+		# Only evaluate the branch that is taken
 		@defer.inlineCallbacks
 		def _run ():
 			test = yield self.getInputValue('IF')
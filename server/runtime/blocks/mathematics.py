@@ -15,12 +15,12 @@ import numpy
 
 
 class math_number (Block):
-	def eval (self):
+	def calculate (self, inputValue):
 		number = float(self.fields['NUM'])
 		if '.' not in str(self.fields['NUM']):
 			number = int(number)
 
-		return defer.succeed(number)
+		return number
 
 
 class math_constant (Block):
@@ -33,10 +33,8 @@ class math_constant (Block):
 		"INFINITY": float('inf')
 	}
 
-	def eval (self):
-		return defer.succeed(self._map[self.fields['CONSTANT']])
-
-		# Emit a warning if bad op given
+	def calculate (self, inputValue):
+		return self._map[self.fields['CONSTANT']]
 
 
 class math_single (Block):
@@ -52,18 +50,13 @@ class math_single (Block):
 		"POW10": lambda x: math.pow(10, x)
 	}
 
-	def eval (self):
-		def calculate (result):
-			if result is None:
-				return None
-
-			op = self._map[self.fields['OP']]
-			return op(result)
+	def calculate (self, inputValue):
+		result = inputValue('NUM')
 
-			# Emit a warning if bad op given
+		if result is None:
+			return None
 
-		self._complete = self.getInputValue('NUM').addCallback(calculate)
-		return self._complete
+		return self._map[self.fields['OP']](result)
 
 
 class math_trig (math_single):
@@ -97,23 +90,14 @@ class math_arithmetic (Block):
 		"POWER": math.pow
 	}
 
-	def eval (self):
-		def calculate (results):
-			lhs, rhs = results
-
-			if lhs is None or rhs is None:
-				return None
-
-			op = self._map[self.fields['OP']]
-			return op(lhs, rhs)
-
-			# Emit a warning if bad op given
+	def calculate (self, inputValue):
+		lhs = inputValue('A')
+		rhs = inputValue('B')
 
-		lhs = self.getInputValue('A')
-		rhs = self.getInputValue('B')
+		if lhs is None or rhs is None:
+			return None
 
-		self._complete = defer.gatherResults([lhs, rhs]).addCallback(calculate)
-		return self._complete
+		return self._map[self.fields['OP']](lhs, rhs)
 
 
 class math_number_property (Block):
@@ -125,71 +109,44 @@ class math_number_property (Block):
 		"NEGATIVE": lambda x: x < 0,
 	}
 
-	def eval (self):
+	def calculate (self, inputValue):
 		if self.fields['PROPERTY'] == "DIVISIBLE_BY":
-			def calculatedivby (results):
-				lhs, rhs = results
-
-				return float(lhs) % float(rhs) == 0
-
-			lhs = self.getInputValue('NUMBER_TO_CHECK')
-			rhs = self.getInputValue('DIVISOR')
-
-			self._complete = defer.gatherResults([lhs, rhs]).addCallback(calculatedivby)
+			lhs = inputValue('NUMBER_TO_CHECK')
+			rhs = inputValue('DIVISOR')
 
-			return self._complete
+			return float(lhs) % float(rhs) == 0
 
-		def calculate (result):
-			op = self._map[self.fields['PROPERTY']]
-			return op(float(result))
-
-			# Emit a warning if bad op given
-
-		self._complete = self.getInputValue('NUMBER_TO_CHECK').addCallback(calculate)
-		return self._complete
+		op = self._map[self.fields['PROPERTY']]
+		return op(float(inputValue('NUMBER_TO_CHECK')))
 
 
 class math_modulo (Block):
 	# TODO: int if a and b are ints.
 	outputType = float
 
-	def eval (self):
-		def calculate (results):
-			a, b = results
-
-			if a is None or b is None:
-				return None
+	def calculate (self, inputValue):
+		a = inputValue('DIVIDEND')
+		b = inputValue('DIVISOR')
 
-			return operator.mod(a, b)
+		if a is None or b is None:
+			return None
 
-		self._complete = defer.gatherResults([
-			self.getInputValue('DIVIDEND'),
-			self.getInputValue('DIVISOR')
-		]).addCallback(calculate)
-
-		return self._complete
+		return operator.mod(a, b)
 
 
 class math_constrain (Block):
 	# TODO: int if val, low and high are all ints.
 	outputType = float
 
-	def eval (self):
-		def calculate (results):
-			val, low, high = results
-
-			if val is None or low is None or high is None:
-				return None
+	def calculate (self, inputValue):
+		val = inputValue('VALUE')
+		low = inputValue('LOW')
+		high = inputValue('HIGH')
 
-			return min(max(val, low), high)
+		if val is None or low is None or high is None:
+			return None
 
-		self._complete = defer.gatherResults([
-			self.getInputValue('VALUE'),
-			self.getInputValue('LOW'),
-			self.getInputValue('HIGH')
-		]).addCallback(calculate)
-
-		return self._complete
+		return min(max(val, low), high)
 
 
 class math_random_int (Block):
@@ -1,4 +1,5 @@
-from ..workspace import Block, Disconnected, Cancelled
+from ..workspace import Block
+from ..expressions import Expression, same
 
 try:
 	import SimpleCV
@@ -35,7 +36,7 @@ class global_declaration (Block):
 		return "global.global::" + (name or self.getFieldValue('NAME', ''))
 
 	def created (self):
-		self._variables = []
+		self._expression = None
 
 		# Deal with name changes
 		@self.on('value-changed')
@@ -52,16 +53,10 @@ class global_declaration (Block):
 
 	# Set up event listeners whenever connections change
 	def _onConnectivityChanged (self, data = None):
-		for v in self._variables:
-			v.off('change', self._onChange)
+		if self._expression is not None:
+			self._expression.dispose()
 
-		try:
-			self._variables = set(self.getInput('VALUE').getReferencedVariables())
-		except (KeyError, AttributeError):
-			self._variables = []
-
-		for v in self._variables:
-			v.on('change', self._onChange)
+		self._expression = Expression(self, 'VALUE', self._onChange, default = None)
 
 	# Handle any changes in variables
 	@defer.inlineCallbacks
@@ -69,15 +64,22 @@ class global_declaration (Block):
 		if self.workspace.state not in (State.RUNNING, State.PAUSED):
 			return
 
-		try:
-			result = yield self.getInput('VALUE').eval()
-		except (KeyError, AttributeError, Disconnected, Cancelled):
+		if self._expression.input is None:
+			return
+
+		changed, result = yield self._expression.evaluate()
+
+		# Disconnected or cancelled inputs evaluate to None
+		if result is None:
 			return
 
 		variable = self.workspace.variables[self._varName()]
 
 		try:
-			yield variable.set(result)
+			# Another block (or the user) may have set the variable
+			# since it was last set here.
+			if not same(variable.value, result):
+				yield variable.set(result)
 		except AttributeError:
 			pass
 		except:
@@ -115,8 +117,7 @@ class global_declaration (Block):
 		self._onConnectivityChanged()
 
 	def disposed (self):
-		for v in self._variables:
-			v.off('change', self._onChange)
+		self._expression.dispose()
 
 		self.workspace.variables.remove(self._varName())
 
@@ -193,18 +194,18 @@ class lexical_variable_set_to (lexical_variable_set):
 
 
 class lexical_variable_get (lexical_variable):
-	def eval (self):
+	def calculate (self, inputValue):
 		try:
 			variable = self._getVariable()
 			self.outputType = variable.type
-			return defer.succeed(variable.value)
+			return variable.value
 		except (AttributeError):
 			self.emitLogMessage(
 				"Unknown variable: " + str(self.getFieldValue('VAR')),
 				"error"
 			)
 
-			return defer.succeed(None)
+			return None
 
 
 class math_change (lexical_variable_set):
@@ -0,0 +1,437 @@
+#
+# Compilation of pure block subtrees to Python functions
+#
+# A subtree of maths, logic and text blocks is translated into the body
+# of a Python function, with a temporary variable for the value of each
+# block, and compiled with ast and compile(). The function computes the
+# same values as calculate() would, including returning None if an input
+# is None and only evaluating the inputs of logic_operation and
+# logic_ternary which are needed. Blocks which cannot be compiled, and
+# lexical_variable_get, are called from the function.
+#
+# The compiled code is cached by the structure of the subtree (the types,
+# fields and connections of its blocks), so that identical subtrees, or a
+# subtree which is reconnected, are only compiled once. Each block keeps
+# its own function until its subtree changes (see Block.compiled()).
+#
+
+# Python Imports
+import ast
+import operator
+
+# Package Imports
+from ..util import LRUCache
+
+
+# Compiled code, by structure. Entries are (factory, leaves).
+cache = LRUCache(256)
+
+_binaryOperators = {
+	operator.add: ast.Add,
+	operator.sub: ast.Sub,
+	operator.mul: ast.Mult,
+	operator.truediv: ast.Div,
+	operator.mod: ast.Mod
+}
+
+_comparisonOperators = {
+	operator.eq: ast.Eq,
+	operator.ne: ast.NotEq,
+	operator.lt: ast.Lt,
+	operator.le: ast.LtE,
+	operator.gt: ast.Gt,
+	operator.ge: ast.GtE
+}
+
+_literals = (int, float, str, bool, type(None))
+
+
+def compileBlock (block):
+	""" Returns a function with no arguments which returns the value of
+	block, or None if the block cannot be compiled (or has no inputs,
+	so compiling it would not help). """
+
+	if block.type not in _compilers \
+	or all(input is None for input in block.inputs.values()):
+		return None
+
+	key = _structure(block)
+	entry = cache.get(key)
+
+	if entry is None:
+		compiler = _Compiler()
+		body = []
+
+		# The block itself must be compiled, rather than called
+		try:
+			result = _compilers[block.type](compiler, block, (), body)
+		except Unsupported:
+			return None
+
+		entry = (compiler.build(body, result), compiler.leaves)
+		cache.set(key, entry)
+
+	factory, leaves = entry
+
+	return factory(*[
+		getattr(_follow(block, path), method)
+		for path, method in leaves
+	])
+
+def _structure (block):
+	return (
+		block.type,
+		tuple(sorted(block.fields.items())),
+		tuple(
+			(name, () if input is None else _structure(input))
+			for name, input in sorted(block.inputs.items())
+		)
+	)
+
+def _follow (block, path):
+	for name in path:
+		block = block.inputs[name]
+
+	return block
+
+
+class Unsupported (Exception):
+	""" Raised by a block's compiler, before it has added any
+	statements, if the block must be called instead. """
+
+
+class _Compiler (object):
+	def __init__ (self):
+		# (path, method) of the blocks called from the function
+		self.leaves = []
+		self.constants = {}
+		self._temporaries = 0
+
+	def compile (self, block, path, body):
+		""" Adds statements computing the value of block to body, and
+		returns an expression (a name or constant) for the value. """
+
+		function = _compilers.get(block.type)
+
+		if function is not None:
+			try:
+				return function(self, block, path, body)
+			except Unsupported:
+				pass
+
+		return self.leaf(block, path, body)
+
+	def input (self, block, path, inputName, body, default = False):
+		input = block.inputs.get(inputName)
+
+		if input is None:
+			return self.constant(default)
+
+		return self.compile(input, path + (inputName,), body)
+
+	def leaf (self, block, path, body, method = "evalSync", *args):
+		name = "_l{:d}".format(len(self.leaves))
+		self.leaves.append((path, method))
+
+		return self.assign(body, ast.Call(
+			func = ast.Name(id = name, ctx = ast.Load()),
+			args = [self.constant(arg) for arg in args],
+			keywords = []
+		))
+
+	def constant (self, value):
+		if type(value) in _literals:
+			return ast.Constant(value = value)
+
+		# Other values, such as functions, are globals of the code
+		name = "_c{:d}".format(len(self.constants))
+		self.constants[name] = value
+
+		return ast.Name(id = name, ctx = ast.Load())
+
+	def assign (self, body, value, name = None):
+		if name is None:
+			name = self.temporary()
+
+		body.append(ast.Assign(
+			targets = [ast.Name(id = name, ctx = ast.Store())],
+			value = value
+		))
+
+		return ast.Name(id = name, ctx = ast.Load())
+
+	def temporary (self):
+		self._temporaries += 1
+		return "_t{:d}".format(self._temporaries)
+
+	def call (self, function, *args):
+		if isinstance(function, str):
+			function = ast.Name(id = function, ctx = ast.Load())
+		else:
+			function = self.constant(function)
+
+		return ast.Call(func = function, args = list(args), keywords = [])
+
+	def unlessNone (self, body, values, expression):
+		""" Assigns expression, or None if any of values is None. """
+
+		# Only values which are not constants need to be tested
+		if any(isinstance(value, ast.Constant) and value.value is None for value in values):
+			return self.constant(None)
+
+		test = [
+			ast.Compare(left = value, ops = [ast.Is()], comparators = [ast.Constant(value = None)])
+			for value in values
+			if not isinstance(value, ast.Constant)
+		]
+
+		if len(test) == 0:
+			return self.assign(body, expression)
+
+		return self.assign(body, ast.IfExp(
+			test = test[0] if len(test) == 1 else ast.BoolOp(op = ast.Or(), values = test),
+			body = ast.Constant(value = None),
+			orelse = expression
+		))
+
+	def build (self, body, result):
+		""" Compiles body into a factory, which is passed the leaf
+		functions and returns the function for a block. """
+
+		source = "def _factory({:s}):\n\tdef _expression():\n\t\tpass\n\treturn _expression\n".format(
+			", ".join("_l{:d}".format(i) for i in range(len(self.leaves)))
+		)
+
+		module = ast.parse(source)
+		function = module.body[0].body[0]
+		function.body = body + [ast.Return(value = result)]
+		ast.fix_missing_locations(module)
+
+		namespace = dict(self.constants)
+		exec(compile(module, "<blocks>", "exec"), namespace)
+
+		return namespace["_factory"]
+
+
+#
+# Compilers for each block type. Each adds statements computing the
+# value of the block to body and returns an expression for it, or
+# raises Unsupported.
+#
+
+def _constant (compiler, block, path, body):
+	try:
+		return compiler.constant(block.calculate(None))
+	except Exception:
+		raise Unsupported
+
+def _single (compiler, block, path, body):
+	try:
+		op = block._map[block.fields['OP']]
+	except KeyError:
+		raise Unsupported
+
+	value = compiler.input(block, path, 'NUM', body)
+
+	return compiler.unlessNone(body, [value], compiler.call(op, value))
+
+def _arithmetic (compiler, block, path, body):
+	try:
+		op = block._map[block.fields['OP']]
+	except KeyError:
+		raise Unsupported
+
+	lhs = compiler.input(block, path, 'A', body)
+	rhs = compiler.input(block, path, 'B', body)
+
+	if op in _binaryOperators:
+		expression = ast.BinOp(left = lhs, op = _binaryOperators[op](), right = rhs)
+	else:
+		expression = compiler.call(op, lhs, rhs)
+
+	return compiler.unlessNone(body, [lhs, rhs], expression)
+
+def _compare (compiler, block, path, body):
+	try:
+		op = _comparisonOperators[block._map[block.fields['OP']]]
+	except KeyError:
+		raise Unsupported
+
+	lhs = compiler.input(block, path, 'A', body)
+	rhs = compiler.input(block, path, 'B', body)
+
+	return compiler.unlessNone(body, [lhs, rhs], ast.Compare(
+		left = lhs, ops = [op()], comparators = [rhs]
+	))
+
+def _numberProperty (compiler, block, path, body):
+	property = block.fields.get('PROPERTY')
+
+	if property == "DIVISIBLE_BY":
+		lhs = compiler.input(block, path, 'NUMBER_TO_CHECK', body)
+		rhs = compiler.input(block, path, 'DIVISOR', body)
+
+		return compiler.assign(body, ast.Compare(
+			left = ast.BinOp(
+				left = compiler.call("float", lhs),
+				op = ast.Mod(),
+				right = compiler.call("float", rhs)
+			),
+			ops = [ast.Eq()],
+			comparators = [ast.Constant(value = 0)]
+		))
+
+	try:
+		op = block._map[property]
+	except KeyError:
+		raise Unsupported
+
+	value = compiler.input(block, path, 'NUMBER_TO_CHECK', body)
+
+	return compiler.assign(body, compiler.call(op, compiler.call("float", value)))
+
+def _modulo (compiler, block, path, body):
+	a = compiler.input(block, path, 'DIVIDEND', body)
+	b = compiler.input(block, path, 'DIVISOR', body)
+
+	return compiler.unlessNone(body, [a, b], ast.BinOp(left = a, op = ast.Mod(), right = b))
+
+def _constrain (compiler, block, path, body):
+	value = compiler.input(block, path, 'VALUE', body)
+	low = compiler.input(block, path, 'LOW', body)
+	high = compiler.input(block, path, 'HIGH', body)
+
+	return compiler.unlessNone(body, [value, low, high], compiler.call(
+		"min", compiler.call("max", value, low), high
+	))
+
+def _negate (compiler, block, path, body):
+	value = compiler.input(block, path, 'BOOL', body)
+
+	return compiler.unlessNone(body, [value], ast.Compare(
+		left = value, ops = [ast.Eq()], comparators = [ast.Constant(value = False)]
+	))
+
+def _branch (compiler, body, test, cases):
+	""" Adds if test is None: result = None, then an elif / else for
+	each (test, function) in cases, where function adds statements to
+	a body and returns the result. Constant tests are decided here,
+	as compile() warns about "is" with a literal. """
+
+	if isinstance(test, ast.Constant) and test.value is None:
+		return compiler.constant(None)
+
+	result = compiler.temporary()
+	statements = orelse = []
+
+	for caseTest, function in cases:
+		if isinstance(caseTest, ast.Constant):
+			if not caseTest.value:
+				continue
+
+			caseTest = None
+
+		caseBody = []
+		compiler.assign(caseBody, function(caseBody), result)
+
+		if caseTest is None:
+			orelse.extend(caseBody)
+			break
+
+		case = ast.If(test = caseTest, body = caseBody, orelse = [])
+		orelse.append(case)
+		orelse = case.orelse
+
+	if isinstance(test, ast.Constant):
+		body.extend(statements)
+	else:
+		body.append(ast.If(
+			test = ast.Compare(left = test, ops = [ast.Is()], comparators = [ast.Constant(value = None)]),
+			body = [ast.Assign(
+				targets = [ast.Name(id = result, ctx = ast.Store())],
+				value = ast.Constant(value = None)
+			)],
+			orelse = statements
+		))
+
+	return ast.Name(id = result, ctx = ast.Load())
+
+def _operation (compiler, block, path, body):
+	op = block.fields.get('OP')
+	lhs = compiler.input(block, path, 'A', body)
+
+	if op not in ("AND", "OR"):
+		return compiler.constant(None)
+
+	def _rhs (caseBody):
+		rhs = compiler.input(block, path, 'B', caseBody)
+
+		if isinstance(rhs, ast.Constant):
+			return ast.Constant(value = None if rhs.value is None else bool(rhs.value))
+
+		return ast.IfExp(
+			test = ast.Compare(left = rhs, ops = [ast.Is()], comparators = [ast.Constant(value = None)]),
+			body = ast.Constant(value = None),
+			orelse = compiler.call("bool", rhs)
+		)
+
+	# Only evaluate B if it is needed
+	shortCircuit = op == "OR"
+
+	if isinstance(lhs, ast.Constant):
+		test = ast.Constant(value = bool(lhs.value) is shortCircuit)
+	elif shortCircuit:
+		test = lhs
+	else:
+		test = ast.UnaryOp(op = ast.Not(), operand = lhs)
+
+	return _branch(compiler, body, lhs, [
+		(test, lambda caseBody: ast.Constant(value = shortCircuit)),
+		(None, _rhs)
+	])
+
+def _ternary (compiler, block, path, body):
+	test = compiler.input(block, path, 'IF', body)
+
+	# Only evaluate the branch that is taken
+	return _branch(compiler, body, test, [
+		(test, lambda caseBody: compiler.input(block, path, 'THEN', caseBody)),
+		(None, lambda caseBody: compiler.input(block, path, 'ELSE', caseBody))
+	])
+
+def _join (compiler, block, path, body):
+	values = [
+		compiler.call("str", compiler.input(block, path, name, body))
+		for name in block._inputNames()
+	]
+
+	return compiler.assign(body, ast.Call(
+		func = ast.Attribute(value = ast.Constant(value = ""), attr = "join", ctx = ast.Load()),
+		args = [ast.Tuple(elts = values, ctx = ast.Load())],
+		keywords = []
+	))
+
+def _variable (compiler, block, path, body):
+	# Looks up the variable each time, as calculate() does
+	return compiler.leaf(block, path, body, "calculate", None)
+
+_compilers = {
+	"math_number": _constant,
+	"math_constant": _constant,
+	"math_single": _single,
+	"math_trig": _single,
+	"math_round": _single,
+	"math_arithmetic": _arithmetic,
+	"math_number_property": _numberProperty,
+	"math_modulo": _modulo,
+	"math_constrain": _constrain,
+	"logic_null": _constant,
+	"logic_boolean": _constant,
+	"logic_negate": _negate,
+	"logic_compare": _compare,
+	"logic_operation": _operation,
+	"logic_ternary": _ternary,
+	"text": _constant,
+	"text_join": _join,
+	"lexical_variable_get": _variable
+}
@@ -0,0 +1,174 @@
+#
+# Incremental evaluation of block expressions
+#
+# Blocks such as controls_bind and controls_wait_until re-evaluate the
+# subtree connected to one of their inputs whenever a variable that it
+# references changes. If every block in the subtree is pure (defines
+# calculate()), the subtree is compiled into a graph of nodes which are
+# evaluated synchronously, and only the nodes above the variable that
+# changed are recalculated. Subtrees which are compiled (see compiler.py)
+# are a single node. Otherwise the input is evaluated with
+# getInputValue(), as before.
+#
+
+
+class Expression (object):
+	""" The value of the input inputName of block.
+
+	onChange is called with the event data whenever a variable that
+	the input references changes. The expression must be rebuilt if the
+	blocks connected to the input, or their fields, change; dispose()
+	removes its listeners from the variables. """
+
+	def __init__ (self, block, inputName, onChange = None, default = False):
+		self.block = block
+		self.inputName = inputName
+		self.default = default
+		self.value = None
+
+		self._onChange = onChange
+		self._evaluated = False
+		self._listeners = {}
+		self._build()
+
+	def _build (self):
+		self._removeListeners()
+
+		self.input = self.block.inputs.get(self.inputName)
+		self._root = None
+		self._readers = {}
+		self._version = self.block.workspace.variables.version
+
+		if self.input is None:
+			return
+
+		if self.input.isPure():
+			self._root = self._compile(self.input, None)
+			variables = list(self._readers.keys())
+		else:
+			variables = self.input.getReferencedVariables()
+
+		for variable in set(variables):
+			def onChange (data, variable = variable):
+				self._variableChanged(variable, data)
+
+			variable.on('change', onChange)
+			self._listeners[variable] = onChange
+
+	def _compile (self, block, parent):
+		node = _Node(block, parent)
+
+		# A compiled subtree is evaluated in one call, as one node
+		if block.compiled() is None:
+			for name, input in block.inputs.items():
+				if input is not None:
+					node.inputs[name] = self._compile(input, node)
+
+		# Nodes without inputs evaluate their whole subtree, which
+		# references these variables.
+		if len(node.inputs) == 0:
+			for variable in block.getReferencedVariables():
+				self._readers.setdefault(variable, []).append(node)
+
+		return node
+
+	def _variableChanged (self, variable, data):
+		for node in self._readers.get(variable, ()):
+			node.invalidate()
+
+		if self._onChange is not None:
+			self._onChange(data)
+
+	def _removeListeners (self):
+		for variable, onChange in self._listeners.items():
+			variable.off('change', onChange)
+
+		self._listeners = {}
+
+	def dispose (self):
+		self._removeListeners()
+		self._readers = {}
+		self._root = None
+
+	def evaluate (self):
+		""" Returns (changed, value): the value of the input, and
+		whether it is different to the value returned last time.
+
+		If the input is not pure, returns a Deferred which fires with
+		(changed, value) once it has been evaluated. """
+
+		# Variables referenced by name may have been added or removed
+		if self.block.workspace.variables.version != self._version:
+			self._build()
+
+		if self.input is None:
+			return self._result(self.default)
+
+		if self._root is not None:
+			return self._result(self._root.evaluate())
+
+		return self.block.getInputValue(
+			self.inputName, self.default
+		).addCallback(self._result)
+
+	def _result (self, value):
+		changed = not (self._evaluated and same(value, self.value))
+		self._evaluated = True
+		self.value = value
+
+		return changed, value
+
+
+class _Node (object):
+	""" A pure block in an Expression. The node is dirty until its
+	value has been calculated, and again once a node below it has
+	become dirty. A clean node can have dirty inputs if it did not
+	need their values (e.g. the unused branch of logic_ternary). """
+
+	__slots__ = ("block", "parent", "inputs", "dirty", "value")
+
+	def __init__ (self, block, parent):
+		self.block = block
+		self.parent = parent
+		self.inputs = {}
+		self.dirty = True
+		self.value = None
+
+	def inputValue (self, inputName, default = False):
+		try:
+			node = self.inputs[inputName]
+		except KeyError:
+			return default
+
+		return node.evaluate()
+
+	def evaluate (self):
+		if self.dirty:
+			if len(self.inputs):
+				self.value = self.block.calculate(self.inputValue)
+			else:
+				self.value = self.block.evalSync()
+
+			self.dirty = False
+
+		return self.value
+
+	def invalidate (self):
+		node = self
+
+		while node is not None and not node.dirty:
+			node.dirty = True
+			node = node.parent
+
+
+def same (a, b):
+	""" Whether a and b are the same value (of the same type). """
+
+	if type(a) is not type(b):
+		return False
+
+	try:
+		return bool(a == b)
+	except Exception:
+		# e.g. numpy arrays
+		return False
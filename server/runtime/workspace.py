@@ -1,3 +1,6 @@
+# Python Imports
+import json
+
 # Twisted Imports
 from twisted.internet import reactor, defer, task
 from twisted.python import log
@@ -11,6 +14,7 @@ from octopus.machine import Component
 
 # Package Imports
 from ..util import EventEmitter
+from . import compiler
 
 # Debugging
 defer.Deferred.debug = True
@@ -38,6 +42,14 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 		self.topBlocks = {}
 		self.variables = Variables()
 
+		# Incremented on every change to the layout of the workspace
+		self.version = 0
+		self._serialised = None
+		self._serialisedJSON = None
+
+		# Effectiveness of the blocks' cached variable analysis
+		self.variableCache = { "hits": 0, "misses": 0, "invalidations": 0 }
+
 	def addBlock (self, id, type, fields = None, x = 0, y = 0):
 		try:
 			blockType = type
@@ -58,6 +70,7 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 
 		self.allBlocks[block.id] = block
 		self.topBlocks[block.id] = block
+		self._changed()
 
 		self.emit('top-block-added', block = block)
 
@@ -106,6 +119,7 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 		except KeyError:
 			pass
 
+		self._changed()
 		self.emit('top-block-removed', block = block)
 		block.disposed()
 
@@ -146,7 +160,8 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 
 	def _run (self):
 		self._complete = defer.Deferred()
-		dependencyGraph = []
+		dependencyGraph = DependencyIndex()
+		dependencyListeners = {}
 		runningBlocks = set()
 		externalStopBlocks = set()
 		resumeBlocks = []
@@ -186,23 +201,14 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 				return
 
 			runningBlocks.discard(block)
-			decls = block.getGlobalDeclarationNames()
-
-			# Check if any other blocks can be run
-			toRun = []
-			for item in dependencyGraph:
-				for decl in decls:
-					item["deps"].discard(decl)
-
-				if len(item["deps"]) is 0:
-					toRun.append(item)
 
+			# Run any blocks that were only waiting for the variables
+			# declared by this block.
 			# _runBlock needs to be called in the next tick (done in _runBlock)
 			# so that the dependency graph is updated before any new blocks run.
-			for item in toRun:
-				dependencyGraph.remove(item)
-				item["block"].off("connectivity-change", item["onConnectivityChange"])
-				_runBlock(item["block"])
+			for item in dependencyGraph.declare(block.getGlobalDeclarationNames()):
+				_stopWaiting(item)
+				_runBlock(item)
 
 			# Check if the experiment can be finished
 			reactor.callLater(0, _checkFinished)
@@ -236,25 +242,21 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 		# Allow access to called within scope of _blockError
 		_blockError.called = False
 
-		def _updateDependencyGraph (data = None, block = None):
-			toRemove = []
-
-			for item in dependencyGraph:
-				if block is not None and item['block'] is not block:
-					continue
-
-				# If a block is no longer a top block, remove it
-				# from the dependency graph
-				if item['block'].prevBlock is not None:
-					toRemove.append(item)
-					continue
+		def _wait (block, deps):
+			def onConnectivityChange (data):
+				# Update the dependencies of the block when
+				# blocks are connected to or disconnected from it.
+				if len(dependencyGraph.add(block, block.getUnmatchedVariableNames())) == 0:
+					_stopWaiting(block)
+					_runBlock(block)
 
-				# Update dependency list
-				item['deps'] = set(item['block'].getUnmatchedVariableNames())
+			dependencyGraph.add(block, deps)
+			dependencyListeners[block] = onConnectivityChange
+			block.on("connectivity-changed", onConnectivityChange)
 
-			for item in toRemove:
-				item['block'].off('connectivity-change', item['onConnectivityChange'])
-				dependencyGraph.remove(item)
+		def _stopWaiting (block):
+			dependencyGraph.remove(block)
+			block.off("connectivity-changed", dependencyListeners.pop(block))
 
 		# When a new top block is added, add it to the list of blocks that must
 		# complete before the run can be finished; or to the list of blocks that
@@ -276,9 +278,12 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 					errbackArgs = [block]
 				).addErrback(log.err)
 
-			_updateDependencyGraph()
-
-		self.on('top-block-removed', _updateDependencyGraph)
+		# If a waiting block is no longer a top block, remove it
+		# from the dependency graph
+		@self.on('top-block-removed')
+		def onTopBlockRemoved (data):
+			if data['block'] in dependencyGraph:
+				_stopWaiting(data['block'])
 
 		# If there are no more running blocks, stop running.
 		def _checkFinished (error = None):
@@ -287,7 +292,7 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 			if len(runningBlocks) > 0:
 				return
 
-			log.msg("Skipped blocks:" + str(dependencyGraph))
+			log.msg("Skipped blocks:" + str([block.id for block in dependencyGraph]))
 
 			if not (_blockError.called or self._complete.called):
 				_externalStop()
@@ -298,10 +303,10 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 		def _removeListeners ():
 			self.emit("workspace-stopped")
 			self.off('top-block-added', onTopBlockAdded)
-			self.off('top-block-removed', _updateDependencyGraph)
+			self.off('top-block-removed', onTopBlockRemoved)
 
-			for item in dependencyGraph:
-				item['block'].off('connectivity-change', item['onConnectivityChange'])
+			for block in dependencyGraph:
+				_stopWaiting(block)
 
 		# Cancel all blocks which must be stopped externally.
 		def _externalStop ():
@@ -312,130 +317,59 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 					pass
 
 		# Set up the dependency graph
-		allDeclaredGlobalVariables = set()
+		declarations, dependencies = self._dependencies()
+		report = self.validate(declarations, dependencies)
 		blocksToRunImmediately = []
-		dependencyError = False
-
-		# Create a list of all global variables defined in the workspace
-		for block in self.topBlocks.values():
-			allDeclaredGlobalVariables.update(block.getGlobalDeclarationNames())
-
-		def _generateOnConnectivityChange (block):
-			def onConnectivityChange (data):
-				_updateDependencyGraph(block = block)
 
-			return onConnectivityChange
+		# Check that all dependencies will be met.
+		for item in report["undefined"]:
+			self.emit(
+				"log-message",
+				level = "error",
+				message = "Referenced variable {:s} is never defined. ".format(item["variable"]),
+				block = item["block"]
+			)
 
 		# Defer blocks with dependencies until these have been met.
-		for block in self.topBlocks.values():
-			deps = set(block.getUnmatchedVariableNames())
-
-			# Check that all of these dependencies will be met.
-			for dep in deps:
-				if dep not in allDeclaredGlobalVariables:
-					self.emit(
-						"log-message",
-						level = "error",
-						message = "Referenced variable {:s} is never defined. ".format(dep),
-						block = block.id
-					)
-					dependencyError = True
-
-			if len(deps) is 0:
+		for block, deps in dependencies.items():
+			if len(deps) == 0:
 				log.msg("Block %s has no deps, running now" % block.id)
 				blocksToRunImmediately.append(block)
 
 			else:
 				log.msg("Block %s waiting for %s" % (block.id, deps))
-
-				onConnectivityChange = _generateOnConnectivityChange(block)
-				block.on("connectivity-change", onConnectivityChange)
-
-				dependencyGraph.append({
-					"block": block,
-					"deps": deps,
-					"onConnectivityChange": onConnectivityChange
-				})
+				_wait(block, deps)
 
 		# If there are no blocks that have no dependencies, then
 		# there must be a circular dependency somewhere!
-		if len(blocksToRunImmediately) == 0:
+		if not report["runnable"]:
 			self.emit(
 				"log-message",
 				level = "error",
 				message = "No blocks can run."
 			)
-			dependencyError = True
-
-		# Check for circular dependencies using a topological sorting algorithm
-		def findCircularDependencies (blocks, graph):
-			circularDeps = []
-
-			while len(blocks) > 0:
-				block = blocks.pop()
-				toRemove = []
-
-				for item in graph:
-					for decl in block["decls"]:
-						item["deps"].discard(decl)
-
-					if len(item["deps"]) is 0:
-						toRemove.append(item)
-
-				for item in toRemove:
-					graph.remove(item)
-					blocks.append(item)
-
-			# Remove any blocks that just depend on one of the
-			# circularly-dependent blocks
-			toRemove = []
-			for item in graph:
-				if len(item["decls"]) == 0:
-					toRemove.append(item)
 
-			for item in toRemove:
-				graph.remove(item)
-
-			return graph
-
-		circularDeps = findCircularDependencies(
-			blocks = [{
-				"block": block.id,
-				"position": block.position,
-				"decls": block.getGlobalDeclarationNames()
-			} for block in blocksToRunImmediately],
-			graph = [{
-				"block": item["block"].id,
-				"position": item["block"].position,
-				"deps": item["deps"].copy(),
-				"decls": item["block"].getGlobalDeclarationNames()
-			} for item in dependencyGraph]
-		)
-
-		if len(circularDeps) > 0:
+		if len(report["cycles"]) > 0:
 			self.emit(
 				"log-message",
 				level = "error",
 				message = "Circular dependencies detected:"
 			)
 
-			for item in sorted(
-				circularDeps, key = lambda item: item["position"]
-			):
-				self.emit(
-					"log-message",
-					level = "error",
-					message = "* {:s} depends on {:s}".format(
-						', '.join(item["decls"]),
-						', '.join(item["deps"])
-					),
-					block = item["block"]
-				)
-
-			dependencyError = True
+			for cycle in report["cycles"]:
+				for item in cycle:
+					self.emit(
+						"log-message",
+						level = "error",
+						message = "* {:s} depends on {:s}".format(
+							', '.join(item["declares"]),
+							', '.join(item["depends"])
+						),
+						block = item["block"]
+					)
 
 		# Do not run if there was an error with the dependencies.
-		if dependencyError:
+		if not report["valid"]:
 			self.state = State.COMPLETE
 			self._complete.errback(Exception("Dependency errors prevented start."))
 			_removeListeners()
@@ -492,16 +426,99 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 
 		return defer.DeferredList(results)
 
+	#
+	# Validation
+	#
+
+	def _dependencies (self):
+		""" The global variables declared and needed by each top block. """
+
+		declarations = {}
+		dependencies = {}
+
+		for block in self.topBlocks.values():
+			declarations[block] = block.getGlobalDeclarationNames()
+			dependencies[block] = set(block.getUnmatchedVariableNames())
+
+		return declarations, dependencies
+
+	def validate (self, declarations = None, dependencies = None):
+		""" Check the dependencies between the top blocks, without
+		running them.
+
+		Returns a dict with "undefined", a list of { block, variable }
+		for variables which are referenced but never declared;
+		"runnable", whether any block can start straight away; and
+		"cycles", a list of the sets of blocks which depend on each
+		other, each a list of { block, declares, depends } in order of
+		position. "valid" is True if none of these prevent a run. """
+
+		if declarations is None:
+			declarations, dependencies = self._dependencies()
+
+		declared = set()
+		for names in declarations.values():
+			declared.update(names)
+
+		undefined = [
+			{ "block": block.id, "variable": name }
+			for block, deps in dependencies.items()
+			for name in sorted(deps - declared)
+		]
+
+		runnable = any(len(deps) == 0 for deps in dependencies.values())
+		cycles = []
+
+		for cycle in findDependencyCycles(declarations, dependencies):
+			cycleDeclarations = set()
+			for block in cycle:
+				cycleDeclarations.update(declarations[block])
+
+			cycles.append([{
+				"block": block.id,
+				"declares": sorted(declarations[block]),
+				"depends": sorted(dependencies[block] & cycleDeclarations)
+			} for block in sorted(cycle, key = lambda b: b.position)])
+
+		return {
+			"valid": len(undefined) == 0 and runnable and len(cycles) == 0,
+			"undefined": undefined,
+			"runnable": runnable,
+			"cycles": cycles
+		}
+
 	#
 	# Serialisation
 	#
 
+	# The events of each block's subtree are cached by the block, and
+	# the cache is cleared along the path to its top block when it
+	# changes. The returned lists are shared, and must not be modified.
+
 	def toEvents (self):
-		events = []
-		for block in self.topBlocks.values():
-			events.extend(block.toEvents())
+		if self._serialised is None:
+			events = []
+			for block in self.topBlocks.values():
+				events.extend(block.toEvents())
+
+			self._serialised = events
+
+		return self._serialised
+
+	def toEventsJSON (self):
+		""" toEvents(), encoded as a JSON array. """
 
-		return events
+		if self._serialisedJSON is None:
+			self._serialisedJSON = "[" + ",".join(
+				block.toEventsJSON() for block in self.topBlocks.values()
+			) + "]"
+
+		return self._serialisedJSON
+
+	def _changed (self):
+		self.version += 1
+		self._serialised = None
+		self._serialisedJSON = None
 
 	def fromEvents (self, events):
 		for e in events:
@@ -511,11 +528,191 @@ class Workspace (Runnable, Pausable, Cancellable, EventEmitter):
 			event.apply(self)
 
 
+class DependencyIndex (object):
+	""" Blocks waiting for global variables to be declared.
+
+	Keeps the names that each waiting block still needs, and the
+	blocks waiting for each name, so that declaring a name only
+	touches the blocks that depend on it. Names which have been
+	declared are not waited for by blocks added afterwards. """
+
+	def __init__ (self):
+		self.declared = set()
+		self._remaining = {}
+		self._dependents = {}
+
+	def __len__ (self):
+		return len(self._remaining)
+
+	def __contains__ (self, block):
+		return block in self._remaining
+
+	def __iter__ (self):
+		return iter(list(self._remaining))
+
+	def remaining (self, block):
+		return set(self._remaining[block])
+
+	def add (self, block, names):
+		""" Add (or update) a block waiting for names. Returns the
+		names which have not been declared yet. """
+
+		self.remove(block)
+		remaining = set(names) - self.declared
+		self._remaining[block] = remaining
+
+		for name in remaining:
+			# A dict is used as an ordered set, so that blocks
+			# become ready in the order in which they were added.
+			self._dependents.setdefault(name, {})[block] = True
+
+		return remaining
+
+	def remove (self, block):
+		for name in self._remaining.pop(block, ()):
+			dependents = self._dependents[name]
+			del dependents[block]
+
+			if len(dependents) == 0:
+				del self._dependents[name]
+
+	def declare (self, names):
+		""" Mark names as declared. Returns the blocks which are no
+		longer waiting for anything, which are removed. """
+
+		ready = []
+
+		for name in names:
+			self.declared.add(name)
+
+			for block in self._dependents.pop(name, ()):
+				remaining = self._remaining[block]
+				remaining.discard(name)
+
+				if len(remaining) == 0:
+					del self._remaining[block]
+					ready.append(block)
+
+		return ready
+
+	def copy (self):
+		index = DependencyIndex()
+		index.declared = set(self.declared)
+
+		for block, names in self._remaining.items():
+			index.add(block, names)
+
+		return index
+
+
+def findDependencyCycles (declarations, dependencies):
+	""" Find the cycles in the dependencies between blocks.
+
+	declarations and dependencies map each block to the names of the
+	global variables that it declares and that it needs. The blocks
+	which can never run are those left waiting once the variables of
+	every block that can run have been declared, in turn (Kahn's
+	algorithm). The strongly-connected components of the dependencies
+	between these blocks (Tarjan's algorithm) are the cycles. Returns
+	a list of cycles, each a list of blocks. """
+
+	graph = DependencyIndex()
+	ready = []
+
+	for block, deps in dependencies.items():
+		if len(deps) == 0:
+			ready.append(block)
+		else:
+			graph.add(block, deps)
+
+	while len(ready) > 0:
+		ready.extend(graph.declare(declarations[ready.pop()]))
+
+	# Every declaration of a name that a waiting block needs is in
+	# another waiting block (or it would have been declared).
+	declarers = {}
+	for block in graph:
+		for name in declarations[block]:
+			declarers.setdefault(name, []).append(block)
+
+	edges = {
+		block: [
+			declarer
+			for name in graph.remaining(block)
+			for declarer in declarers.get(name, ())
+		]
+		for block in graph
+	}
+
+	return [
+		component for component in _stronglyConnected(edges)
+		if len(component) > 1 or component[0] in edges[component[0]]
+	]
+
+def _stronglyConnected (edges):
+	""" Tarjan's algorithm, without recursion. edges maps each node
+	to a list of its successors. Returns the strongly-connected
+	components, each a list of nodes. """
+
+	index = {}
+	lowlink = {}
+	stack = []
+	onStack = set()
+	components = []
+
+	def _visit (node):
+		index[node] = lowlink[node] = len(index)
+		stack.append(node)
+		onStack.add(node)
+		work.append((node, iter(edges[node])))
+
+	for root in edges:
+		if root in index:
+			continue
+
+		work = []
+		_visit(root)
+
+		while len(work) > 0:
+			node, successors = work[-1]
+
+			for successor in successors:
+				if successor not in index:
+					_visit(successor)
+					break
+				elif successor in onStack:
+					lowlink[node] = min(lowlink[node], index[successor])
+			else:
+				work.pop()
+
+				if len(work) > 0:
+					parent = work[-1][0]
+					lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+				if lowlink[node] == index[node]:
+					component = []
+
+					while True:
+						member = stack.pop()
+						onStack.discard(member)
+						component.append(member)
+
+						if member is node:
+							break
+
+					components.append(component)
+
+	return components
+
+
 class Variables (EventEmitter):
 	def __init__ (self):
 		self._variables = {}
 		self._handlers = {}
 
+		# Incremented whenever a variable is added, removed or renamed
+		self.version = 0
+
 	def add (self, name, variable):
 		if name in self._variables:
 			if self._variables[name] is variable:
@@ -524,6 +721,7 @@ class Variables (EventEmitter):
 			self.remove(name)
 
 		self._variables[name] = variable
+		self.version += 1
 
 		def _makeHandler (name):
 			def onChange (data):
@@ -575,6 +773,7 @@ class Variables (EventEmitter):
 
 		del self._variables[name]
 		del self._handlers[name]
+		self.version += 1
 
 	def rename (self, oldName, newName):
 		log.msg("Renaming variable: %s to %s" % (oldName, newName))
@@ -593,6 +792,7 @@ class Variables (EventEmitter):
 			oldNames = [oldName]
 
 		variable.alias = newName
+		self.version += 1
 
 		for name in oldNames:
 			variable = self._variables[name]
@@ -648,6 +848,21 @@ class Block (BaseStep, EventEmitter):
 	# value immediately.
 	outputType = None
 
+	# Pure blocks, whose output depends only on their fields and
+	# inputs, define calculate(inputValue). This returns the output,
+	# given a function which returns the value of an input, as
+	# getInputValue() does. If all of the blocks connected under a
+	# block are pure, it is evaluated synchronously (see evalSync()).
+	calculate = None
+
+	# Whether pure subtrees are compiled to Python functions, rather
+	# than evaluated block by block (see compiler.py).
+	compileExpressions = True
+
+	# Events which are also emitted by each of the blocks that
+	# this block is connected under, up to its top block.
+	bubblingEvents = frozenset(['connectivity-changed', 'value-changed'])
+
 	@property
 	def state (self):
 		return self._state
@@ -667,6 +882,7 @@ class Block (BaseStep, EventEmitter):
 	@disabled.setter
 	def disabled (self, disabled):
 		self._disabled = bool(disabled)
+		self._changed()
 
 		try:
 			if disabled:
@@ -679,6 +895,11 @@ class Block (BaseStep, EventEmitter):
 		self.emit("connectivity-changed")
 
 	def __init__ (self, workspace, id):
+		self._serialised = None
+		self._serialisedJSON = None
+		self._variableCache = {}
+		self._pure = None
+		self._compiled = None
 		self.workspace = workspace
 		self.id = id
 		self.type = self.__class__.__name__
@@ -704,6 +925,24 @@ class Block (BaseStep, EventEmitter):
 	def disposed (self):
 		pass
 
+	def emit (self, _event, **data):
+		if _event not in self.bubblingEvents:
+			return EventEmitter.emit(self, _event, **data)
+
+		# Walk up the parent chain, skipping blocks without listeners
+		handled = False
+		block = self
+
+		while block is not None:
+			listeners = getattr(block, '_events', None)
+
+			if listeners and (_event in listeners or 'all' in listeners):
+				handled |= EventEmitter.emit(block, _event, **data)
+
+			block = block.outputBlock or block.prevBlock
+
+		return handled
+
 	def emitLogMessage (self, message, level):
 		self.workspace.emit(
 			"log-message",
@@ -721,6 +960,7 @@ class Block (BaseStep, EventEmitter):
 		self.nextBlock = childBlock
 		childBlock.prevBlock = self
 		childBlock.parentInput = None
+		childBlock._changed()
 
 		if self.state in (State.RUNNING, State.PAUSED):
 			try:
@@ -738,21 +978,6 @@ class Block (BaseStep, EventEmitter):
 				except AlreadyRunning:
 					pass
 
-		@childBlock.on('connectivity-changed')
-		def onConnChange (data):
-			self.emit('connectivity-changed', **data)
-
-		@childBlock.on('value-changed')
-		def onValueChange (data):
-			self.emit('value-changed', **data)
-
-		@self.on('disconnected')
-		def onDisconnect (data):
-			if "next" in data and data['next'] is True:
-				childBlock.off('connectivity-changed', onConnChange)
-				childBlock.off('value-changed', onValueChange)
-				self.off('disconnected', onDisconnect)
-
 		self.emit('connectivity-changed')
 
 	def disconnectNextBlock (self, childBlock):
@@ -767,9 +992,11 @@ class Block (BaseStep, EventEmitter):
 		except AttributeError:
 			pass
 
+		self._changed()
 		self.nextBlock = None
 		childBlock.prevBlock = None
 		childBlock.parentInput = None
+		childBlock._changed()
 
 		self.emit('disconnected', next = True)
 		self.emit('connectivity-changed')
@@ -807,6 +1034,7 @@ class Block (BaseStep, EventEmitter):
 		oldValue = self.getFieldValue(fieldName)
 
 		self.fields[fieldName] = value
+		self._changed()
 		self.emit('value-changed',
 			block = self,
 			field = fieldName,
@@ -832,12 +1060,62 @@ class Block (BaseStep, EventEmitter):
 		if input is None:
 			return defer.succeed(default)
 
+		if input.isPure():
+			try:
+				return defer.succeed(input.evalSync())
+			except:
+				return defer.fail()
+
 		def error (failure):
 			failure.trap(Cancelled, Disconnected)
 			return default
 
 		return input.eval().addErrback(error)
 
+	def isPure (self):
+		""" Whether this block and all of the blocks connected to its
+		inputs are pure. Cached until the subtree changes. """
+
+		if self._pure is None:
+			self._pure = self.calculate is not None and all(
+				input is None or input.isPure()
+				for input in self.inputs.values()
+			)
+
+		return self._pure
+
+	def evalSync (self):
+		""" Returns the output of a pure block, evaluating its inputs
+		synchronously. Only valid if isPure() is True. """
+
+		function = self.compiled()
+
+		if function is not None:
+			return function()
+
+		return self.calculate(self._inputValueSync)
+
+	def compiled (self):
+		""" Returns a function which evaluates this block's (pure)
+		subtree, or None if it is not compiled. Cached until the
+		subtree changes. """
+
+		if not self.compileExpressions:
+			return None
+
+		if self._compiled is None:
+			self._compiled = compiler.compileBlock(self) or False
+
+		return self._compiled or None
+
+	def _inputValueSync (self, inputName, default = False):
+		input = self.inputs.get(inputName)
+
+		if input is None:
+			return default
+
+		return input.evalSync()
+
 	def connectInput (self, inputName, childBlock, type):
 		if type == "value":
 			childBlock.outputBlock = self
@@ -848,6 +1126,7 @@ class Block (BaseStep, EventEmitter):
 
 		self.inputs[inputName] = childBlock
 		childBlock.parentInput = inputName
+		childBlock._changed()
 
 		if type == "value":
 			if self.state is State.READY:
@@ -879,21 +1158,6 @@ class Block (BaseStep, EventEmitter):
 				except NotRunning:
 					pass
 
-		@childBlock.on('connectivity-changed')
-		def onConnChange (data):
-			self.emit('connectivity-changed', **data)
-
-		@childBlock.on('value-changed')
-		def onValueChange (data):
-			self.emit('value-changed', **data)
-
-		@self.on('disconnected')
-		def onDisconnect (data):
-			if "input" in data and data['input'] == inputName:
-				childBlock.off('connectivity-changed', onConnChange)
-				childBlock.off('value-changed', onValueChange)
-				self.off('disconnected', onDisconnect)
-
 		self.emit('connectivity-changed')
 		self.workspace.emit('top-block-removed', block = childBlock)
 
@@ -911,6 +1175,8 @@ class Block (BaseStep, EventEmitter):
 		except AttributeError:
 			pass
 
+		self._changed()
+
 		if type == "value":
 			childBlock.outputBlock = None
 		elif type == "statement":
@@ -920,24 +1186,51 @@ class Block (BaseStep, EventEmitter):
 
 		self.inputs[inputName] = None
 		childBlock.parentInput = None
+		childBlock._changed()
 
 		self.emit('disconnected', input = inputName)
 		self.emit('connectivity-changed')
 		self.workspace.emit('top-block-added', block = childBlock)
 
-	def getReferencedVariables (self, variables = None):
-		variables = variables or []
+	# Each of these returns the variables of a block (passed in by
+	# subclasses) and those of its children. The children's results
+	# are cached by the block until its subtree changes; referenced
+	# variables also depend on the workspace's variables.
+
+	def _childVariables (self, method, version = None):
+		stats = self.workspace.variableCache
+
+		try:
+			cachedVersion, result = self._variableCache[method]
+		except KeyError:
+			pass
+		else:
+			if cachedVersion == version:
+				stats["hits"] += 1
+				return result
+
+		stats["misses"] += 1
+		result = []
 
 		for block in self.getChildren():
-			variables.extend(block.getReferencedVariables())
+			result.extend(getattr(block, method)())
+
+		self._variableCache[method] = (version, result)
+
+		return result
+
+	def getReferencedVariables (self, variables = None):
+		variables = variables or []
+		variables.extend(self._childVariables(
+			"getReferencedVariables",
+			self.workspace.variables.version
+		))
 
 		return variables
 
 	def getReferencedVariableNames (self, variables = None):
 		variables = variables or []
-
-		for block in self.getChildren():
-			variables.extend(block.getReferencedVariableNames())
+		variables.extend(self._childVariables("getReferencedVariableNames"))
 
 		return variables
 
@@ -951,9 +1244,7 @@ class Block (BaseStep, EventEmitter):
 		"""
 
 		variables = variables or []
-
-		for block in self.getChildren():
-			variables.extend(block.getGlobalDeclarationNames())
+		variables.extend(self._childVariables("getGlobalDeclarationNames"))
 
 		return variables
 
@@ -965,9 +1256,7 @@ class Block (BaseStep, EventEmitter):
 		defined globally."""
 
 		variables = variables or []
-
-		for block in self.getChildren():
-			variables.extend(block.getUnmatchedVariableNames())
+		variables.extend(self._childVariables("getUnmatchedVariableNames"))
 
 		return variables
 
@@ -1045,7 +1334,30 @@ class Block (BaseStep, EventEmitter):
 		return self._complete
 
 	def eval (self):
-		return defer.succeed(None)
+		if self.calculate is None:
+			return defer.succeed(None)
+
+		if self.isPure():
+			try:
+				return defer.succeed(self.evalSync())
+			except:
+				return defer.fail()
+
+		# Evaluate all of the inputs, then calculate from their values
+		names = [name for name, input in self.inputs.items() if input is not None]
+
+		def calculate (results):
+			values = dict(zip(names, results))
+
+			return self.calculate(
+				lambda inputName, default = False: values.get(inputName, default)
+			)
+
+		self._complete = defer.gatherResults([
+			self.getInputValue(name) for name in names
+		]).addCallback(calculate)
+
+		return self._complete
 
 	def pause (self):
 		if self.state is State.RUNNING:
@@ -1194,7 +1506,58 @@ class Block (BaseStep, EventEmitter):
 	# Serialise
 	#
 
+	def _changed (self, variables = True):
+		""" Clear the cached events of this block, and of the blocks
+		that it is connected under, whose events include its own. If
+		variables is True, also clear their cached variable analysis,
+		purity and compiled function. """
+
+		block = self
+
+		while block is not None:
+			block._serialised = None
+			block._serialisedJSON = None
+
+			if variables:
+				block._pure = None
+				block._compiled = None
+
+				if len(block._variableCache):
+					block._variableCache = {}
+					self.workspace.variableCache["invalidations"] += 1
+
+			block = block.outputBlock or block.prevBlock
+
+		self.workspace._changed()
+
 	def toEvents (self):
+		if self._serialised is None:
+			head, tail = self._ownEvents()
+
+			for child in self.getChildren():
+				head.extend(child.toEvents())
+
+			self._serialised = head + tail
+
+		return self._serialised
+
+	def toEventsJSON (self):
+		""" toEvents(), encoded as the items of a JSON array. """
+
+		if self._serialisedJSON is None:
+			head, tail = self._ownEvents()
+			parts = [_dumps(event) for event in head]
+			parts.extend(child.toEventsJSON() for child in self.getChildren())
+			parts.extend(_dumps(event) for event in tail)
+
+			self._serialisedJSON = ",".join(parts)
+
+		return self._serialisedJSON
+
+	def _ownEvents (self):
+		""" The events for this block which come before and after
+		the events of its children. """
+
 		events = []
 		events.append({ "type": "AddBlock", "data": { "id": self.id, "type": self.type, "fields": self.fields }})
 
@@ -1213,8 +1576,8 @@ class Block (BaseStep, EventEmitter):
 			else:
 				events.append({ "type": "ConnectBlock", "data": { "id": self.id, "connection": "previous", "parent": self.prevBlock.id }})
 
-		for child in self.getChildren():
-			events.extend(child.toEvents())
+		head = events
+		events = []
 
 		if self.disabled:
 			events.append({ "type": "SetBlockDisabled", "data": { "id": self.id, "value": True }})
@@ -1230,8 +1593,11 @@ class Block (BaseStep, EventEmitter):
 		if self.outputBlock is None and self.prevBlock is None:
 			events.append({ "type": "SetBlockPosition", "data": { "id": self.id, "x": self.position[0], "y": self.position[1] }})
 
-		return events
+		return head, events
+
 
+def _dumps (value):
+	return json.dumps(value, separators = (',', ':'))
 
 def _toHyphenated (name):
 	import re
@@ -1326,6 +1692,7 @@ class SetBlockPosition (Event):
 			int(self.values['x'] or 0),
 			int(self.values['y'] or 0)
 		]
+		block._changed(variables = False)
 
 class SetBlockFieldValue (Event):
 	_fields = ("id", "field", "value")
@@ -1350,6 +1717,7 @@ class SetBlockCollapsed (Event):
 	def apply (self, workspace):
 		block = workspace.getBlock(self.values['id'])
 		block.collapsed = bool(self.values['value'])
+		block._changed(variables = False)
 
 class SetBlockComment (Event):
 	_fields = ("id", "value")
@@ -1358,6 +1726,7 @@ class SetBlockComment (Event):
 	def apply (self, workspace):
 		block = workspace.getBlock(self.values['id'])
 		block.comment = str(self.values['value'])
+		block._changed(variables = False)
 
 class SetBlockInputsInline (Event):
 	_fields = ("id", "value")
@@ -1366,6 +1735,7 @@ class SetBlockInputsInline (Event):
 	def apply (self, workspace):
 		block = workspace.getBlock(self.values['id'])
 		block.inputsInline = bool(self.values['value'])
+		block._changed(variables = False)
 
 class SetBlockMutation (Event):
 	_fields = ("id", "mutation")
@@ -1374,6 +1744,7 @@ class SetBlockMutation (Event):
 	def apply (self, workspace):
 		block = workspace.getBlock(self.values['id'])
 		block.mutation = self.values['mutation']
+		block._changed()
 
 # Not Implemented:
 # block-set-deletable (value)
@@ -23,6 +23,8 @@ from . import sketch
 from . import experiment
 from . import websocket
 from . import template
+from . import export
+from .runtime import workspace, compiler
 
 # System Imports
 import sys, os
@@ -101,13 +103,20 @@ def _error (failure, request):
 	request.write(f"There was an error: {str(failure)}".encode('utf-8'))
 	request.finish()
 
+def _getArgList (request, arg):
+	# Argument names are bytes under Python 3
+	try:
+		return request.args[arg.encode('ascii')]
+	except KeyError:
+		return request.args.get(arg, [])
+
 def _getArg (request, arg, cast = None, default = None):
 	try:
 		if cast is not None:
-			return cast(request.args[arg][0])
+			return cast(_getArgList(request, arg)[0])
 		else:
-			return request.args[arg][0]
-	except (TypeError, KeyError):
+			return _getArgList(request, arg)[0]
+	except (TypeError, IndexError, ValueError):
 		return default
 
 def _getIntArg (request, arg):
@@ -347,7 +356,7 @@ class ShowExperiment (resource.Resource):
 
 	def __init__ (self, id):
 		resource.Resource.__init__(self)
-		self._id = id
+		self._id = id.decode('ascii')
 
 	def render_GET (self, request):
 		def _done (exists):
@@ -376,13 +385,13 @@ class ShowExperiment (resource.Resource):
 		return server.NOT_DONE_YET
 
 	def getChild (self, action, request):
-		if action == "data":
+		if action == b"data":
 			return GetExperimentData(self._id)
-		elif action == "download":
+		elif action == b"download":
 			return DownloadExperimentData(self._id)
-		elif action == "delete":
+		elif action == b"delete":
 			return DeleteExperiment(self._id)
-		elif action == "restore":
+		elif action == b"restore":
 			return UndeleteExperiment(self._id)
 
 		return NoResource()
@@ -395,10 +404,7 @@ class GetExperimentData (resource.Resource):
 		self._id = id
 
 	def render_GET (self, request):
-		try:
-			variables = request.args['var[]']
-		except KeyError:
-			variables = []
+		variables = [v.decode('utf-8') for v in _getArgList(request, 'var[]')]
 
 		start = _getArg(request, 'start', float)
 		end = _getArg(request, 'end', float)
@@ -460,35 +466,56 @@ class DownloadExperimentData (resource.Resource):
 
 	@defer.inlineCallbacks
 	def _render_POST (self, request):
+		finished = []
+		request.notifyFinish().addBoth(finished.append)
+
 		try:
 			expt = yield self._getExperiment(self._id)
 
 			yield expt.load()
 
-			variables = request.args['vars']
+			variables = [v.decode('utf-8') for v in _getArgList(request, 'vars')]
 			time_divisor = _getArg(request, 'time_divisor', int, None)
 			time_dp = _getArg(request, 'time_dp', int, None)
+			fileFormat = _getArg(request, 'format', lambda f: f.decode('ascii'), 'xlsx')
+			aggregate = _getArg(request, 'aggregate', lambda a: a.decode('ascii'), 'first')
+
+			if fileFormat not in export.contentTypes:
+				raise Exception("Unknown format " + fileFormat)
+
+			if aggregate not in export.aggregations:
+				raise Exception("Unknown aggregation " + aggregate)
+
 			filename = '.'.join([
 				re.sub(r'[^a-zA-Z0-9]+', '_', expt.title).strip('_'),
 				time.strftime(
 					'%Y%m%d_%H%M%S',
 					time.gmtime(expt.finished_date)
 				),
-				'xlsx'
+				fileFormat
 			])
 
-			xlsxdata = yield expt.buildExcelFile(variables, time_divisor, time_dp)
+			header, rows = yield expt.exportRows(variables, time_divisor, time_dp, aggregate)
 
 		except Exception as e:
 			request.write("<!DOCTYPE html>\n".encode('utf-8'))
 			_error(e, request)
 			return
 
-		request.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+		request.setHeader('Content-Type', export.contentTypes[fileFormat])
 		request.setHeader('Content-Disposition', 'attachment; filename=' + filename + ';')
 
-		request.write(xlsxdata)
-		request.finish()
+		# Rows are written as the client is ready for them.
+		try:
+			if fileFormat == 'csv':
+				yield export.writeCSV(request, header, rows)
+			else:
+				yield export.writeXLSX(request, expt.title, header, rows)
+		except Exception:
+			log.err()
+
+		if not finished:
+			request.finish()
 
 
 class DeleteExperiment (resource.Resource):
@@ -578,7 +605,11 @@ def makeConsoleServerFactory ():
 			ColoredManhole,
 			dict(
 				sketches = loaded_sketches,
-				experiments = running_experiments
+				experiments = running_experiments,
+				experiment_cache = experiment.CompletedExperiment.cache,
+				expression_cache = compiler.cache,
+				sketch_loads = sketch.Sketch.recentLoads,
+				client_queues = websocket_runtime.clientMetrics
 			)
 		)
 
@@ -605,6 +636,11 @@ def makeService (options):
 		service.Application("octopus_editor_server", uid = 1, gid = 1)
 	)
 
+	experiment.Experiment.dataFormat = str(options["dataformat"])
+	experiment.CompletedExperiment.cache.maxSize = int(options["cachesize"]) * 2 ** 20
+	sketch.Sketch.compressSnapshots = str(options["snapshots"]) == "gzip"
+	workspace.Block.compileExpressions = str(options["expressions"]) == "compiled"
+
 	ws_factory = makeWebsocketServerFactory(str(options["wshost"]), int(options["wsport"]))
 	internet.TCPServer(int(options["wsport"]), ws_factory).setServiceParent(application)
 
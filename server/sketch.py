@@ -3,10 +3,12 @@ import uuid
 import os
 import re
 import json
+import gzip
+import collections
 from time import time as now
 
 # Twisted Imports
-from twisted.internet import defer, threads
+from twisted.internet import reactor, defer, threads, task
 from twisted.python import log
 from twisted.python.filepath import FilePath
 
@@ -16,8 +18,9 @@ from octopus.runtime.sequence.error import NotRunning
 # Package Imports
 from .util import EventEmitter
 from .dbutil import makeFinder
-from .runtime.workspace import Workspace, Aborted, Cancelled
+from .runtime.workspace import Workspace, Aborted, Cancelled, UnknownEventError
 from .experiment import Experiment
+from .logwriter import LogWriter
 
 
 class Sketch (EventEmitter):
@@ -29,6 +32,25 @@ class Sketch (EventEmitter):
 	db = None
 	dataDir = None
 
+	# Deferreds for sketches whose logs and snapshots are still being
+	# written after being closed, by id.
+	_closing = {}
+
+	# A snapshot of the workspace is written every snapshotEvents
+	# events, or every snapshotInterval seconds if anything has changed.
+	snapshotEvents = 500
+	snapshotInterval = 5 * 60
+
+	# Snapshots are written as gzipped JSON if compressSnapshots is set.
+	compressSnapshots = True
+
+	# Timings of recent sketch loads
+	recentLoads = collections.deque(maxlen = 100)
+
+	# Block state changes are sent to subscribers at most once
+	# every blockStateInterval seconds.
+	blockStateInterval = 0.05
+
 	@classmethod
 	def createId (cls):
 		id = str(uuid.uuid4())
@@ -74,17 +96,25 @@ class Sketch (EventEmitter):
 		self.workspace = Workspace()
 		self.experiment = None
 		self.subscribers = {}
+		self.blockStates = BlockStateCoalescer(self, self.blockStateInterval)
 		self._eventIndex = 0
+		self._snapEventIndex = 0
 
 		self._sketchDir = FilePath(self.dataDir).child(id)
 		if not self._sketchDir.exists():
 			self._sketchDir.createDirectory()
 
-		eventFile = self._sketchDir.child("events.log")
-		if not eventFile.exists():
-			eventFile.create()
+		# Events are appended to the log in order by a worker thread.
+		# Each event is queued for writing as soon as it happens.
+		# The writer is started and the log opened once the sketch is
+		# loaded, so that a sketch which fails to load is not kept alive.
+		self._logWriter = LogWriter(bufferSize = 0, syncInterval = 60)
+		self._eventsLog = None
 
-		self._eventsLog = eventFile.open('a')
+		self._snapshotLoop = task.LoopingCall(self._periodicSnapshot)
+		self._snapshotLock = defer.DeferredLock()
+		self._lastSnapshot = None
+		self.loadMetrics = None
 
 	def load (self):
 		return self._loadFrom(self.id)
@@ -103,62 +133,146 @@ class Sketch (EventEmitter):
 			raise Error("Sketch %s not found." % id)
 
 		self.title = sketch[0][0]
-		self.loaded = True
 
-		# Find the most recent snapshot file
-		try:
-			sketchDir = FilePath(self.dataDir).child(id)
-			max_snap = max(map(
-				lambda fp: int(
-					os.path.splitext(fp.basename())[0].split('.')[1]
-				),
-				sketchDir.globChildren('snapshot.*.log')
-			))
-
-			log.msg(
-				"Found snapshot {:d} for sketch {:s}".format(
-					max_snap,
-					id
-				)
+		# Wait for the sketch to be written if it has just been closed.
+		if id in self._closing:
+			yield self._closing[id]
+
+		# Read the most recent snapshot. Events logged after the
+		# snapshot was taken (if the server stopped without closing
+		# the sketch) are replayed.
+		sketchDir = FilePath(self.dataDir).child(id)
+		started = now()
+		max_snap, events = yield threads.deferToThread(_readSnapshot, sketchDir)
+		tail = yield threads.deferToThread(_readEventsAfter, sketchDir, max_snap)
+		read = now()
+
+		self.workspace.fromEvents(events)
+		self._replay(tail)
+		applied = now()
+
+		self.loadMetrics = {
+			"sketch": id,
+			"snapshot": max_snap,
+			"snapshot_events": len(events),
+			"replayed_events": len(tail),
+			"read_time": read - started,
+			"apply_time": applied - read
+		}
+		self.recentLoads.append(self.loadMetrics)
+
+		log.msg(
+			"Loaded snapshot {:d} and {:d} more events for sketch {:s} in {:.3f}s".format(
+				max_snap,
+				len(tail),
+				id,
+				applied - started
 			)
+		)
 
-		except ValueError:
-			self._eventIndex = 0
+		if copy:
+			self._eventIndex = len(events) + len(tail)
 			self._snapEventIndex = 0
 		else:
-			snapFile = sketchDir.child('snapshot.' + str(max_snap) + '.log')
-
-			if max_snap > 0:
-				snapshot = yield threads.deferToThread(snapFile.getContent)
-				events = map(
-					json.loads,
-					filter(lambda e: e.strip() != "", snapshot.split("\n"))
-				)
-				self.workspace.fromEvents(events)
-
-			if copy:
-				self._eventIndex = len(events)
-				self._snapEventIndex = 0
-			else:
-				self._eventIndex = max_snap
-				self._snapEventIndex = max_snap
+			self._eventIndex = tail[-1]["index"] if len(tail) else max_snap
+			self._snapEventIndex = max_snap
+
+		self._logWriter.start()
+		self._openEventsLog()
+
+		# Events can only be written once the events log is open
+		self.loaded = True
+
+		self._snapshotLoop.start(self.snapshotInterval, False).addErrback(log.err)
 
 		# Rename if a copy
 		if copy:
 			self.rename(self.title + " Copy")
 
+	def _replay (self, events):
+		for event in events:
+			try:
+				self.workspace.fromEvents([event])
+			except UnknownEventError:
+				# Sketch events, e.g. RenameSketch
+				pass
+			except Exception:
+				log.err(None, "Replaying event {:d} of sketch {:s}".format(event["index"], self.id))
+
+	def _openEventsLog (self):
+		""" Start a new events log, for events after the current one. """
+
+		if self._eventsLog is not None:
+			self._eventsLog.close()
+
+		self._eventsLog = self._logWriter.open(
+			self._sketchDir.child("events." + str(self._eventIndex) + ".log"),
+			append = True
+		)
+
+	def snapshot (self):
+		""" Write a snapshot of the workspace, and start a new events log.
+
+		Returns a Deferred which fires once the snapshot has been
+		written. Older snapshots are then removed. """
+
+		d = self._writeSnapshot()
+		self._openEventsLog()
+
+		return d
+
+	def _periodicSnapshot (self):
+		if self._eventIndex > self._snapEventIndex:
+			self.snapshot()
+
+	def _writeSnapshot (self):
+		# The events are serialised now (mostly from the workspace's
+		# cache), but are compressed and written in a worker thread.
+		# Snapshots are written one at a time, so that the manifest
+		# always points to the latest.
+		index = self._eventIndex
+		sketchDir = self._sketchDir
+		events = self.workspace.toEventsJSON()
+		compress = self.compressSnapshots
+		self._snapEventIndex = index
+
+		d = self._lastSnapshot = self._snapshotLock.run(
+			threads.deferToThread,
+			_writeSnapshotFiles,
+			sketchDir,
+			index,
+			events,
+			compress
+		)
+		d.addErrback(log.err)
+
+		return d
+
 	def close (self):
+		""" Close the sketch, writing a snapshot if anything has changed.
+
+		Returns a Deferred which fires once the events log and snapshot
+		have been written. """
+
 		log.msg("Closing sketch {:s}".format(self.id))
 
+		if self._snapshotLoop.running:
+			self._snapshotLoop.stop()
+
+		self.blockStates.flush()
+		writes = []
+
+		# Wait for any periodic snapshot which is still being written
+		if self._lastSnapshot is not None:
+			writes.append(self._lastSnapshot)
+
 		# If anything has changed...
 		if self._eventIndex > self._snapEventIndex:
 			# Write a snapshot
-			snapFile = self._sketchDir.child("snapshot." + str(self._eventIndex) + ".log")
-			if not snapFile.exists():
-				snapFile.create()
+			writes.append(self._writeSnapshot())
 
-			with snapFile.open('w') as fp:
-				fp.write("\n".join(map(json.dumps, self.workspace.toEvents())))
+		# Close the events log
+		writes.append(self._logWriter.close())
 
 		# Set the modified date
 		self.db.runOperation('''
@@ -167,11 +281,20 @@ class Sketch (EventEmitter):
 			WHERE guid = ?
 		''', (now(), self.id))
 
-		# Close the events log
-		self._eventsLog.close()
+		id = self.id
+		d = self._closing[id] = defer.gatherResults(writes, consumeErrors = True)
+
+		def _closed (result):
+			if self._closing.get(id) is d:
+				del self._closing[id]
+
+		d.addErrback(log.err)
+		d.addCallback(_closed)
 
 		self.emit("closed")
 
+		return d
+
 	def rename (self, title):
 		self._writeEvent("RenameSketch", { "from": self.title, "to": title })
 		self.db.runOperation("UPDATE sketches SET title = ? WHERE guid = ?", (title, self.id))
@@ -181,8 +304,16 @@ class Sketch (EventEmitter):
 	# Subscribers
 	#
 
-	def subscribe (self, subscriber, notifyFn):
-		self.subscribers[subscriber] = notifyFn
+	def subscribe (self, subscriber, notifyFn = None, transport = None):
+		""" Subscribe to notifications from the sketch.
+
+		notifyFn is called with (protocol, topic, payload) for each
+		notification. Clients of a transport are subscribed with the
+		transport instead, and each notification is sent to all of them
+		with a single transport.broadcast() so that it is only encoded
+		once. """
+
+		self.subscribers[subscriber] = (notifyFn, transport)
 
 	def unsubscribe (self, subscriber):
 		if subscriber in self.subscribers:
@@ -192,9 +323,23 @@ class Sketch (EventEmitter):
 			self.close()
 
 	def notifySubscribers (self, protocol, topic, payload, source = None):
-		for subscriber, notifyFn in self.subscribers.items():
-			if subscriber is not source:
+		contexts = collections.OrderedDict()
+
+		for subscriber, (notifyFn, transport) in list(self.subscribers.items()):
+			if subscriber is source:
+				continue
+
+			if transport is None:
 				notifyFn(protocol, topic, payload)
+			else:
+				contexts.setdefault(transport, []).append(subscriber)
+
+		if len(contexts):
+			if 'sketch' not in payload:
+				payload = dict(payload, sketch = self.id)
+
+			for transport, subscribers in contexts.items():
+				transport.broadcast(protocol, topic, payload, subscribers)
 
 	#
 	# Experiment
@@ -333,11 +478,237 @@ class Sketch (EventEmitter):
 			"data": data
 		}
 
-		self._eventsLog.write(json.dumps(event) + "\n")
+		self._eventsLog.write((json.dumps(event) + "\n").encode('utf-8'))
+
+		if self._eventIndex - self._snapEventIndex >= self.snapshotEvents:
+			self.snapshot()
 
 		return self._eventIndex
 
 
+#
+# Snapshot files
+#
+# A snapshot is a single JSON document, { "index": <index>, "events": [...] },
+# in snapshot.<index>.json (or snapshot.<index>.json.gz if compressed).
+# manifest.json points to the latest snapshot, so that it can be found
+# without listing the sketch directory. Sketches saved before the
+# manifest was introduced have snapshot.<index>.log files, with one
+# event per line.
+#
+
+MANIFEST = "manifest.json"
+SNAPSHOT_PATTERNS = ('snapshot.*.json', 'snapshot.*.json.gz', 'snapshot.*.log')
+
+def _indexedFiles (directory, *patterns):
+	""" Find files named like name.<index>.ext, as a list of
+	(index, FilePath) sorted by index. """
+
+	files = []
+
+	for pattern in patterns:
+		for fp in directory.globChildren(pattern):
+			try:
+				files.append((int(fp.basename().split('.')[1]), fp))
+			except ValueError:
+				pass
+
+	return sorted(files, key = lambda f: f[0])
+
+def _readEvents (file):
+	""" Read the events in an events log (or a snapshot from before the
+	manifest). An incomplete final line (e.g. if the server stopped
+	whilst writing it) is ignored. """
+
+	events = []
+
+	with file.open() as fp:
+		for line in fp:
+			if line.strip() == b"":
+				continue
+
+			try:
+				events.append(json.loads(line.decode('utf-8')))
+			except ValueError:
+				break
+
+	return events
+
+def _readSnapshotFile (snapFile):
+	if snapFile.basename().endswith(".log"):
+		return _readEvents(snapFile)
+
+	content = snapFile.getContent()
+
+	if snapFile.basename().endswith(".gz"):
+		content = gzip.decompress(content)
+
+	return json.loads(content.decode('utf-8'))["events"]
+
+def _readSnapshot (sketchDir):
+	""" Read the latest snapshot of a sketch. Returns (index, events). """
+
+	manifest = sketchDir.child(MANIFEST)
+
+	if manifest.exists():
+		try:
+			latest = json.loads(manifest.getContent().decode('utf-8'))
+
+			return latest["index"], _readSnapshotFile(sketchDir.child(latest["snapshot"]))
+		except (ValueError, KeyError, IOError, OSError):
+			log.err(None, "Reading snapshot manifest of {:s}".format(sketchDir.path))
+
+	snapshots = _indexedFiles(sketchDir, *SNAPSHOT_PATTERNS)
+
+	if len(snapshots) == 0:
+		return 0, []
+
+	index, snapFile = snapshots[-1]
+
+	if index == 0:
+		return 0, []
+
+	return index, _readSnapshotFile(snapFile)
+
+def _readEventsAfter (sketchDir, index):
+	""" Read the logged events with an index greater than index.
+
+	A new events log, events.<index>.log, is started with each snapshot
+	and each time the sketch is loaded, so only the log that was being
+	written when the snapshot was taken and any later logs are read.
+	Sketches saved before this may have a single events.log. """
+
+	logs = _indexedFiles(sketchDir, 'events.*.log')
+	legacy = sketchDir.child('events.log')
+
+	if legacy.exists():
+		logs.insert(0, (0, legacy))
+
+	starts = [start for start, fp in logs if start <= index]
+	first = max(starts) if len(starts) else 0
+
+	return [
+		event
+		for start, fp in logs
+		if start >= first
+		for event in _readEvents(fp)
+		if event["index"] > index
+	]
+
+def _writeFile (file, content):
+	""" Write content to a temporary file, sync it and move it into
+	place, so that the file is never incomplete. """
+
+	tempFile = file.siblingExtension(".tmp")
+
+	with tempFile.open('w') as fp:
+		fp.write(content)
+		fp.flush()
+		os.fsync(fp.fileno())
+
+	tempFile.moveTo(file)
+
+def _writeSnapshotFiles (sketchDir, index, events, compress):
+	""" Write a snapshot of events (encoded as JSON) and point the
+	manifest to it, then remove older snapshots and the events logs
+	that it supersedes. """
+
+	content = ('{"index":' + str(int(index)) + ',"events":' + events + '}').encode('utf-8')
+
+	name = "snapshot." + str(index) + ".json"
+
+	if compress:
+		content = gzip.compress(content)
+		name += ".gz"
+
+	_writeFile(sketchDir.child(name), content)
+	_writeFile(
+		sketchDir.child(MANIFEST),
+		json.dumps({ "index": index, "snapshot": name }).encode('utf-8')
+	)
+
+	for snapIndex, snapFile in _indexedFiles(sketchDir, *SNAPSHOT_PATTERNS):
+		if snapIndex < index:
+			snapFile.remove()
+
+	# Events after index are in the newest log started at or before
+	# index (see _readEventsAfter), and any later logs.
+	logs = [
+		fp for start, fp in _indexedFiles(sketchDir, 'events.*.log')
+		if start <= index
+	]
+	legacy = sketchDir.child('events.log')
+
+	if legacy.exists():
+		logs.insert(0, legacy)
+
+	for logFile in logs[:-1]:
+		try:
+			logFile.remove()
+		except OSError:
+			# e.g. still open on Windows; removed after the next snapshot
+			log.msg("Could not remove events log {:s}".format(logFile.path))
+
+
+class BlockStateCoalescer (object):
+	""" Collects the block state changes of a running experiment and
+	sends them to the sketch's subscribers in batches.
+
+	The first change starts a window of interval seconds, at the end of
+	which a single "block" "states" message is sent, with the latest
+	state of each block that changed during the window. Blocks which
+	are back in the state that was last sent are left out. """
+
+	def __init__ (self, sketch, interval):
+		self.sketch = sketch
+		self.interval = interval
+		self._states = collections.OrderedDict()
+		self._sent = {}
+		self._experiment = None
+		self._call = None
+
+	def add (self, block, state, experiment):
+		if experiment is not self._experiment:
+			self.flush()
+			self._sent = {}
+
+		self._states[block] = state
+		self._experiment = experiment
+
+		if self._call is None:
+			self._call = reactor.callLater(self.interval, self.flush)
+
+	def flush (self):
+		""" Send any pending state changes now. """
+
+		if self._call is not None:
+			if self._call.active():
+				self._call.cancel()
+
+			self._call = None
+
+		if len(self._states) == 0:
+			return
+
+		states = [
+			{ "block": block, "state": state }
+			for block, state in self._states.items()
+			if self._sent.get(block) != state
+		]
+		experiment = self._experiment
+		self._sent.update(self._states)
+		self._states = collections.OrderedDict()
+
+		if len(states) == 0:
+			return
+
+		self.sketch.notifySubscribers("block", "states", {
+			"sketch": self.sketch.id,
+			"experiment": experiment.id,
+			"states": states
+		}, experiment)
+
+
 find = makeFinder(
 	Sketch,
 	'sketches',
@@ -8,7 +8,11 @@ class Options (usage.Options):
 		['wshost', None, "localhost", "Listening host for WAMP websockets"],
 		['wsport', None, 9000, "Listening port for WAMP websockets"],
 		['port', None, 8001, "Listening port for web connections"],
-		['consoleport', None, 4040, "Listening port for console SSH connections"]
+		['consoleport', None, 4040, "Listening port for console SSH connections"],
+		['dataformat', None, "csv", "Storage format for experiment variable logs (csv or binary)"],
+		['cachesize', None, 64, "Memory budget in MiB for cached experiment results"],
+		['snapshots', None, "gzip", "Storage format for sketch snapshots (gzip or json)"],
+		['expressions', None, "compiled", "Evaluation of pure block expressions (compiled or interpreted)"]
 	]
 
 	optFlags = [['ssl', 's']]
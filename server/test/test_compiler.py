@@ -0,0 +1,82 @@
+# Python Imports
+import warnings
+
+# Twisted Imports
+from twisted.trial import unittest
+
+# Package Imports
+from ..runtime.workspace import Workspace, Block, populate_blocks
+from ..runtime import compiler
+
+populate_blocks()
+
+
+class CompilerTestCase (unittest.TestCase):
+	def setUp (self):
+		self.workspace = Workspace()
+		self._count = 0
+		compiler.cache.clear()
+
+	def block (self, type, **fields):
+		self._count += 1
+		id = "b{:d}".format(self._count)
+		self.workspace.addBlock(id, type, fields)
+
+		return self.workspace.allBlocks[id]
+
+	def connect (self, block, parent, input):
+		self.workspace.connectBlock(block.id, parent.id, "input-value", input)
+
+	def assertCompiles (self, block, value):
+		""" Compiles block with warnings as errors, and checks that it
+		gives the same value as the interpreter. """
+
+		with warnings.catch_warnings():
+			warnings.simplefilter("error")
+			function = compiler.compileBlock(block)
+
+		self.assertIsNotNone(function)
+		self.assertEqual(function(), value)
+
+		Block.compileExpressions = False
+
+		try:
+			self.assertEqual(block.evalSync(), value)
+		finally:
+			Block.compileExpressions = True
+
+	def test_ternaryConstantTest (self):
+		for number, expected in [("1", "yes"), ("0", "no")]:
+			ternary = self.block("logic_ternary")
+			self.connect(self.block("math_number", NUM = number), ternary, "IF")
+			self.connect(self.block("text", TEXT = "yes"), ternary, "THEN")
+			self.connect(self.block("text", TEXT = "no"), ternary, "ELSE")
+
+			self.assertCompiles(ternary, expected)
+
+	def test_ternaryNullTest (self):
+		ternary = self.block("logic_ternary")
+		self.connect(self.block("logic_null"), ternary, "IF")
+		self.connect(self.block("text", TEXT = "yes"), ternary, "THEN")
+
+		self.assertCompiles(ternary, None)
+
+	def test_operationConstantInputs (self):
+		for op, a, b, expected in [
+			("AND", "1", "2", True),
+			("AND", "0", "2", False),
+			("OR", "0", "0", False),
+			("OR", "3", "0", True)
+		]:
+			operation = self.block("logic_operation", OP = op)
+			self.connect(self.block("math_number", NUM = a), operation, "A")
+			self.connect(self.block("math_number", NUM = b), operation, "B")
+
+			self.assertCompiles(operation, expected)
+
+	def test_operationMissingInput (self):
+		# The missing input B defaults to False
+		operation = self.block("logic_operation", OP = "AND")
+		self.connect(self.block("logic_boolean", BOOL = "TRUE"), operation, "A")
+
+		self.assertCompiles(operation, False)
@@ -0,0 +1,79 @@
+# Twisted Imports
+from twisted.trial import unittest
+
+# Octopus Imports
+from octopus.data import Variable
+from octopus.constants import State
+
+# Package Imports
+from ..runtime.workspace import Workspace, populate_blocks
+
+populate_blocks()
+
+
+class DependentsTestCase (unittest.TestCase):
+	def setUp (self):
+		self.workspace = Workspace()
+		self._count = 0
+
+	def variable (self, name, type, value):
+		variable = Variable(type, value)
+		self.workspace.variables["global.global::" + name] = variable
+
+		return variable
+
+	def block (self, type, **fields):
+		self._count += 1
+		id = "b{:d}".format(self._count)
+		self.workspace.addBlock(id, type, fields)
+
+		return self.workspace.allBlocks[id]
+
+	def connect (self, block, parent, input, connection = "input-value"):
+		self.workspace.connectBlock(block.id, parent.id, connection, input)
+
+	def test_bindRestoresValue (self):
+		x = self.variable("x", float, 1.0)
+		out = self.variable("out", float, 0.0)
+
+		bind = self.block("controls_bind", VAR = "global.global::out")
+		self.connect(self.block("lexical_variable_get", VAR = "global.global::x"), bind, "VALUE")
+		bind.run()
+
+		self.assertEqual(out.value, 1.0)
+
+		# The bound value is put back, although it has not changed
+		out.set(5.0)
+		x.set(1.0)
+
+		self.assertEqual(out.value, 1.0)
+
+	def test_statemonitorTriggerBusy (self):
+		ok = self.variable("ok", bool, True)
+		release = self.variable("release", bool, False)
+
+		# TRIGGER keeps running until release is set
+		trigger = self.block("controls_wait_until")
+		self.connect(self.block("lexical_variable_get", VAR = "global.global::release"), trigger, "CONDITION")
+
+		monitor = self.block("controls_statemonitor")
+		monitor.cancel_on_reset = False
+		self.connect(self.block("lexical_variable_get", VAR = "global.global::ok"), monitor, "TEST0")
+		self.connect(trigger, monitor, "TRIGGER", "input-statement")
+		monitor.run()
+
+		ok.set(False)
+		self.assertTrue(monitor._triggered)
+
+		# Reset, then fail again whilst TRIGGER is still running
+		ok.set(True)
+		ok.set(False)
+		self.assertFalse(monitor._triggered)
+		self.assertIs(trigger.state, State.RUNNING)
+
+		release.set(True)
+		self.assertIs(trigger.state, State.COMPLETE)
+
+		# The inputs are still failing, so TRIGGER runs once it is free
+		ok.set(False)
+		self.assertTrue(monitor._triggered)
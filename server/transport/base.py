@@ -30,6 +30,45 @@ class BaseTransport (object):
 
 		raise NotImplementedError
 
+	def broadcast (self, protocol, topic, payload, contexts):
+		"""Send the same message to a number of users. Transports
+		should override this to encode the message only once.
+		@param [str] Name of the protocol
+		@param [str] Topic of the message
+		@param [dict] Message payload
+		@param [list] Message contexts, dependent on the transport
+		"""
+
+		for context in contexts:
+			self.send(protocol, topic, payload, context)
+
+	def sendBinary (self, data, context, push = False):
+		"""Send a binary message to the user. Only called for clients
+		which have enabled a capability that uses binary messages.
+		@param [bytes] Message data
+		@param [Object] Message context, dependent on the transport
+		@param [bool] Whether the message was not requested by the user
+		"""
+
+		raise NotImplementedError
+
+	def enableCapabilities (self, capabilities, context):
+		"""Enable optional capabilities requested by the client.
+		Returns the list of capabilities that were enabled.
+		@param [list] Names of the requested capabilities
+		@param [Object] Message context, dependent on the transport
+		"""
+
+		return []
+
+	def supports (self, capability, context):
+		"""Whether the client has enabled an optional capability.
+		@param [str] Name of the capability
+		@param [Object] Message context, dependent on the transport
+		"""
+
+		return False
+
 	def receive (self, protocol, topic, payload, context):
 		"""Handle incoming message
 		This is the entry-point to actual protocol handlers. When receiving
@@ -50,6 +89,10 @@ class BaseTransport (object):
 		except KeyError:
 			sketch = None
 
+		# Runtime actions
+		if protocol == 'runtime':
+			return self.runtimeProtocol.receive(topic, payload, context)
+
 		# Block actions
 		if protocol == 'block':
 			return self.blockProtocol.receive(topic, payload, sketch, context)
@@ -1,27 +1,34 @@
 # System Imports
 import functools
+import collections
 
 # Twisted Imports
 from twisted.python import log
 
 
 class EventEmitter (object):
+	""" Calls listener functions when named events are emitted.
+
+	The listeners for each event are kept in an insertion-ordered dict,
+	keyed by id() so that functions are compared by identity, and can
+	be added or removed in constant time. emit() calls a tuple of the
+	listeners, which is only rebuilt after they have changed; listeners
+	added or removed during an emit take effect from the next one. """
+
 	def on (self, name, function = None):
 		def _on (function):
 			try:
-				self._events[name]
+				listeners = self._events[name]
 			except (TypeError, AttributeError):
 				self._events = {}
-				self._events[name] = []
+				self._snapshots = {}
+				listeners = self._events[name] = {}
 			except KeyError:
-				self._events[name] = []
-
-			# Use is instead of in to avoid equality comparison
-			for f in self._events[name]:
-				if function is f:
-					return function
+				listeners = self._events[name] = {}
 
-			self._events[name].append(function)
+			if id(function) not in listeners:
+				listeners[id(function)] = function
+				self._snapshots.pop(name, None)
 
 			return function
 
@@ -46,60 +53,162 @@ class EventEmitter (object):
 
 	def off (self, name = None, function = None):
 		try:
-			self._events
+			events = self._events
 		except AttributeError:
 			return
 
 		# If no name is passed, remove all handlers
 		if name is None:
-			self._events.clear()
+			events.clear()
+			self._snapshots.clear()
 
 		# If no function is passed, remove all functions
 		elif function is None:
-			try:
-				self._events[name] = []
-			except KeyError:
-				pass
+			events.pop(name, None)
+			self._snapshots.pop(name, None)
 
 		# Remove handler [function] from [name]
 		else:
-			self._events[name].remove(function)
+			# Events with no listeners are removed, but removing a
+			# listener from one raises ValueError, as with list.remove.
+			listeners = events.get(name, {})
+			key = id(function)
+
+			# An equal function (e.g. a bound method accessed again)
+			# is removed, as with list.remove.
+			if key not in listeners:
+				for key, f in listeners.items():
+					if f == function:
+						break
+				else:
+					raise ValueError("Listener not found")
+
+			del listeners[key]
+			self._snapshots.pop(name, None)
+
+			if len(listeners) == 0:
+				del events[name]
 
 	def listeners (self, event):
 		try:
-			return self._events[event]
+			return list(self._events[event].values())
 		except (AttributeError, KeyError):
 			return []
 
-	def emit (self, _event, **data):
-		handled = False
+	def _snapshot (self, name):
+		try:
+			return self._snapshots[name]
+		except KeyError:
+			snapshot = self._snapshots[name] = tuple(self._events[name].values())
+			return snapshot
 
+	def emit (self, _event, **data):
 		try:
-			events = self._events[_event][:]
+			events = self._events
 		except AttributeError:
 			return False # No events defined yet
-		except KeyError:
-			pass
-		else:
-			handled |= bool(len(events))
 
-			for function in events:
+		handled = False
+
+		if _event in events:
+			handled = True
+
+			for function in self._snapshot(_event):
 				try:
 					function(data)
 				except:
 					log.err()
 
-		try:
-			events = self._events["all"][:]
-		except KeyError:
-			pass
-		else:
-			handled |= bool(len(events))
+		if "all" in events:
+			handled = True
 
-			for function in events:
+			for function in self._snapshot("all"):
 				try:
 					function(_event, data)
 				except:
 					log.err()
 
 		return handled
+
+
+class JSONFragment (object):
+	""" A value which has already been encoded as JSON. """
+
+	def __init__ (self, json):
+		self.json = json
+
+
+class LRUCache (object):
+	""" A least-recently-used cache with a budget on the total size
+	of its entries.
+
+	Keys are tuples whose first element is a group (e.g. an
+	experiment id), so that all of the entries for a group can
+	be invalidated together. The size of each entry is supplied
+	by the caller when it is set. """
+
+	def __init__ (self, maxSize):
+		self.maxSize = maxSize
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+
+		self._entries = collections.OrderedDict()
+		self._groups = {}
+
+	def get (self, key, default = None):
+		try:
+			value, size = self._entries[key]
+		except KeyError:
+			self.misses += 1
+			return default
+
+		self._entries.move_to_end(key)
+		self.hits += 1
+
+		return value
+
+	def set (self, key, value, size = 1):
+		self.remove(key)
+
+		if size > self.maxSize:
+			return
+
+		self._entries[key] = (value, size)
+		self._groups.setdefault(key[0], set()).add(key)
+		self.size += size
+
+		# Evict least recently used entries
+		while self.size > self.maxSize:
+			self.remove(next(iter(self._entries)))
+
+	def remove (self, key):
+		try:
+			value, size = self._entries.pop(key)
+		except KeyError:
+			return
+
+		self.size -= size
+
+		group = self._groups[key[0]]
+		group.discard(key)
+		if len(group) == 0:
+			del self._groups[key[0]]
+
+	def invalidate (self, group):
+		for key in list(self._groups.get(group, ())):
+			self.remove(key)
+
+	def clear (self):
+		self._entries.clear()
+		self._groups.clear()
+		self.size = 0
+
+	def stats (self):
+		return {
+			"entries": len(self._entries),
+			"size": self.size,
+			"maxSize": self.maxSize,
+			"hits": self.hits,
+			"misses": self.misses
+		}
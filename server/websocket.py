@@ -1,11 +1,46 @@
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory
 from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from autobahn.websocket.protocol import PreparedMessage
 from twisted.python import log
-from twisted.internet import reactor
+from twisted.internet import reactor, task, interfaces
+from zope.interface import implementer
 
 import json
+import collections
 
 from .transport.base import BaseTransport
+from .util import JSONFragment
+
+def _mergeStates (queued, payload):
+	states = collections.OrderedDict(
+		(item['block'], item) for item in queued['states'] + payload['states']
+	)
+
+	return dict(payload, states = list(states.values()))
+
+def _mergeProperties (queued, payload):
+	data = dict(queued['data'])
+	data.update(payload['data'])
+
+	return dict(payload, data = data)
+
+# Messages which a client that is not keeping up does not need to get
+# one by one. Queued block states and property values are merged with
+# newer ones. Stream data pushed to subscribers is discarded while the
+# queue is over budget; replies to requests for stream data are not.
+# All other messages (sketch edits, experiment state, logs) are always
+# queued.
+COALESCE = {
+	("block", "states"): _mergeStates,
+	("experiment", "properties"): _mergeProperties,
+}
+
+DROPPABLE = set([
+	("experiment", "streams"),
+])
+
+def _isPush (payload):
+	return isinstance(payload, dict) and payload.get('push', False) is True
 
 class WebSocketRuntime (BaseTransport):
 	def __init__ (self):
@@ -14,10 +49,13 @@ class WebSocketRuntime (BaseTransport):
 				'protocol:sketch',
 				'protocol:block',
 				'protocol:experiment',
+				'encoding:binary-streams',
 			]
 		})
 
-	def send (self, protocol, topic, payload, context):
+		self.connections = set()
+
+	def encode (self, protocol, topic, payload):
 		if isinstance(payload, Exception):
 			payload = {
 				"type": payload.__class__.__name__,
@@ -34,20 +72,209 @@ class WebSocketRuntime (BaseTransport):
 			log.err("Response Error: " + str(payload))
 		# log.msg("Response", response)
 
-		context.sendMessage(json.dumps(response).encode('utf-8'))
+		# Include already-encoded values in the payload as they are
+		if isinstance(payload, dict) and any(isinstance(value, JSONFragment) for value in payload.values()):
+			return (
+				'{"protocol": ' + json.dumps(protocol) +
+				', "command": ' + json.dumps(topic) +
+				', "payload": {' + ", ".join(
+					json.dumps(str(key)) + ": " + (value.json if isinstance(value, JSONFragment) else json.dumps(value))
+					for key, value in payload.items()
+				) + '}}'
+			).encode('utf-8')
+
+		return json.dumps(response).encode('utf-8')
+
+	def send (self, protocol, topic, payload, context):
+		context.queueMessage(
+			(protocol, topic),
+			payload,
+			self.encode(protocol, topic, payload),
+			push = _isPush(payload)
+		)
+
+	def broadcast (self, protocol, topic, payload, contexts):
+		# The message is encoded and framed once for all connections.
+		# Compression can't be shared, as each connection has its own
+		# deflate context, so autobahn compresses the prepared payload
+		# separately for connections using permessage-deflate.
+		message = contexts[0].factory.prepareMessage(self.encode(protocol, topic, payload))
+
+		for context in contexts:
+			context.queueMessage((protocol, topic), payload, message, push = _isPush(payload))
+
+	def sendBinary (self, data, context, push = False):
+		# Binary frames only carry stream data
+		context.queueMessage(("experiment", "streams"), None, data, isBinary = True, push = push)
 
+	def enableCapabilities (self, capabilities, context):
+		context.capabilities = set(
+			capability for capability in capabilities
+			if capability.startswith('encoding:')
+			and capability in self.options["capabilities"]
+		)
+
+		return sorted(context.capabilities)
+
+	def supports (self, capability, context):
+		return capability in context.capabilities
+
+	def clientMetrics (self):
+		""" Outbound queue metrics of each open connection. """
 
+		return {
+			connection.peer: connection.metrics()
+			for connection in self.connections
+		}
+
+
+@implementer(interfaces.IPushProducer)
 class OctopusEditorProtocol (WebSocketServerProtocol):
+	""" A websocket connection to an editor or experiment viewer.
+
+	The connection is registered as a producer with its transport, which
+	pauses it when the transport's write buffer is full. Messages sent
+	whilst it is paused are queued, and written out once the transport
+	has caught up. Once the queue holds more than highWatermark bytes
+	it is over budget: queued block states and properties are merged
+	with newer ones and pushed stream data is discarded, until the
+	queue has drained below lowWatermark. """
+
+	highWatermark = 1024 * 1024
+	lowWatermark = 256 * 1024
+
 	def onConnect (self, request):
 		return 'octopus'
 
 	def onOpen (self):
 		self.subscribedExperiments = {}
+		self.capabilities = set()
+
+		self._outbox = collections.deque()
+		self._coalescing = {}
+		self._paused = False
+		self._overBudget = False
+		self.queuedBytes = 0
+		self.maxQueuedBytes = 0
+		self.coalesced = 0
+		self.dropped = 0
+
+		self.transport.registerProducer(self, True)
+		self.factory.runtime.connections.add(self)
 		self.sendPing()
 
 	def onClose (self, wasClean, code, reason):
+		for subscription in getattr(self, 'subscribedExperiments', {}).values():
+			self._stopPush(subscription)
+
+		self.factory.runtime.connections.discard(self)
 		self.factory.runtime.disconnected(self)
 
+	#
+	# Outbound queue
+	#
+
+	def queueMessage (self, kind, payload, message, isBinary = False, push = False):
+		""" Send an encoded message (or a PreparedMessage), or queue it
+		if the transport is not accepting more data. kind is the
+		(protocol, command) of the message, and payload its unencoded
+		payload if it has one. push is True for messages which were not
+		requested by the client. """
+
+		if not self._paused and len(self._outbox) == 0:
+			return self._sendMessage(message, isBinary)
+
+		if kind in COALESCE and payload is not None:
+			key = kind + (payload.get('sketch'), payload.get('experiment'))
+			queued = self._coalescing.get(key)
+
+			if queued is not None:
+				queued['payload'] = COALESCE[kind](queued['payload'], payload)
+				message = self.factory.runtime.encode(kind[0], kind[1], queued['payload'])
+				self._resize(queued, len(message))
+				queued['message'] = message
+				self.coalesced += 1
+				return
+		elif kind in DROPPABLE and push and self._overBudget:
+			self.dropped += 1
+			return
+		else:
+			key = None
+
+		item = {
+			"key": key,
+			"payload": payload,
+			"message": message,
+			"binary": isBinary,
+			"size": 0
+		}
+
+		self._outbox.append(item)
+		self._resize(item, self._size(message))
+
+		if key is not None:
+			self._coalescing[key] = item
+
+	def isCongested (self):
+		""" Whether messages sent now would be queued. """
+
+		return self._paused or len(self._outbox) > 0
+
+	def metrics (self):
+		return {
+			"paused": self._paused,
+			"over_budget": self._overBudget,
+			"queued_messages": len(self._outbox),
+			"queued_bytes": self.queuedBytes,
+			"max_queued_bytes": self.maxQueuedBytes,
+			"coalesced": self.coalesced,
+			"dropped": self.dropped
+		}
+
+	def _size (self, message):
+		if isinstance(message, PreparedMessage):
+			return len(message.payloadHybi)
+
+		return len(message)
+
+	def _resize (self, item, size):
+		self.queuedBytes += size - item['size']
+		self.maxQueuedBytes = max(self.maxQueuedBytes, self.queuedBytes)
+		item['size'] = size
+
+		if self.queuedBytes > self.highWatermark:
+			self._overBudget = True
+		elif self.queuedBytes < self.lowWatermark:
+			self._overBudget = False
+
+	def _sendMessage (self, message, isBinary):
+		if isinstance(message, PreparedMessage):
+			self.sendPreparedMessage(message)
+		else:
+			self.sendMessage(message, isBinary)
+
+	def pauseProducing (self):
+		self._paused = True
+
+	def resumeProducing (self):
+		self._paused = False
+
+		# Sending may pause the connection again
+		while len(self._outbox) and not self._paused:
+			item = self._outbox.popleft()
+
+			if item['key'] is not None:
+				del self._coalescing[item['key']]
+
+			self._resize(item, 0)
+			self._sendMessage(item['message'], item['binary'])
+
+	def stopProducing (self):
+		self._paused = True
+		self._outbox.clear()
+		self._coalescing.clear()
+		self.queuedBytes = 0
+
 	def onMessage (self, payload, isBinary):
 		if isBinary:
 			raise ValueError("WebSocket message must be UTF-8")
@@ -64,12 +291,44 @@ class OctopusEditorProtocol (WebSocketServerProtocol):
 		)
 
 	def subscribeExperiment (self, experiment):
+		self.stopExperimentPush(experiment)
 		self.subscribedExperiments[experiment.id] = {
 			"experiment": experiment,
 			"streams": [],
-			"properties": []
+			"properties": [],
+			"push": None,
+			"sent": {},
+			"values": {}
 		}
 
+	def startExperimentPush (self, experiment, interval, push):
+		""" Call push every interval seconds, until stopExperimentPush
+		is called or the connection is closed. """
+
+		subscription = self.subscribedExperiments[experiment.id]
+		self._stopPush(subscription)
+
+		subscription['push'] = task.LoopingCall(push)
+		subscription['push'].start(interval).addErrback(log.err)
+
+	def stopExperimentPush (self, experiment):
+		try:
+			self._stopPush(self.subscribedExperiments[experiment.id])
+		except KeyError:
+			pass
+
+	def _stopPush (self, subscription):
+		if subscription['push'] is not None and subscription['push'].running:
+			subscription['push'].stop()
+
+		subscription['push'] = None
+
+	def getExperimentPushState (self, experiment):
+		""" The last point time sent for each stream, and the last value
+		sent for each property, in the current push subscription. """
+
+		return self.subscribedExperiments[experiment.id]
+
 	def chooseExperimentProperties (self, experiment, properties):
 		self.subscribedExperiments[experiment.id]['properties'] = properties
 